@@ -0,0 +1,230 @@
+# @file BuildFingerprint.py
+# This module fingerprints the inputs of a build so an unchanged build can be skipped.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+from MuPythonLibrary.Uefi.EdkII.Parsers.InfParser import InfParser
+from MuEnvironment.ParseCache import RecordingDscParser
+
+# ex: INF  RuleOverride = ACPITABLE  MdeModulePkg/Universal/Acpi/AcpiTableDxe/AcpiTableDxe.inf
+FDF_INF_EXP = re.compile(r"^INF\s.*?(\S+\.inf)\s*$", re.IGNORECASE)
+
+
+class BuildFingerprint(object):
+    '''
+    Fingerprint of the inputs to an edk2 build: the DSC and FDF with everything they include,
+    every INF they use with its sources and packages, and any other values (like the build
+    command line and tool versions) that are added.  Files that are named directly are hashed.
+    Module and package directories are compared by the size and modified time of every file
+    in them, which catches the headers an INF doesn't list.
+    '''
+    VERSION = 1
+
+    def __init__(self, ws, package_paths=[], input_vars={}):
+        self.Logger = logging.getLogger("BuildFingerprint")
+        self.ws = ws
+        self.PPs = package_paths
+        self.InputVars = input_vars
+        self.Values = {}
+        self.Files = set()
+        self.Trees = set()
+        self._Digest = None
+
+    def AddValue(self, name, value):
+        '''
+        Add a value to the fingerprint.  value must be JSON serializable.
+        '''
+        self.Values[name] = value
+        self._Digest = None
+
+    def AddFile(self, path):
+        self.Files.add(os.path.normpath(os.path.abspath(path)))
+        self._Digest = None
+
+    def AddTree(self, path):
+        self.Trees.add(os.path.normpath(os.path.abspath(path)))
+        self._Digest = None
+
+    def _FindFile(self, parser, path):
+        # like FindPath, but quietly returns None if the file doesn't exist
+        for root in [self.ws, parser.TargetFilePath] + [os.path.join(self.ws, pp) for pp in self.PPs]:
+            if root is not None and os.path.isfile(os.path.join(root, path)):
+                return os.path.join(root, path)
+        return None
+
+    def _ParseDscFile(self, file_path):
+        parser = RecordingDscParser().SetBaseAbsPath(self.ws).SetPackagePaths(
+            self.PPs).SetInputVars(dict(self.InputVars))
+        parser.ParseFile(file_path)
+        self.AddFile(file_path)
+        infs = set()
+        for (args, path) in parser.ResolvedPaths:
+            if args[-1].lower().endswith(".inf"):
+                infs.add(path)
+            else:
+                # !include
+                self.AddFile(path)
+        return (parser, infs)
+
+    def AddPlatform(self, dsc_path, fdf_path=None):
+        '''
+        Add the platform DSC, the FDF (if there is one) and all the modules they use.
+        '''
+        (dscp, infs) = self._ParseDscFile(dsc_path)
+        for inf in dscp.GetMods() + dscp.OtherMods + dscp.GetLibs():
+            path = self._FindFile(dscp, inf)
+            if path is not None:
+                infs.add(path)
+
+        if fdf_path is not None:
+            (fdfp, fdf_infs) = self._ParseDscFile(fdf_path)
+            infs.update(fdf_infs)
+            for line in fdfp.Lines:
+                match = FDF_INF_EXP.match(line.strip())
+                if match is not None:
+                    path = self._FindFile(fdfp, match.group(1))
+                    if path is not None:
+                        infs.add(path)
+                    continue
+                # other files put in the flash (like FILE or SECTION lines)
+                for token in line.replace("=", " ").split():
+                    if "." in token and ("/" in token or "\\" in token):
+                        path = self._FindFile(fdfp, token)
+                        if path is not None:
+                            self.AddFile(path)
+
+        for inf in sorted(infs):
+            self.AddModule(inf)
+
+    def AddModule(self, inf_path):
+        '''
+        Add a module INF, its directory, its sources and the packages it uses.
+        '''
+        self.AddFile(inf_path)
+        self.AddTree(os.path.dirname(inf_path))
+        parser = InfParser().SetBaseAbsPath(self.ws).SetPackagePaths(self.PPs)
+        parser.ParseFile(inf_path)
+        for source in parser.Sources:
+            self.AddFile(os.path.join(os.path.dirname(inf_path), source))
+        for dec in parser.PackagesUsed:
+            path = self._FindFile(parser, dec)
+            if path is not None:
+                self.AddFile(path)
+                self.AddTree(os.path.dirname(path))
+
+    @staticmethod
+    def _HashFile(path):
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except (OSError, IOError):
+            return None
+
+    @staticmethod
+    def _HashTree(path):
+        sha = hashlib.sha256()
+        for (root, dirs, files) in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != ".git")
+            for name in sorted(files):
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                sha.update("{0}|{1}|{2}\n".format(
+                    os.path.relpath(os.path.join(root, name), path), st.st_mtime_ns, st.st_size).encode('utf-8'))
+        return sha.hexdigest()
+
+    def _GetTrees(self):
+        # trees inside another tree are already covered
+        trees = []
+        for tree in sorted(self.Trees):
+            if not trees or os.path.commonpath([trees[-1], tree]) != trees[-1]:
+                trees.append(tree)
+        return trees
+
+    def GetDigest(self):
+        if self._Digest is None:
+            data = {
+                'version': self.VERSION,
+                'values': self.Values,
+                'files': {path: self._HashFile(path) for path in sorted(self.Files)},
+                'trees': {path: self._HashTree(path) for path in self._GetTrees()}
+            }
+            self._Digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+        return self._Digest
+
+    def Matches(self, record_path):
+        '''
+        Check if record_path was saved for a build with the same inputs and all of its outputs are still there.
+        '''
+        try:
+            with open(record_path, 'r') as f:
+                record = json.load(f)
+        except (OSError, IOError, ValueError):
+            return False
+
+        try:
+            if record['digest'] != self.GetDigest():
+                self.Logger.debug("Build inputs changed since %s.", record_path)
+                return False
+            for path in record['outputs']:
+                if not os.path.exists(path):
+                    self.Logger.debug("Build output %s is missing.", path)
+                    return False
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def Save(self, record_path, outputs=[]):
+        '''
+        Record a successful build with these inputs that made outputs.
+
+        return True if the record was written.
+        '''
+        record = {'digest': self.GetDigest(), 'outputs': list(outputs)}
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(record_path), exist_ok=True)
+            # Write to a temp file first so a reader never sees a partial record.
+            (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(record_path), prefix=".fingerprint_")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(temp_path, record_path)
+        except (OSError, IOError) as e:
+            self.Logger.debug("Unable to save build fingerprint %s: %s", record_path, e)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        return True
+
+    @staticmethod
+    def Remove(record_path):
+        if os.path.isfile(record_path):
+            os.remove(record_path)
@@ -0,0 +1,155 @@
+# @file BuildThreads.py
+# Picks the number of build threads from the cpus and memory the build can use.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+import os
+import math
+import logging
+
+# memory one edk2 build thread (a compiler job) is expected to need
+DEFAULT_MEMORY_PER_THREAD_MB = 1024
+
+
+def GetCpuCount():
+    """
+    Returns (cpus in the system, cpus this process is allowed to run on).
+    """
+    cpus = os.cpu_count() or 1
+    try:
+        allowed = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # not available on Windows or macOS
+        allowed = cpus
+    return (cpus, allowed)
+
+
+def _ReadFile(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except (OSError, IOError):
+        return None
+
+
+def GetCgroupCpuLimit(cgroup_root="/sys/fs/cgroup"):
+    """
+    Returns the number of cpus the cgroup quota allows (can be a fraction) or None if there is no quota.
+    """
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _ReadFile(os.path.join(cgroup_root, "cpu.max"))
+    if cpu_max is not None:
+        (quota, period) = (cpu_max.split() + [None])[:2]
+        if quota != "max" and quota is not None and period is not None:
+            return int(quota) / int(period)
+        return None
+
+    # cgroup v1
+    quota = _ReadFile(os.path.join(cgroup_root, "cpu", "cpu.cfs_quota_us"))
+    period = _ReadFile(os.path.join(cgroup_root, "cpu", "cpu.cfs_period_us"))
+    if quota is not None and period is not None and int(quota) > 0 and int(period) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def GetCgroupMemoryAvailable(cgroup_root="/sys/fs/cgroup"):
+    """
+    Returns the bytes left under the cgroup memory limit or None if there is no limit.
+    """
+    for (limit_file, usage_file) in (("memory.max", "memory.current"),
+                                     (os.path.join("memory", "memory.limit_in_bytes"),
+                                      os.path.join("memory", "memory.usage_in_bytes"))):
+        limit = _ReadFile(os.path.join(cgroup_root, limit_file))
+        if limit is None:
+            continue
+        usage = _ReadFile(os.path.join(cgroup_root, usage_file)) or "0"
+        # v1 reports a huge number when there is no limit
+        if not limit.isdigit() or int(limit) >= (1 << 60):
+            return None
+        return max(0, int(limit) - int(usage))
+    return None
+
+
+def GetMemoryAvailable(meminfo="/proc/meminfo"):
+    """
+    Returns the bytes of memory available for new processes or None if it can't be found.
+    """
+    # Linux
+    info = _ReadFile(meminfo)
+    if info is not None:
+        for line in info.splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+
+    # Windows
+    if os.name == 'nt':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+
+    # other POSIX systems
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def GetAutoThreadCount(memory_per_thread_mb=DEFAULT_MEMORY_PER_THREAD_MB, cgroup_root="/sys/fs/cgroup",
+                       meminfo="/proc/meminfo"):
+    """
+    Pick a build thread count that fits the cpus and memory this process can use.
+
+    Returns (thread count, dictionary of what it was based on).
+    """
+    (cpus, allowed) = GetCpuCount()
+    quota = GetCgroupCpuLimit(cgroup_root)
+    available = GetMemoryAvailable(meminfo)
+    cgroup_available = GetCgroupMemoryAvailable(cgroup_root)
+    if available is None or (cgroup_available is not None and cgroup_available < available):
+        available = cgroup_available
+
+    count = allowed
+    if quota is not None:
+        count = min(count, max(1, math.ceil(quota)))
+    if available is not None:
+        count = min(count, max(1, available // (memory_per_thread_mb * 1024 * 1024)))
+
+    inputs = {
+        "cpu_count": cpus,
+        "cpu_affinity": allowed,
+        "cgroup_cpu_limit": quota,
+        "memory_available_mb": available // (1024 * 1024) if available is not None else None,
+        "memory_per_thread_mb": memory_per_thread_mb
+    }
+    logging.debug("Picked %d build threads from %s", count, inputs)
+    return (int(count), inputs)
@@ -0,0 +1,131 @@
+# @file BuildTrace.py
+# Records the time spent in each phase of a build.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+BUILD_TRACE = None
+
+
+class BuildTrace(object):
+    '''
+    Collects how long each phase of the build takes.  The result can be written as a
+    Chrome trace-event file (load it in chrome://tracing or https://ui.perfetto.dev)
+    and summarized in the build log.
+    '''
+
+    def __init__(self):
+        super(BuildTrace, self).__init__()
+        self.Events = []
+        self._Lock = threading.Lock()
+        self._Origin = time.perf_counter()
+        self._logger = logging.getLogger("BuildTrace")
+
+    @contextlib.contextmanager
+    def Span(self, name, category="build", **args):
+        """
+        Time the code in a with block.
+
+        name -- The name of what is being timed (like a build phase or plugin).
+        category -- The kind of thing being timed.  Used to group spans.
+        args -- Any other information to record with the span.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.AddSpan(name, category, start, time.perf_counter(), **args)
+
+    def AddSpan(self, name, category, start, end, **args):
+        """
+        Record a span that has already been timed.  start and end come from time.perf_counter().
+        """
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self._Origin) * 1000000),
+            "dur": round((end - start) * 1000000),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args
+        }
+        with self._Lock:
+            self.Events.append(event)
+        self._logger.debug("%s %s took %.3fs", category, name, end - start)
+
+    def GetChromeTrace(self):
+        """
+        Returns the spans in Chrome trace-event format.
+        """
+        with self._Lock:
+            events = sorted(self.Events, key=lambda e: (e["ts"], -e["dur"]))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def WriteChromeTrace(self, filepath):
+        """
+        Write the spans to filepath in Chrome trace-event format.
+        """
+        with open(filepath, "w") as f:
+            json.dump(self.GetChromeTrace(), f)
+
+    def GetSummary(self):
+        """
+        Returns a list of (category, name, total seconds, count) in the order each was first started.
+        Spans with the same category and name are added together.
+        """
+        summary = {}
+        for event in self.GetChromeTrace()["traceEvents"]:
+            key = (event["cat"], event["name"])
+            (total, count) = summary.get(key, (0, 0))
+            summary[key] = (total + event["dur"], count + 1)
+        return [(cat, name, total / 1000000.0, count) for ((cat, name), (total, count)) in summary.items()]
+
+    def LogSummary(self, level=logging.INFO):
+        """
+        Log a table of the summary.  The markdown log picks this up at the default level.
+        """
+        logging.log(level, "| Category | Name | Time (s) | Count |")
+        logging.log(level, "| --- | --- | ---: | ---: |")
+        for (cat, name, seconds, count) in self.GetSummary():
+            logging.log(level, "| %s | %s | %.3f | %d |", cat, name, seconds, count)
+
+
+def GetBuildTrace():
+    """
+    Returns a singleton instance of this class for global use.
+    """
+    global BUILD_TRACE
+
+    if BUILD_TRACE is None:
+        logging.debug("Setting up build trace")
+        BUILD_TRACE = BuildTrace()
+
+    return BUILD_TRACE
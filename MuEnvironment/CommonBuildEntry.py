@@ -38,6 +38,7 @@ from MuEnvironment import SelfDescribingEnvironment
 from MuEnvironment import MuLogging
 from MuEnvironment import PluginManager
 from MuEnvironment import VersionAggregator
+from MuEnvironment import BuildTrace
 from MuPythonLibrary.UtilityFunctions import RunCmd
 
 try:
@@ -98,7 +99,7 @@ def cmd_with_output(cmd_string, cwd):
 # necessary to get this process off the ground.
 
 
-def minimum_env_init(my_workspace_path, my_project_scope):
+def minimum_env_init(my_workspace_path, my_project_scope, snapshot_path=None):
     # TODO: Check the Git version against minimums.
 
     # Check the Python version against minimums.
@@ -126,6 +127,14 @@ def minimum_env_init(my_workspace_path, my_project_scope):
     if version_compare(min_git, cur_git) > 0:
         raise RuntimeError("Please upgrade Git! Current version is %s. Minimum is %s." % (cur_git, min_git))
 
+    # If nothing has changed since the last build, use the environment it saved.
+    if snapshot_path is not None:
+        env_state = SelfDescribingEnvironment.LoadEnvironmentSnapshot(my_workspace_path, my_project_scope,
+                                                                      snapshot_path)
+        if env_state is not None:
+            logging.info("Environment restored from snapshot: " + snapshot_path)
+            return env_state
+
     # Initialized the build environment.
     return SelfDescribingEnvironment.BootstrapEnvironment(my_workspace_path, my_project_scope)
 
@@ -304,20 +313,26 @@ def build_process(my_workspace_path, my_project_scope, my_module_pkg_paths, work
     #
     # Next, get the environment set up.
     #
-    try:
-        (build_env, shell_env) = minimum_env_init(
-            my_workspace_path, my_project_scope)
-        if not SelfDescribingEnvironment.VerifyEnvironment(my_workspace_path, my_project_scope):
-            raise RuntimeError("Validation failed.")
-    except Exception:
-        raise RuntimeError(
-            "Environment is not in a state to build! Please run '--UPDATE'.")
+    trace = BuildTrace.GetBuildTrace()
+    snapshot_path = os.path.join(log_directory, SelfDescribingEnvironment.ENV_SNAPSHOT_FILENAME)
+    with trace.Span("Environment", "Setup"):
+        try:
+            (build_env, shell_env) = minimum_env_init(
+                my_workspace_path, my_project_scope, snapshot_path)
+            if not SelfDescribingEnvironment.VerifyEnvironment(my_workspace_path, my_project_scope):
+                raise RuntimeError("Validation failed.")
+        except Exception:
+            raise RuntimeError(
+                "Environment is not in a state to build! Please run '--UPDATE'.")
+        SelfDescribingEnvironment.SaveEnvironmentSnapshot(snapshot_path)
 
     # Load plugins
     logging.log(MuLogging.SECTION, "Loading Plugins")
     pluginManager = PluginManager.PluginManager()
-    failedPlugins = pluginManager.SetListOfEnvironmentDescriptors(
-        build_env.plugins)
+    with trace.Span("Load Plugins", "Setup"):
+        # other kinds of plugins (like IMuBuildPlugin) aren't imported unless they're asked for
+        failedPlugins = pluginManager.SetListOfEnvironmentDescriptors(
+            build_env.plugins, [PluginManager.IUefiBuildPlugin, PluginManager.IUefiHelperPlugin])
     if failedPlugins:
         logging.critical("One or more plugins failed to load. Halting build.")
         for a in failedPlugins:
@@ -349,6 +364,13 @@ def build_process(my_workspace_path, my_project_scope, my_module_pkg_paths, work
     # always output the location of the log file
     MuLogging.log_progress("Log file at " + logfile)
 
+    # timing for each phase goes in the markdown log and in a trace next to the log file
+    tracefile = os.path.join(log_directory, "BUILDLOG_TRACE.json")
+    trace.WriteChromeTrace(tracefile)
+    logging.log(MuLogging.SUB_SECTION, "Build Timing")
+    trace.LogSummary()
+    MuLogging.log_progress("Build trace at " + tracefile)
+
     # get all vars needed as we can't do any logging after shutdown otherwise our log is cleared.
     # Log viewer
     ep = PB.env.GetValue("LaunchBuildLogProgram")
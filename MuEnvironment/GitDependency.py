@@ -42,6 +42,7 @@ class GitDependency(ExternalDependency):
     - source:  url for git clone
     - version: commit from git repo
     - url_creds_var: shell_var name for credential updating [optional]
+    - sparse_checkout: list of folders to check out instead of the whole tree [optional]
     '''
 
     TypeString = "git"
@@ -71,8 +72,18 @@ class GitDependency(ExternalDependency):
         self._local_repo_root_path = os.path.join(os.path.abspath(self.contents_dir), self.name)
         self.logger = logging.getLogger("git-dependency")
 
-        # valid_attributes = ["Path", "Url", "Branch", "Commit", "ReferencePath", "Full"]
+        # sparse checkout cone paths are compared against git's normalized, sorted list,
+        # which leaves out paths inside of other paths
+        self.sparse_checkout = None
+        sparse_checkout = descriptor.get('sparse_checkout', None)
+        if sparse_checkout:
+            paths = set(x.replace("\\", "/").strip("/") for x in sparse_checkout)
+            self.sparse_checkout = sorted(p for p in paths if not any(p.startswith(q + "/") for q in paths))
+
+        # valid_attributes = ["Path", "Url", "Branch", "Commit", "ReferencePath", "Full", "Worktree", "Sparse"]
         self._repo_resolver_dep_obj = {"Path": self.name, "Url": self.repo_url, "Commit": self.commit}
+        if self.sparse_checkout is not None:
+            self._repo_resolver_dep_obj["Sparse"] = self.sparse_checkout
 
     def fetch(self):
 
@@ -118,6 +129,10 @@ class GitDependency(ExternalDependency):
                 self.logger.error(f"Git Dependency: head is {r.head.commit} and version is {self.version}")
                 result = False
 
+            if result and r.get_sparse_checkout() != self.sparse_checkout:
+                self.logger.error("Git Dependency: sparse checkout doesn't match {0}".format(self.sparse_checkout))
+                result = False
+
         self.logger.debug("Verify '%s' returning '%s'." % (self.name, result))
         if(logversion):
             VersionAggregator.GetVersionAggregator().ReportVersion(self.name, self.version,
@@ -29,6 +29,7 @@
 import os
 import logging
 from MuPythonLibrary.UtilityFunctions import RunCmd
+from MuEnvironment.OmniCacheLock import OmniCacheLock
 
 try:
     from io import StringIO
@@ -69,6 +70,7 @@ class Repo(object):
         self.dirty = False  # if there are changes
         self.head = None  # the head commit that this repo is at
         self.submodules = None  # List of submodule paths
+        self.worktree = False  # if this is a linked worktree of another repo
         self._update_from_git()
         self._logger = logging.getLogger("git.repo")
 
@@ -81,6 +83,7 @@ class Repo(object):
                 self.active_branch = self._get_branch()
                 self.remotes = self._get_remotes()
                 self.head = self._get_head()
+                self.worktree = self._get_worktree()
                 self.dirty = self._get_dirty()
                 self.url = self._get_url()
                 self.bare = self._get_bare()
@@ -141,6 +144,11 @@ class Repo(object):
         if len(p1) > 0:
             return True
 
+        if self.worktree:
+            # a worktree is always on a detached HEAD and the branches belong to the
+            # mirror it was added from (a bare mirror has no remote tracking refs)
+            return False
+
         return_buffer = StringIO()
         params = "log --branches --not --remotes --decorate --oneline"
 
@@ -189,7 +197,26 @@ class Repo(object):
             return False
 
     def _get_initalized(self):
-        return os.path.isdir(os.path.join(self._path, ".git"))
+        # linked worktrees and submodules have a .git file instead of a folder
+        return os.path.exists(os.path.join(self._path, ".git"))
+
+    def _get_worktree(self):
+        # a linked worktree has a .git file pointing at a gitdir that contains a commondir file
+        dot_git = os.path.join(self._path, ".git")
+        if not os.path.isfile(dot_git):
+            return False
+        with open(dot_git, "r") as f:
+            content = f.read().strip()
+        if not content.startswith("gitdir:"):
+            return False
+        gitdir = content[len("gitdir:"):].strip()
+        if not os.path.isabs(gitdir):
+            gitdir = os.path.join(self._path, gitdir)
+        return os.path.isfile(os.path.join(gitdir, "commondir"))
+
+    def has_commit(self, commit):
+        params = "cat-file -e {0}^{{commit}}".format(commit)
+        return RunCmd("git", params, workingdir=self._path, logging_level=logging.DEBUG) == 0
 
     def submodule(self, command, *args):
         self._logger.debug(
@@ -208,10 +235,14 @@ class Repo(object):
 
         return True
 
-    def fetch(self):
+    def fetch(self, remote=None, refspec=None):
         return_buffer = StringIO()
 
         params = "fetch"
+        if remote is not None:
+            params += " " + remote
+            if refspec is not None:
+                params += " " + refspec
 
         ret = RunCmd("git", params, workingdir=self._path,
                      outstream=return_buffer)
@@ -254,20 +285,82 @@ class Repo(object):
 
         return True
 
+    def sparse_checkout(self, paths):
+        '''
+        Limit the working tree to the given cone mode paths
+        '''
+        self._logger.debug("Setting sparse checkout of {0} to {1}".format(self._path, paths))
+        return_buffer = StringIO()
+        ret = RunCmd("git", "sparse-checkout init --cone", workingdir=self._path, outstream=return_buffer)
+        if ret == 0:
+            params = "sparse-checkout set {0}".format(" ".join(paths))
+            ret = RunCmd("git", params, workingdir=self._path, outstream=return_buffer)
+
+        p1 = return_buffer.getvalue().strip()
+        return_buffer.close()
+        if ret != 0:
+            self._logger.error(p1)
+            return False
+
+        return True
+
+    def sparse_checkout_disable(self):
+        '''
+        Check out the whole tree again
+        '''
+        self._logger.debug("Disabling sparse checkout of {0}".format(self._path))
+        return_buffer = StringIO()
+        ret = RunCmd("git", "sparse-checkout disable", workingdir=self._path, outstream=return_buffer)
+        p1 = return_buffer.getvalue().strip()
+        return_buffer.close()
+        if ret != 0:
+            self._logger.error(p1)
+            return False
+
+        return True
+
+    def get_sparse_checkout(self):
+        '''
+        returns the list of sparse checkout paths or None if the whole tree is checked out
+        '''
+        return_buffer = StringIO()
+        params = "config --get core.sparseCheckout"
+        RunCmd("git", params, workingdir=self._path, outstream=return_buffer)
+        p1 = return_buffer.getvalue().strip()
+        return_buffer.close()
+        if p1.lower() != "true":
+            return None
+
+        return_buffer = StringIO()
+        params = "sparse-checkout list"
+        RunCmd("git", params, workingdir=self._path, outstream=return_buffer)
+        p1 = return_buffer.getvalue().strip()
+        return_buffer.close()
+        return [x.strip() for x in p1.split("\n") if len(x.strip()) > 0]
+
     @classmethod
-    def clone_from(self, url, to_path, progress=None, env=None, shallow=False, reference=None, **kwargs):
+    def clone_from(self, url, to_path, progress=None, env=None, shallow=False, reference=None, sparse=None,
+                   serve_url=None, **kwargs):
         _logger = logging.getLogger("git.repo")
         _logger.debug("Cloning {0} into {1}".format(url, to_path))
         # make sure we get the commit if
         # use run command from utilities
         cmd = "git"
-        params = ["clone"]
+        params = []
+        if serve_url:
+            # objects come from serve_url but the origin remote is still url
+            _logger.debug("Cloning {0} thru {1}".format(url, serve_url))
+            params.append("-c url.{0}.insteadOf={1}".format(serve_url, url))
+        params.append("clone")
         if shallow:
             params.append("--shallow-submodules")
         if reference:
             params.append("--reference %s" % reference)
-        else:
+        elif not sparse:
             params.append("--recurse-submodules")  # if we don't have a reference we can just recurse the submodules
+        if sparse:
+            # partial clone so only the blobs inside the sparse paths are ever downloaded
+            params.append("--filter=blob:none --no-checkout")
         params.append(url)
         params.append(to_path)
 
@@ -280,6 +373,13 @@ class Repo(object):
             logging.error("ERROR CLONING ")
             return None
 
+        if sparse:
+            # files are populated by the checkout that follows
+            if not Repo(to_path).sparse_checkout(sparse):
+                logging.error("ERROR SETTING SPARSE CHECKOUT")
+                return None
+            return Repo(to_path)
+
         # if we have a reference path we must init the submodules
         if reference:
             params = ["submodule", "update", "--init", "--recursive"]
@@ -288,3 +388,47 @@ class Repo(object):
             ret = RunCmd(cmd, param_string)
 
         return Repo(to_path)
+
+    @classmethod
+    def worktree_from(self, url, to_path, mirror, commit):
+        '''
+        Materialize commit of url as a linked worktree of the bare mirror repo.
+        Objects are fetched into the mirror so they are shared by every worktree.
+        The worktree gets its own origin remote and is always on a detached HEAD
+        since a branch can only be checked out by one worktree of a repo.
+        '''
+        _logger = logging.getLogger("git.repo")
+        _logger.debug("Adding worktree of {0} at {1} from {2}".format(url, to_path, mirror))
+        cmd = "git"
+
+        # forget about worktrees whose folders have been deleted
+        RunCmd(cmd, "worktree prune", workingdir=mirror)
+
+        # only go to the network if the mirror doesn't already have the commit
+        if RunCmd(cmd, "cat-file -e {0}^{{commit}}".format(commit), workingdir=mirror) != 0:
+            ret = RunCmd(cmd, "fetch --no-tags {0} {1}".format(url, commit), workingdir=mirror)
+            if ret != 0:
+                _logger.error("Failed to fetch {0} from {1} into {2}".format(commit, url, mirror))
+                return None
+
+        # per worktree config lets each worktree have an origin and not be bare
+        return_buffer = StringIO()
+        RunCmd(cmd, "config --get extensions.worktreeConfig", workingdir=mirror, outstream=return_buffer)
+        if return_buffer.getvalue().strip().lower() != "true":
+            # the mirror is usually a shared omnicache
+            with OmniCacheLock(mirror):
+                RunCmd(cmd, "config extensions.worktreeConfig true", workingdir=mirror)
+        return_buffer.close()
+        ret = RunCmd(cmd, "worktree add --detach {0} {1}".format(to_path, commit), workingdir=mirror)
+        if ret != 0:
+            logging.error("ERROR ADDING WORKTREE")
+            return None
+
+        RunCmd(cmd, "config --worktree core.bare false", workingdir=to_path)
+        RunCmd(cmd, "config --worktree remote.origin.url {0}".format(url), workingdir=to_path)
+
+        params = ["submodule", "update", "--init", "--recursive"]
+        params.append("--reference %s" % mirror)
+        RunCmd(cmd, " ".join(params), workingdir=to_path)
+
+        return Repo(to_path)
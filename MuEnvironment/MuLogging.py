@@ -232,6 +232,47 @@ def remove_output_stream(handler, logging_namespace=''):
     else:
         logger.removeHandler(handler)
 
+
+# one expression for every kind of compiler problem. the name of the group that matched is the kind.
+_COMPILER_PROBLEM_EXP = re.compile(r"(?:error (?:C(?P<compile>\d+)|LNK(?P<linker>\d+)|F(?P<edk2>\d+)|(?P<buildpy>\d+)E)"
+                                   r"|warning C(?P<warning>\d+)):")
+# the order problems on the same line are reported in
+_COMPILER_PROBLEM_KINDS = (("compile", logging.ERROR, "Compile: Error: {0}"),
+                           ("warning", logging.WARNING, "Compile: Warning: {0}"),
+                           ("linker", logging.ERROR, "Linker: Error: {0}"),
+                           ("edk2", logging.ERROR, "EDK2: Error: {0}"),
+                           ("buildpy", logging.ERROR, "Build.py: Error: {0}"))
+
+
+def _add_compiler_problems(line, kinds, problems):
+    line = line.strip()
+    for kind, level, message in _COMPILER_PROBLEM_KINDS:
+        if kind in kinds:
+            problems.append((level, message.format(line)))
+
+
+def _scan_compiler_text(text, problems):
+    # search the whole block at once and only find the lines that have a match,
+    # since most of the output has no problems. every match starts with one of these
+    # and checking for them is much faster than the expression.
+    if "error " not in text and "warning " not in text:
+        return
+    line_start = line_end = -1
+    kinds = set()
+    for match in _COMPILER_PROBLEM_EXP.finditer(text):
+        if match.start() > line_end:
+            if kinds:
+                _add_compiler_problems(text[line_start:line_end], kinds, problems)
+            line_start = text.rfind("\n", 0, match.start()) + 1
+            line_end = text.find("\n", match.end())
+            if line_end < 0:
+                line_end = len(text)
+            kinds = set()
+        kinds.add(match.lastgroup)
+    if kinds:
+        _add_compiler_problems(text[line_start:line_end], kinds, problems)
+
+
 # TODO: how to merge this into mu_build since this is copy and pasted
 
 
@@ -239,31 +280,42 @@ def scan_compiler_output(output_stream):
     # seek to the start of the output stream
     problems = []
     output_stream.seek(0, 0)
-    error_exp = re.compile(r"error C(\d+):")
-    edk2_error_exp = re.compile(r"error F(\d+):")
-    buildpy_error_exp = re.compile(r"error (\d+)E:")
-    linker_error_exp = re.compile(r"error LNK(\d+):")
-    warning_exp = re.compile(r"warning C(\d+):")
-    for raw_line in output_stream.readlines():
-        line = raw_line.strip("\n").strip()
-        match = error_exp.search(line)
-        if match is not None:
-            problems.append((logging.ERROR, "Compile: Error: {0}".format(line)))
-        match = warning_exp.search(line)
-        if match is not None:
-            problems.append((logging.WARNING, "Compile: Warning: {0}".format(line)))
-        match = linker_error_exp.search(line)
-        if match is not None:
-            problems.append((logging.ERROR, "Linker: Error: {0}".format(line)))
-        match = edk2_error_exp.search(line)
-        if match is not None:
-            problems.append((logging.ERROR, "EDK2: Error: {0}".format(line)))
-        match = buildpy_error_exp.search(line)
-        if match is not None:
-            problems.append((logging.ERROR, "Build.py: Error: {0}".format(line)))
+    # read in chunks so we don't make a second copy of the whole output
+    for lines in iter(lambda: output_stream.readlines(1 << 20), []):
+        _scan_compiler_text("".join(lines), problems)
     return problems
 
 
+class CompilerOutputHandler(logging.Handler):
+    '''
+    A handler that looks for compiler problems as the output is logged.
+    Only the problems are kept, so memory doesn't grow with the size of the output.
+    '''
+
+    def __init__(self, level=logging.INFO):
+        logging.Handler.__init__(self, level)
+        self.problems = []
+
+    def emit(self, record):
+        try:
+            _scan_compiler_text(record.getMessage(), self.problems)
+        except Exception:
+            self.handleError(record)
+
+    def get_problems(self):
+        # a copy so it can be read while the build is still logging
+        with self.lock:
+            return list(self.problems)
+
+
+def create_compiler_output_handler(level=logging.INFO, logging_namespace=''):
+    # creates a handler that collects compiler problems as they are logged
+    handler = CompilerOutputHandler(level)
+    logger = logging.getLogger(logging_namespace)
+    logger.addHandler(handler)
+    return handler
+
+
 class MuLogFilter(logging.Filter):
     _allowedLoggers = ["root"]
 
@@ -0,0 +1,90 @@
+# @file OmniCacheLock.py
+# Inter-process lock of an omnicache shared by the Omnicache tool and MuGit.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+import os
+import time
+import logging
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+OMNICACHE_LOCK_FILENAME = "omnicache.lock"
+
+
+class OmniCacheLock():
+    '''
+    Inter-process lock of an omnicache.
+
+    Hold it while changing the omnicache config, ref state, git remotes or serve
+    views and reload the config after taking it.  Fetches don't need the lock so
+    many processes can update a shared omnicache at the same time.  The lock is
+    not reentrant.
+    '''
+
+    def __init__(self, cache_dir, timeout=None):
+        self.lockfile = os.path.join(cache_dir, OMNICACHE_LOCK_FILENAME)
+        self.timeout = timeout
+        self._fd = None
+
+    def acquire(self):
+        start = time.time()
+        fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o666)
+        while True:
+            try:
+                if msvcrt is not None:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if self.timeout is not None and (time.time() - start) >= self.timeout:
+                    os.close(fd)
+                    raise Exception("Timed out waiting for Omnicache lock {0}".format(self.lockfile))
+                time.sleep(0.05)
+        logging.debug("Acquired Omnicache lock {0}".format(self.lockfile))
+        self._fd = fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        if msvcrt is not None:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        logging.debug("Released Omnicache lock {0}".format(self.lockfile))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
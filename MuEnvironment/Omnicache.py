@@ -1,17 +1,66 @@
 import os
+import re
 import sys
+import stat
+import time
+import shutil
 import logging
 import argparse
 import datetime
+import hashlib
+import pathlib
+import tempfile
+import subprocess
 import yaml
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 try:
     from io import StringIO
 except ImportError:
     from StringIO import StringIO
 
 from MuEnvironment import MuLogging
+from MuEnvironment.OmniCacheLock import OmniCacheLock
 from MuPythonLibrary import UtilityFunctions
-from MuEnvironment import MuGit
+
+
+def SaveYaml(filepath, data):
+    '''
+    save data as yaml by writing a temp file next to filepath and renaming it
+    over filepath so readers never see a partially written file
+    '''
+    (fd, temppath) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)),
+                                      prefix=os.path.basename(filepath) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as outfile:
+            yaml.dump(data, outfile, default_flow_style=False)
+        # mkstemp files are private to the user.  Keep the mode of the file being replaced.
+        if os.path.isfile(filepath):
+            os.chmod(temppath, stat.S_IMODE(os.stat(filepath).st_mode))
+        else:
+            os.chmod(temppath, 0o644)
+        os.replace(temppath, filepath)
+    except Exception:
+        if os.path.exists(temppath):
+            os.remove(temppath)
+        raise
+
+
+def NormalizeUrl(url):
+    '''
+    normalize a url so that urls for the same repo compare equal.
+    Whitespace, trailing slashes and a trailing .git are removed and
+    the scheme and host are lower case.
+    '''
+    url = url.strip().rstrip("/")
+    if url.endswith(".git"):
+        url = url[:-len(".git")].rstrip("/")
+    parts = url.split("://", 1)
+    if len(parts) == 2:
+        (scheme, rest) = parts
+        (host, sep, path) = rest.partition("/")
+        (userinfo, at, host) = host.rpartition("@")
+        url = scheme.lower() + "://" + userinfo + at + host.lower() + sep + path
+    return url
 
 
 class OmniCacheConfig():
@@ -20,18 +69,23 @@ class OmniCacheConfig():
     Load, Save, Version check, etc.
     '''
 
-    CONFIG_VERSION = 1
+    CONFIG_VERSION = 2
 
-    def __init__(self, absfilepath):
+    def __init__(self, absfilepath, migrate=False):
+        '''
+        migrate moves an older config (and the omnicache) to the current version.
+        Only do it while holding the OmniCacheLock.  Otherwise an older config is
+        read as it is.
+        '''
         self.version = OmniCacheConfig.CONFIG_VERSION
         self.filepath = absfilepath
         self.last_change = datetime.datetime.strftime(datetime.datetime.now(), "%A, %B %d, %Y %I:%M%p")
+        self.remotes = {}
+        self._url_index = {}  # normalized url -> remote name
         if os.path.isfile(self.filepath):
-            self._Load()
-        else:
-            self.remotes = {}
+            self._Load(migrate)
 
-    def _Load(self):
+    def _Load(self, migrate=False):
         with open(self.filepath) as ymlfile:
             content = yaml.safe_load(ymlfile)
 
@@ -40,19 +94,41 @@ class OmniCacheConfig():
         elif content["version"] == self.version:
             # parse yml into config data
             self.remotes = {x["name"]: x for x in content["remotes"]}
+            self._RebuildIndex()
             self.last_change = content["last_change"]
-        else:
+        elif migrate:
             self._Transition(content)
+        elif content["version"] == 1:
+            # the remotes are the same.  Only the tags are fetched differently.
+            logging.debug("Omnicache config {0} is version 1.  Not migrating it.".format(self.filepath))
+            self.version = content["version"]
+            self.remotes = {x["name"]: x for x in content["remotes"]}
+            self._RebuildIndex()
+            self.last_change = content["last_change"]
+        else:
+            raise Exception("Unsupported config data")
 
     def Save(self):
         data = {"version": self.version, "remotes": list(self.remotes.values()),
                 "last_change": datetime.datetime.strftime(datetime.datetime.now(),
                                                           "%A, %B %d, %Y %I:%M%p")}
-        with open(self.filepath, 'w') as outfile:
-            yaml.dump(data, outfile, default_flow_style=False)
+        SaveYaml(self.filepath, data)
+
+    def _RebuildIndex(self):
+        self._url_index = {NormalizeUrl(x["url"]): x["name"] for x in self.remotes.values()}
 
     def _Transition(self, data):
         # Add code here to move old config data to new format
+        if data["version"] == 1:
+            # version 2 fetches the tags of each remote into refs/rtags/<name>/.  The shared tags
+            # fetched by version 1 are deleted and the tags are fetched again by the next fetch.
+            logging.critical("Migrating Omnicache config from version 1 to 2")
+            if MigrateTagsToRtags(os.path.dirname(self.filepath)) != 0:
+                raise Exception("Failed to migrate Omnicache to config version 2")
+            self.remotes = {x["name"]: x for x in data["remotes"]}
+            self._RebuildIndex()
+            self.Save()
+            return
         raise Exception("Unsupported config data")
 
     def Log(self, level=logging.DEBUG):
@@ -70,38 +146,87 @@ class OmniCacheConfig():
             logging.warning("Skipping add this entry %s %s" % (name, url))
             return
         # if the name already exists, we overwrite it
+        if name in self.remotes:
+            self._url_index.pop(NormalizeUrl(self.remotes[name]["url"]), None)
         remote = {"name": name, "url": url}
         if tags:
             remote["tag"] = True
         self.remotes[name] = remote
+        self._url_index[NormalizeUrl(url)] = name
 
     def Contains_url(self, url):
-        for x in self.remotes.values():
-            if x["url"] == url:
-                return True
-        return False
+        return NormalizeUrl(url) in self._url_index
 
     def Contains_name(self, name):
-        for x in self.remotes.values():
-            if x["name"] == name:
-                return True
-        return False
+        return name in self.remotes
 
     def GetNameForUrl(self, url):
-        for x in self.remotes.values():
-            if (x["url"] == url):
-                return x["name"]
-        return None
+        return self._url_index.get(NormalizeUrl(url))
 
     def Remove(self, del_name):
-        del self.remotes[del_name]
+        remote = self.remotes.pop(del_name)
+        self._url_index.pop(NormalizeUrl(remote["url"]), None)
 
     def Contains(self, name):
         return name in self.remotes
 
 
+class OmniCacheRefState():
+    '''
+    class to manage the snapshot of the refs advertised by each remote
+    the last time it was fetched.  Used by incremental updates to skip
+    remotes that haven't changed.
+    '''
+
+    STATE_VERSION = 1
+
+    def __init__(self, absfilepath):
+        self.version = OmniCacheRefState.STATE_VERSION
+        self.filepath = absfilepath
+        self.states = {}
+        if os.path.isfile(self.filepath):
+            self._Load()
+
+    def _Load(self):
+        with open(self.filepath) as ymlfile:
+            content = yaml.safe_load(ymlfile)
+
+        if content is None or content.get("version") != self.version:
+            # the snapshot is only an optimization.  Drop it and start over.
+            logging.warning("Ignoring unsupported OmniCache ref state file {0}".format(self.filepath))
+            return
+        self.states = {x["name"]: x for x in content["remotes"]}
+
+    def Save(self, config=None):
+        '''
+        Save the snapshot.  If config is given states for remotes no longer in
+        the config are dropped.
+        '''
+        if config is not None:
+            self.states = {k: v for (k, v) in self.states.items() if config.Contains(k)}
+        data = {"version": self.version, "remotes": list(self.states.values())}
+        SaveYaml(self.filepath, data)
+
+    def Get(self, name, url):
+        '''
+        return the digest recorded for the remote or None if it is unknown or the url changed
+        '''
+        state = self.states.get(name)
+        if state is None or state["url"] != url:
+            return None
+        return state["digest"]
+
+    def Set(self, name, url, digest):
+        self.states[name] = {"name": name, "url": url, "digest": digest}
+
+    def Remove(self, name):
+        self.states.pop(name, None)
+
+
 OMNICACHE_VERSION = "0.9"
 OMNICACHE_FILENAME = "omnicache.yaml"
+OMNICACHE_REFSTATE_FILENAME = "omnicache_refstate.yaml"
+OMNICACHE_SERVE_DIRNAME = "serve"
 
 
 def CommonFilePathHandler(path):
@@ -129,6 +254,9 @@ def AddEntriesFromConfig(config, input_config_file):
     with open(input_config_file) as ymlfile:
         content = yaml.safe_load(ymlfile)
     if "remotes" in content:
+        adds = {}  # name -> (name, url, tags) to add
+        pending_urls = {}  # normalized url -> name for entries in adds
+        removes = []
         for remote in content["remotes"]:
             currentRemoteName = config.GetNameForUrl(remote["url"])
             if (currentRemoteName is not None):
@@ -137,15 +265,22 @@ def AddEntriesFromConfig(config, input_config_file):
                         "remote with name: {0} already in cache, renaming to {1}"
                         .format(currentRemoteName, remote["name"])
                     )
-                    RemoveEntry(config, currentRemoteName)  # remove here, then fall through to add entry below.
+                    removes.append(currentRemoteName)  # remove here, then fall through to add entry below.
                 else:
                     logging.debug("remote with name: {0} already in cache".format(remote["name"]))
                     continue
-            if "tag" in remote:
-                AddEntry(config, remote["name"], remote["url"], bool(remote["tag"]))
-            else:
-                AddEntry(config, remote["name"], remote["url"])
+            url = NormalizeUrl(remote["url"])
+            if url in pending_urls:
+                # same url listed twice in the input.  Last one wins.
+                del adds[pending_urls[url]]
+                count -= 1
+            if remote["name"] in adds:
+                del pending_urls[NormalizeUrl(adds[remote["name"]][1])]
+                count -= 1
+            adds[remote["name"]] = (remote["name"], remote["url"], bool(remote.get("tag", False)))
+            pending_urls[url] = remote["name"]
             count += 1
+        UpdateEntries(config, list(adds.values()), removes)
     return (count, content["remotes"])
 
 
@@ -156,31 +291,147 @@ def InitOmnicache(path):
 
 
 def AddEntry(config, name, url, tags=False):
-    logging.info("Adding remote ({0} : {1}) to Omnicache".format(name, url))
-    param = "remote add {0} {1}".format(name, url)
-
-    if config.Contains(name):
-        logging.info("Updating remote ({0} : {1}) in Omnicache".format(name, url))
-        param = "remote set-url {0} {1}".format(name, url)
-    else:
-        logging.info("Adding remote ({0} : {1}) to Omnicache".format(name, url))
-        param = "remote add {0} {1}".format(name, url)
-
-    if(UtilityFunctions.RunCmd("git", param) == 0):
-        config.Add(name, url, tags)
-    else:
+    if UpdateEntries(config, [(name, url, tags)]) != 0:
         logging.error("Failed to add remote for {0}".format(name))
 
 
 def RemoveEntry(config, name):
-    logging.info("Removing remote named {0}".format(name))
-    param = "remote remove {0}".format(name)
-    if UtilityFunctions.RunCmd("git", param) == 0:
-        config.Remove(name)
-    else:
+    if UpdateEntries(config, remove=[name]) != 0:
         logging.error("Failed to remove remote for {0}".format(name))
 
 
+def UpdateEntries(config, add=[], remove=[]):
+    '''
+    Add, update and remove many entries with a single write of the git config
+    instead of running a git remote command for each entry.
+
+    add is a list of (name, url, tags) tuples.  Entries with a name already
+    in the omnicache are updated.  remove is a list of names.
+
+    return
+        0:          success
+        non-zero:   indicates an error
+    '''
+    for name in remove:
+        logging.info("Removing remote named {0}".format(name))
+    for (name, url, tags) in add:
+        if config.Contains(name):
+            logging.info("Updating remote ({0} : {1}) in Omnicache".format(name, url))
+        else:
+            logging.info("Adding remote ({0} : {1}) to Omnicache".format(name, url))
+
+    ret = WriteGitRemotes([(name, url) for (name, url, tags) in add], remove)
+    if ret != 0:
+        return ret
+
+    for name in remove:
+        if config.Contains(name):
+            config.Remove(name)
+        else:
+            logging.warning("Remote {0} not found in Omnicache config".format(name))
+    for (name, url, tags) in add:
+        config.Add(name, url, tags)
+    return 0
+
+
+_REMOTE_SECTION_RE = re.compile(r'^\s*\[\s*remote\s+"((?:[^"\\]|\\.)*)"\s*\]')
+
+
+def _GetGitConfigPath():
+    out = StringIO()
+    ret = UtilityFunctions.RunCmd("git", "rev-parse --git-dir", outstream=out, logging_level=logging.DEBUG)
+    if ret != 0:
+        logging.critical("Could not find the git directory of the Omnicache")
+        return None
+    return os.path.join(os.path.abspath(out.getvalue().strip()), "config")
+
+
+def _QuoteConfigValue(value):
+    if re.search(r'[\s;#"\\]', value) is None:
+        return value
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def WriteGitRemotes(add=[], remove=[]):
+    '''
+    Add and remove remotes in the git config of the omnicache (current directory)
+    in one pass.  Existing sections for remotes in add are replaced which updates
+    their url.  Refs of removed remotes are deleted like git remote remove does.
+
+    add is a list of (name, url) tuples and remove a list of names.
+    The config is written to config.lock and renamed over the config so a
+    concurrent git process either sees the old or new config.
+
+    return
+        0:          success
+        non-zero:   indicates an error
+    '''
+    if len(add) == 0 and len(remove) == 0:
+        return 0
+    configpath = _GetGitConfigPath()
+    if configpath is None:
+        return -1
+
+    drop = set(remove) | set(name for (name, url) in add)
+    with open(configpath) as configfile:
+        lines = configfile.readlines()
+    kept = []
+    skipping = False
+    for line in lines:
+        if line.lstrip().startswith("["):
+            match = _REMOTE_SECTION_RE.match(line)
+            skipping = match is not None and re.sub(r'\\(.)', r'\1', match.group(1)) in drop
+        if not skipping:
+            kept.append(line)
+    if len(kept) > 0 and not kept[-1].endswith("\n"):
+        kept[-1] += "\n"
+    for (name, url) in add:
+        kept.append('[remote "{0}"]\n'.format(name.replace('\\', '\\\\').replace('"', '\\"')))
+        kept.append("\turl = {0}\n".format(_QuoteConfigValue(url)))
+        kept.append("\tfetch = +refs/heads/*:refs/remotes/{0}/*\n".format(name))
+
+    lockpath = configpath + ".lock"
+    try:
+        fd = os.open(lockpath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    except OSError:
+        logging.error("Could not lock git config ({0})".format(lockpath))
+        return -1
+    try:
+        with os.fdopen(fd, "w") as lockfile:
+            lockfile.writelines(kept)
+        os.replace(lockpath, configpath)
+    except OSError as e:
+        logging.error("Failed to write git config: {0}".format(e))
+        if os.path.exists(lockpath):
+            os.remove(lockpath)
+        return -1
+
+    if len(remove) > 0:
+        return _DeleteRemoteRefs(remove)
+    return 0
+
+
+def _DeleteRemoteRefs(names):
+    out = StringIO()
+    ret = UtilityFunctions.RunCmd("git", 'for-each-ref "--format=%(refname)" refs/remotes/', outstream=out,
+                                  logging_level=logging.DEBUG)
+    if ret != 0:
+        logging.error("Could not list remote refs")
+        return ret
+    prefixes = tuple("refs/remotes/{0}/".format(name) for name in names)
+    return _DeleteRefs([x.strip() for x in out.getvalue().splitlines() if x.strip().startswith(prefixes)])
+
+
+def _DeleteRefs(refs, workingdir=None):
+    if len(refs) == 0:
+        return 0
+    p = subprocess.run(["git", "update-ref", "--stdin"], input="".join("delete {0}\n".format(x) for x in refs).encode(),
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=workingdir)
+    if p.returncode != 0:
+        logging.error("Failed to delete refs: {0}".format(p.stdout.decode("utf-8", errors="replace")))
+    return p.returncode
+
+
 def ConsistencyCheckCacheConfig(config):
     '''
     Check the git remote list vs what is in the config file
@@ -204,6 +455,7 @@ def ConsistencyCheckCacheConfig(config):
 
     lines = out.getvalue().split('\n')
     out.close()
+    changed = False
     for line in lines:
         line = line.strip()
         if len(line) == 0:
@@ -214,17 +466,178 @@ def ConsistencyCheckCacheConfig(config):
         if(not config.Contains(git[0])):
             logging.warning("Found entry in git not in config.  Name: {0} Url: {1}".format(git[0], git[1]))
             config.Add(git[0], git[1])
-            config.Save()
+            changed = True
+    if changed:
+        config.Save()
 
     gitnames = set(gitnames)
+    missing = []
     for remote in config.remotes.values():
         if(remote["name"] not in gitnames):
             logging.warning("Found entry in config not in git. Name: {0} Url: {1}".format(remote["name"],
                                                                                           remote["url"]))
-            param = "remote add {0} {1}".format(remote["name"], remote["url"])
-            UtilityFunctions.RunCmd("git", param)
+            missing.append((remote["name"], remote["url"]))
 
-    return 0
+    return WriteGitRemotes(missing)
+
+
+_CONFIG_SECTION_RE = re.compile(r'^\[\s*([^\s"\]]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\](.*)$')
+_CONFIG_ESCAPES = {"n": "\n", "t": "\t", "b": "\b"}
+
+
+def _ParseConfigValue(raw):
+    value = []
+    inquote = False
+    i = 0
+    while i < len(raw):
+        c = raw[i]
+        if c == '"':
+            inquote = not inquote
+        elif c == '\\' and i + 1 < len(raw):
+            i += 1
+            value.append(_CONFIG_ESCAPES.get(raw[i], raw[i]))
+        elif c in "#;" and not inquote:
+            break
+        else:
+            value.append(c)
+        i += 1
+    return "".join(value).strip()
+
+
+def ReadGitConfigFile(path):
+    '''
+    minimal reader for git config formatted files (config, .gitmodules)
+    so that repos can be scanned without starting git processes.
+
+    return
+        dictionary of "section.subsection.key" to value.  Section and key are
+        lower case.  If a key is repeated the last value wins.
+    '''
+    values = {}
+    section = None
+    with open(path, encoding="utf-8", errors="replace") as configfile:
+        for line in configfile:
+            line = line.strip()
+            if len(line) == 0 or line[0] in "#;":
+                continue
+            if line.startswith("["):
+                match = _CONFIG_SECTION_RE.match(line)
+                if match is None:
+                    section = None
+                    continue
+                section = match.group(1).lower()
+                if match.group(2) is not None:
+                    section += "." + re.sub(r'\\(.)', r'\1', match.group(2))
+                line = match.group(3).strip()
+                if len(line) == 0 or line[0] in "#;":
+                    continue
+            if section is None:
+                continue
+            (key, sep, raw) = line.partition("=")
+            values[section + "." + key.strip().lower()] = _ParseConfigValue(raw) if sep else "true"
+    return values
+
+
+def _GetGitConfigFileForRepo(repodir):
+    gitpath = os.path.join(repodir, ".git")
+    if os.path.isfile(gitpath):
+        # submodules and worktrees have a .git file pointing at the real git dir
+        with open(gitpath) as gitfile:
+            content = gitfile.read().strip()
+        if not content.startswith("gitdir:"):
+            return None
+        gitpath = os.path.normpath(os.path.join(repodir, content[len("gitdir:"):].strip()))
+        commondir = os.path.join(gitpath, "commondir")
+        if os.path.isfile(commondir):
+            with open(commondir) as commonfile:
+                gitpath = os.path.normpath(os.path.join(gitpath, commonfile.read().strip()))
+    if not os.path.isdir(gitpath):
+        return None
+    return os.path.join(gitpath, "config")
+
+
+def ScanRepo(scan_dir, item):
+    '''
+    read the origin url and the submodule paths of the repo at scan_dir/item
+
+    return
+        (item, url or None, list of submodule paths relative to the repo)
+    '''
+    repodir = os.path.join(scan_dir, item)
+    url = None
+    submodules = []
+    configpath = _GetGitConfigFileForRepo(repodir)
+    if configpath is not None and os.path.isfile(configpath):
+        url = ReadGitConfigFile(configpath).get("remote.origin.url")
+        gitmodules = os.path.join(repodir, ".gitmodules")
+        if os.path.isfile(gitmodules):
+            submodules = [v for (k, v) in ReadGitConfigFile(gitmodules).items()
+                          if k.startswith("submodule.") and k.endswith(".path")]
+    return (item, url, submodules)
+
+
+def ScanForRepos(scan_dir, jobs=8):
+    '''
+    Scan the top level folders of scan_dir and recursively their submodules
+    for git repos.  Git config files are read directly and the folders are
+    scanned by a pool of worker threads.
+
+    return
+        dictionary of url to name.  If the same url is found more than once
+        the shortest (then alphabetically first) relative path is the name.
+    '''
+    found = {}  # normalized url -> (name, url)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        for item in os.listdir(scan_dir):
+            if os.path.isdir(os.path.join(scan_dir, item)):
+                pending.add(executor.submit(ScanRepo, scan_dir, item))
+        while len(pending) > 0:
+            (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                (item, url, submodules) = future.result()
+                if url is None:
+                    logging.error("Git repo with url not found at %s" % os.path.join(scan_dir, item))
+                    continue
+                logging.info("Found repo %s with url %s" % (item, url))
+                key = NormalizeUrl(url)
+                if key in found:
+                    logging.debug("Repo at %s has previously found url %s" % (item, url))
+                    if (len(item), item) < (len(found[key][0]), found[key][0]):
+                        found[key] = (item, url)
+                else:
+                    found[key] = (item, url)
+                for submodule in submodules:
+                    pending.add(executor.submit(ScanRepo, scan_dir, item + "/" + submodule))
+    return {url: name for (name, url) in sorted(found.values())}
+
+
+def _FetchArgs(name, tags=False):
+    # tags of different remotes can have the same name so each remote gets its own tag namespace
+    # https://stackoverflow.com/questions/22108391/git-checkout-a-remote-tag-when-two-remotes-have-the-same-tag-name
+    args = ["fetch", name, "--no-tags", "+refs/heads/*:refs/remotes/{0}/*".format(name)]
+    if tags:
+        args.append("+refs/tags/*:refs/rtags/{0}/*".format(name))
+    return args
+
+
+def MigrateTagsToRtags(cache_dir):
+    '''
+    delete the tags fetched into refs/tags by config version 1
+
+    return
+        0:          success
+        non-zero:   indicates an error
+    '''
+    out = StringIO()
+    ret = UtilityFunctions.RunCmd("git", 'for-each-ref "--format=%(refname)" refs/tags/', workingdir=cache_dir,
+                                  outstream=out, logging_level=logging.DEBUG)
+    if ret != 0:
+        logging.error("Could not list tags")
+        return ret
+    tags = [x.strip() for x in out.getvalue().splitlines() if x.strip()]
+    logging.info("Deleting {0} tags shared by all remotes".format(len(tags)))
+    return _DeleteRefs(tags, cache_dir)
 
 
 def FetchEntry(name, tags=False):
@@ -236,17 +649,519 @@ def FetchEntry(name, tags=False):
         non-zero:   git command line error
     '''
 
-    param = "fetch {0}".format(name)
-    if not tags:
-        param += " --no-tags"
-    else:
-        param += " --tags"
-        # might want to look at something more complex to avoid tag conflicts
-        # https://stackoverflow.com/questions/22108391/git-checkout-a-remote-tag-when-two-remotes-have-the-same-tag-name
-        # param += "+refs/heads/:refs/remotes/{0}/ +refs/tags/:refs/rtags/{0}/".format(name)
+    # refspecs are quoted so the shell doesn't expand the *
+    param = " ".join('"{0}"'.format(x) if "*" in x else x for x in _FetchArgs(name, tags))
     return UtilityFunctions.RunCmd("git", param)
 
 
+class FetchResult():
+    '''
+    Outcome of fetching a single remote with FetchEntries
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.returncode = -1
+        self.attempts = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.timed_out = False
+
+
+# git only reports the transfer size in the "Receiving objects" progress lines
+_RECEIVED_SIZE_RE = re.compile(r"Receiving objects:[^\r\n]*?,\s*([\d.]+)\s*(bytes|KiB|MiB|GiB)")
+_SIZE_UNITS = {"bytes": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3}
+
+
+def ParseFetchBytes(output):
+    '''
+    parse the number of bytes received from the progress output of git fetch
+
+    return
+        bytes received or 0 if git didn't report it (nothing fetched or a very quick fetch)
+    '''
+    matches = _RECEIVED_SIZE_RE.findall(output)
+    if len(matches) == 0:
+        return 0
+    (value, unit) = matches[-1]
+    return int(float(value) * _SIZE_UNITS[unit])
+
+
+def FormatBytes(count):
+    for unit in ["bytes", "KiB", "MiB"]:
+        if count < 1024:
+            return "{0:.0f} {1}".format(count, unit) if unit == "bytes" else "{0:.2f} {1}".format(count, unit)
+        count /= 1024.0
+    return "{0:.2f} GiB".format(count)
+
+
+def _RunWithTimeout(cmd, timeout, stderr=subprocess.PIPE):
+    '''
+    run cmd and kill it after timeout seconds.  subprocess.run waits for the
+    output pipes to close after the kill, which can hang on Windows while a
+    grandchild (like git-remote-https) still has them open.  The pipes are
+    closed instead.
+
+    return
+        (returncode or None if it timed out, stdout bytes, stderr bytes)
+    '''
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+    try:
+        (out, err) = p.communicate(timeout=timeout)
+        return (p.returncode, out or b"", err or b"")
+    except subprocess.TimeoutExpired as e:
+        p.kill()
+        for pipe in (p.stdout, p.stderr):
+            if pipe is not None:
+                pipe.close()
+        p.wait()
+        return (None, e.output or b"", e.stderr or b"")
+
+
+def _FetchEntryWithStats(name, tags, timeout, retries, backoff):
+    result = FetchResult(name)
+    cmd = ["git"] + _FetchArgs(name, tags) + ["--progress"]
+    start = time.time()
+    while True:
+        result.attempts += 1
+        (returncode, out, _) = _RunWithTimeout(cmd, timeout, stderr=subprocess.STDOUT)
+        output = out.decode("utf-8", errors="replace")
+        result.timed_out = returncode is None
+        result.returncode = -1 if returncode is None else returncode
+        result.bytes += ParseFetchBytes(output)
+        messages = []
+        for line in output.replace("\r", "\n").splitlines():
+            if line.strip() and not line.startswith(("remote:", "Receiving objects", "Resolving deltas")):
+                logging.debug("[{0}] {1}".format(name, line.strip()))
+                messages.append(line.strip())
+
+        if result.returncode == 0 or result.attempts > retries:
+            break
+        delay = backoff * (2 ** (result.attempts - 1))
+        logging.warning("Fetch of {0} {1} (attempt {2} of {3}).  Retrying in {4:.0f}s".format(
+            name, "timed out" if result.timed_out else "failed", result.attempts, retries + 1, delay))
+        time.sleep(delay)
+
+    result.seconds = time.time() - start
+    if result.returncode != 0:
+        logging.error("Failed to fetch {0}{1}".format(name, " (timed out)" if result.timed_out else ""))
+        # what git said on the last attempt
+        for message in messages:
+            logging.error("[{0}] {1}".format(name, message))
+    else:
+        logging.info("Fetched {0} in {1:.1f}s".format(name, result.seconds))
+    return result
+
+
+def FetchEntries(config, remotes, jobs=1, timeout=None, retries=0, backoff=2.0):
+    '''
+    fetch a list of entries using a pool of worker threads.
+    Each remote is fetched by its own git process which is killed after
+    timeout seconds.  Failed fetches are retried up to retries times waiting
+    backoff, 2*backoff, 4*backoff, ... seconds between attempts.
+
+    return
+        list of FetchResult in the same order as remotes
+    '''
+    remotes = list(remotes)
+    jobs = max(1, min(jobs, len(remotes)))
+    logging.info("Fetching {0} remotes using {1} job(s)".format(len(remotes), jobs))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_FetchEntryWithStats, config.remotes[name]["name"], ("tag" in config.remotes[name]),
+                                   timeout, retries, backoff) for name in remotes]
+        return [f.result() for f in futures]
+
+
+def GetRemoteRefDigest(name, tags=False, timeout=None):
+    '''
+    use git ls-remote to get the refs advertised by a remote without
+    fetching any objects.  Tags are only included for remotes that sync tags.
+
+    return
+        sha1 hex digest of the advertised refs or None on failure
+    '''
+    cmd = ["git", "ls-remote", "--heads"]
+    if tags:
+        cmd.append("--tags")
+    cmd.append(name)
+    (returncode, out, err) = _RunWithTimeout(cmd, timeout)
+    if returncode is None:
+        logging.warning("ls-remote of {0} timed out".format(name))
+        return None
+    if returncode != 0:
+        logging.warning("ls-remote of {0} failed: {1}".format(name, err.decode("utf-8", errors="replace").strip()))
+        return None
+    refs = sorted(line.strip() for line in out.decode("utf-8", errors="replace").splitlines() if line.strip())
+    return hashlib.sha1("\n".join(refs).encode("utf-8")).hexdigest()
+
+
+def GetChangedEntries(config, refstate, remotes, jobs=1, timeout=None):
+    '''
+    compare the refs advertised by each remote with the ref state snapshot.
+    The ls-remote calls are run concurrently using jobs worker threads.
+    Remotes that can't be queried are treated as changed so that the
+    following fetch reports the error.
+
+    return
+        (list of changed remote names in the order of remotes,
+         dictionary of remote name to current digest)
+    '''
+    remotes = list(remotes)
+    if len(remotes) == 0:
+        return ([], {})
+    jobs = max(1, min(jobs, len(remotes)))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(GetRemoteRefDigest, config.remotes[name]["name"], ("tag" in config.remotes[name]),
+                                   timeout) for name in remotes]
+        digests = {name: f.result() for (name, f) in zip(remotes, futures)}
+
+    changed = []
+    for name in remotes:
+        digest = digests[name]
+        if digest is None or digest != refstate.Get(name, config.remotes[name]["url"]):
+            changed.append(name)
+        else:
+            logging.debug("Remote {0} unchanged since last fetch".format(name))
+    logging.info("{0} of {1} remotes changed since last fetch".format(len(changed), len(remotes)))
+    return (changed, digests)
+
+
+def LogFetchSummary(results, level=logging.INFO):
+    '''
+    log time and bytes received per remote, slowest first
+    '''
+    if len(results) == 0:
+        return
+    logging.log(level, "Fetch Summary")
+    width = max(len(r.name) for r in results)
+    for r in sorted(results, key=lambda x: x.seconds, reverse=True):
+        if r.returncode == 0:
+            status = "OK"
+        else:
+            status = "TIMEOUT" if r.timed_out else "FAILED"
+        logging.log(level, "  {0:<{1}}  {2:<7}  {3:>8.1f}s  {4:>12}  attempts: {5}".format(
+            r.name, width, status, r.seconds, FormatBytes(r.bytes), r.attempts))
+    failed = len([r for r in results if r.returncode != 0])
+    logging.log(level, "  Total: {0} remotes, {1} failed, {2} received".format(
+        len(results), failed, FormatBytes(sum(r.bytes for r in results))))
+
+
+def GetCacheStats():
+    '''
+    get the object and pack statistics of the omnicache (current directory)
+
+    return
+        dictionary of the git count-objects -v values (count, size, in-pack, packs, size-pack, ...)
+        or None on failure
+    '''
+    out = StringIO()
+    if UtilityFunctions.RunCmd("git", "count-objects -v", outstream=out, logging_level=logging.DEBUG) != 0:
+        return None
+    stats = {}
+    for line in out.getvalue().splitlines():
+        (key, sep, value) = line.partition(":")
+        if sep and value.strip().isdigit():
+            stats[key.strip()] = int(value.strip())
+    return stats
+
+
+def _GetRefOwner(config, refname):
+    '''
+    return the name of the remote a refs/remotes/<name>/* or refs/rtags/<name>/* ref
+    belongs to or None.  Remote names can contain / so the longest matching name wins.
+    '''
+    if not refname.startswith(("refs/remotes/", "refs/rtags/")):
+        return None
+    parts = refname.split("/")[2:]
+    for i in range(len(parts) - 1, 0, -1):
+        name = "/".join(parts[:i])
+        if name in config.remotes:
+            return name
+    return None
+
+
+def PruneStaleRefs(config):
+    '''
+    delete refs/remotes/<name>/ and refs/rtags/<name>/ refs of remotes that
+    are no longer in the omnicache config.  Remote names can contain / so
+    a ref is kept if any remote could own it.
+
+    return
+        number of refs deleted or -1 on error
+    '''
+    out = StringIO()
+    ret = UtilityFunctions.RunCmd("git", 'for-each-ref "--format=%(refname)" refs/remotes/ refs/rtags/',
+                                  outstream=out, logging_level=logging.DEBUG)
+    if ret != 0:
+        logging.error("Could not list remote refs")
+        return -1
+    stale = [x.strip() for x in out.getvalue().splitlines() if x.strip() and _GetRefOwner(config, x.strip()) is None]
+    if len(stale) > 0:
+        logging.info("Deleting {0} refs of remotes no longer in the Omnicache".format(len(stale)))
+        if _DeleteRefs(stale) != 0:
+            return -1
+    return len(stale)
+
+
+# git maintenance never uses a bigger multi-pack-index repack batch than this
+MAX_REPACK_BATCH_SIZE = 2 ** 31 - 1
+
+
+def GetRepackBatchSize(pack_dir=os.path.join("objects", "pack")):
+    '''
+    pick the multi-pack-index repack batch size the same way git maintenance
+    incremental-repack does: one more than the size of the second biggest pack.
+    The biggest pack (usually from the first fetch) is left alone and the small
+    packs added by later fetches are combined.
+
+    return
+        batch size in bytes
+    '''
+    sizes = []
+    if os.path.isdir(pack_dir):
+        sizes = sorted((os.path.getsize(os.path.join(pack_dir, x)) for x in os.listdir(pack_dir)
+                        if x.endswith(".pack")), reverse=True)
+    second_biggest = sizes[1] if len(sizes) > 1 else 0
+    return min(second_biggest + 1, MAX_REPACK_BATCH_SIZE)
+
+
+def GetMaintenanceSteps(expire="2.weeks.ago", full_repack=False, batch_size=None):
+    '''
+    return
+        list of the git commands MaintainCache runs after deleting stale refs
+    '''
+    if batch_size is None:
+        batch_size = GetRepackBatchSize()
+    steps = []
+    if full_repack:
+        steps.append("repack -A -d")
+    steps += ["prune --expire={0}".format(expire),
+              "multi-pack-index write",
+              "multi-pack-index expire",
+              "multi-pack-index repack --batch-size={0}".format(batch_size),
+              "commit-graph write --reachable --split"]
+    return steps
+
+
+def MaintainCache(config, expire="2.weeks.ago", full_repack=False, batch_size=None):
+    '''
+    maintain the omnicache (current directory) so object lookups stay fast as it grows.
+
+    1. delete refs of remotes no longer in the config.  The config is loaded again
+       under the omnicache lock so remotes other processes added since config was
+       loaded aren't deleted.
+    2. optionally (full_repack) repack everything into one pack.  Unreachable
+       objects, like those of removed remotes, are loosened so the prune drops them.
+    3. prune unreachable loose objects older than expire
+    4. incremental repack: write, expire and repack the multi-pack-index.  Packs are
+       combined until they add up to batch_size bytes.  By default that's picked by
+       GetRepackBatchSize so the biggest pack isn't rewritten every time.
+    5. write a split commit-graph of all reachable commits
+
+    return
+        (0 on success or the first error, stats before, stats after)
+    '''
+    before = GetCacheStats()
+    errorcode = 0
+    with OmniCacheLock(os.path.dirname(config.filepath)):
+        if PruneStaleRefs(OmniCacheConfig(config.filepath)) < 0:
+            errorcode = -1
+    for step in GetMaintenanceSteps(expire, full_repack, batch_size):
+        logging.info("Omnicache maintenance: git {0}".format(step))
+        ret = UtilityFunctions.RunCmd("git", step)
+        if ret != 0:
+            # keep going.  Older versions of git don't support all of the steps.
+            logging.warning("Omnicache maintenance step git {0} failed ({1})".format(step, ret))
+            if errorcode == 0:
+                errorcode = ret
+    after = GetCacheStats()
+    return (errorcode, before, after)
+
+
+def LogMaintenanceSummary(before, after, level=logging.INFO):
+    if before is None or after is None:
+        return
+    logging.log(level, "Maintenance Summary")
+    for (key, title) in [("packs", "Packs"), ("size-pack", "Pack size"), ("count", "Loose objects"),
+                         ("size", "Loose size")]:
+        if key in before and key in after:
+            (b, a) = (before[key], after[key])
+            if key.startswith("size"):
+                # count-objects reports sizes in KiB
+                (b, a) = (FormatBytes(b * 1024), FormatBytes(a * 1024))
+            logging.log(level, "  {0:<14} {1:>12} -> {2}".format(title, b, a))
+
+
+def BenchmarkClone(cache_dir, url):
+    '''
+    time a clone of url using the omnicache as the reference.  Only objects
+    missing from the omnicache are transferred so this mostly measures
+    object lookups in the omnicache.
+
+    return
+        seconds or None if the clone failed
+    '''
+    clone_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        ret = UtilityFunctions.RunCmd("git", "clone --quiet --no-checkout --reference {0} {1} {2}".format(
+            cache_dir, url, os.path.join(clone_dir, "clone")), logging_level=logging.DEBUG)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(clone_dir, ignore_errors=True)
+    if ret != 0:
+        logging.error("Benchmark clone of {0} failed".format(url))
+        return None
+    return elapsed
+
+
+def _ServeViewName(name):
+    return name.replace("/", "_").replace("\\", "_") + ".git"
+
+
+def _GetServeRefMap(name, tags=False):
+    '''
+    return list of (cache ref prefix, view ref prefix) that make up the view of a remote
+    '''
+    refmap = [("refs/remotes/{0}/".format(name), "refs/heads/")]
+    if tags:
+        refmap.append(("refs/rtags/{0}/".format(name), "refs/tags/"))
+    return refmap
+
+
+def UpdateServeViews(config, cache_dir):
+    '''
+    Create or refresh a bare repo view per remote in <cache_dir>/serve/<name>.git.
+    A view has no objects of its own.  It borrows all objects from the omnicache
+    thru objects/info/alternates and has a packed-refs file that maps the
+    refs/remotes/<name>/* refs of the omnicache to refs/heads/* so it looks like
+    the upstream repo to git clone and git daemon.
+
+    return
+        0:          success
+        non-zero:   indicates an error
+    '''
+    serve_dir = os.path.join(cache_dir, OMNICACHE_SERVE_DIRNAME)
+    out = StringIO()
+    param = 'for-each-ref "--format=%(objectname)%09%(refname)%09%(*objectname)%09%(symref)"'
+    ret = UtilityFunctions.RunCmd("git", param, workingdir=cache_dir, outstream=out, logging_level=logging.DEBUG)
+    if ret != 0:
+        logging.error("Could not list Omnicache refs")
+        return ret
+    refs = [line.split("\t") for line in out.getvalue().splitlines() if line.count("\t") == 3]
+
+    packed_refs = {name: {} for name in config.remotes}
+    heads = {}
+    for (objectname, refname, peeled, symref) in refs:
+        name = _GetRefOwner(config, refname)
+        if name is None:
+            continue
+        for (source, dest) in _GetServeRefMap(name, ("tag" in config.remotes[name])):
+            if not refname.startswith(source):
+                continue
+            if dest == "refs/heads/" and refname == source + "HEAD":
+                if symref.startswith(source):
+                    heads[name] = dest + symref[len(source):]
+                continue
+            packed_refs[name][dest + refname[len(source):]] = (objectname, peeled)
+
+    os.makedirs(serve_dir, exist_ok=True)
+    expected = set()
+    for name in config.remotes:
+        view_dir = os.path.join(serve_dir, _ServeViewName(name))
+        expected.add(_ServeViewName(name))
+        packed = packed_refs[name]
+        head = heads.get(name)
+        if head is None or head not in packed:
+            branches = sorted(x for x in packed if x.startswith("refs/heads/"))
+            head = "refs/heads/master"
+            for candidate in ["refs/heads/master", "refs/heads/main"] + branches:
+                if candidate in packed:
+                    head = candidate
+                    break
+        _WriteServeView(view_dir, os.path.join(cache_dir, "objects"), packed, head)
+
+    for view in os.listdir(serve_dir):
+        if view not in expected:
+            logging.info("Removing serve view {0}".format(view))
+            shutil.rmtree(os.path.join(serve_dir, view), ignore_errors=True)
+    return 0
+
+
+def _WriteFileIfChanged(path, content):
+    # git wants LF line endings in these files on every OS
+    if os.path.isfile(path):
+        with open(path, newline="") as current:
+            if current.read() == content:
+                return
+    temp = path + ".tmp"
+    with open(temp, "w", newline="\n") as newfile:
+        newfile.write(content)
+    os.replace(temp, path)
+
+
+def _WriteServeView(view_dir, objects_dir, packed, head):
+    for folder in ["objects/info", "objects/pack", "refs/heads", "refs/tags"]:
+        os.makedirs(os.path.join(view_dir, folder), exist_ok=True)
+    _WriteFileIfChanged(os.path.join(view_dir, "config"),
+                        "[core]\n\trepositoryformatversion = 0\n\tbare = true\n"
+                        "[uploadpack]\n\tallowFilter = true\n\tallowAnySHA1InWant = true\n")
+    _WriteFileIfChanged(os.path.join(view_dir, "objects", "info", "alternates"), os.path.abspath(objects_dir) + "\n")
+    _WriteFileIfChanged(os.path.join(view_dir, "HEAD"), "ref: {0}\n".format(head))
+    lines = ["# pack-refs with: peeled fully-peeled sorted \n"]
+    for refname in sorted(packed):
+        (objectname, peeled) = packed[refname]
+        lines.append("{0} {1}\n".format(objectname, refname))
+        if peeled:
+            lines.append("^{0}\n".format(peeled))
+    _WriteFileIfChanged(os.path.join(view_dir, "packed-refs"), "".join(lines))
+
+
+def GetServeUrl(cache_dir, url, base_url=None):
+    '''
+    get the url of the serve view of the omnicache for a remote url.
+
+    base_url is the url the serve folder is exported at (for example
+    git://localhost when git daemon is running).  By default a file url
+    of the view is returned.
+
+    return
+        url of the view or None if the url isn't in the omnicache or it isn't served
+    '''
+    config_file = os.path.join(cache_dir, OMNICACHE_FILENAME)
+    if not os.path.isfile(config_file):
+        return None
+    name = OmniCacheConfig(config_file).GetNameForUrl(url)
+    if name is None:
+        return None
+    view_dir = os.path.join(cache_dir, OMNICACHE_SERVE_DIRNAME, _ServeViewName(name))
+    if not os.path.isfile(os.path.join(view_dir, "packed-refs")):
+        return None
+    if base_url is not None:
+        return base_url.rstrip("/") + "/" + _ServeViewName(name)
+    return pathlib.Path(os.path.abspath(view_dir)).as_uri()
+
+
+def RunDaemon(cache_dir, port=None):
+    '''
+    serve the views of the omnicache with git daemon until interrupted.
+    Views are exported at git://<host>[:port]/<name>.git
+
+    return
+        exit code of git daemon
+    '''
+    serve_dir = os.path.join(cache_dir, OMNICACHE_SERVE_DIRNAME)
+    cmd = ["git", "daemon", "--reuseaddr", "--export-all", "--base-path={0}".format(serve_dir)]
+    if port is not None:
+        cmd.append("--port={0}".format(port))
+    cmd.append(serve_dir)
+    logging.critical("Serving OMNICACHE at git://localhost{0}/".format(":{0}".format(port) if port else ""))
+    try:
+        return subprocess.call(cmd)
+    except KeyboardInterrupt:
+        return 0
+
+
 def get_cli_options():
     parser = argparse.ArgumentParser(description='Tool to provide easy method create and manage the OMNICACHE', )
     parser.add_argument(dest="cache_dir", help="path to an existing or desired OMNICACHE directory")
@@ -268,6 +1183,33 @@ def get_cli_options():
                        help="Update the Omnicache.  All cache changes also cause a fetch", default=False)
     group.add_argument("--no-fetch", dest="no_fetch", action="store_true",
                        help="Prevent auto-fetch if implied by other arguments.", default=False)
+    parser.add_argument("--maintain", dest="maintain", action="store_true", default=False,
+                        help="Prune, repack and write the commit-graph and multi-pack-index of the OMNICACHE")
+    parser.add_argument("--full-repack", dest="full_repack", action="store_true", default=False,
+                        help="With --maintain also repack all objects to drop objects only used by removed remotes")
+    parser.add_argument("--batch-size", dest="batch_size", type=int, default=None,
+                        help="With --maintain combine packs up to this many bytes.  "
+                        "Default is one more than the size of the second biggest pack")
+    parser.add_argument("--prune-expire", dest="prune_expire", default="2.weeks.ago",
+                        help="With --maintain prune unreachable objects older than this.  Default is 2.weeks.ago")
+    parser.add_argument("--benchmark", dest="benchmark", default=None,
+                        help="With --maintain time a clone of this url using the OMNICACHE before and after")
+    parser.add_argument("--serve", dest="serve", action="store_true", default=False,
+                        help="Create or refresh the per remote views of the OMNICACHE in <cache_dir>/serve that "
+                             "workspace clones can use instead of the upstream remote")
+    parser.add_argument("--daemon", dest="daemon", action="store_true", default=False,
+                        help="Serve the OMNICACHE views with git daemon.  Implies --serve")
+    parser.add_argument("--port", dest="port", type=int, default=None,
+                        help="Port for --daemon.  Default is the git daemon default (9418)")
+    parser.add_argument("--incremental", dest="incremental", action="store_true", default=False,
+                        help="Only fetch remotes whose refs changed since the last incremental fetch")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=None,
+                        help="Number of remotes to fetch (or folders to scan) in parallel.  "
+                        "Default is 1 for fetches and 8 for scans")
+    parser.add_argument("--timeout", dest="timeout", type=float, default=None,
+                        help="Seconds before a single remote fetch is stopped.  Default is no timeout")
+    parser.add_argument("--retry", dest="retry", type=int, default=0,
+                        help="Number of times to retry a failed remote fetch.  Default is 0")
     parser.add_argument("-r", "--remove", dest="remove", nargs="?", action="append",
                         help="remove config entry from OMNICACHE <name>", default=[])
     parser.add_argument('--version', action='version', version='%(prog)s ' + OMNICACHE_VERSION)
@@ -307,6 +1249,10 @@ def main():
             logging.critical("Invalid -c argument given.  File ({0}) isn't valid".format(args.input_config_file))
             return -4
 
+    # scan dir is resolved before changing to the cache dir
+    if args.scan is not None:
+        args.scan = CommonFilePathHandler(args.scan)
+
     logging.debug("Args: " + str(args))
 
     omnicache_config = None  # config object
@@ -332,84 +1278,116 @@ def main():
         logging.critical("OMNICACHE path invalid.")
         return -2
 
-    # load config
-    omnicache_config = OmniCacheConfig(omnicache_config_file)
-
-    os.chdir(args.cache_dir)
-
-    if(len(args.add) > 0):
-        auto_fetch = True
-        for inputdata in args.add:
-            if len(inputdata) == 2:
-                AddEntry(omnicache_config, inputdata[0], inputdata[1])
-            elif len(inputdata) == 3:
-                AddEntry(omnicache_config, inputdata[0], inputdata[1], bool(inputdata[2]))
-            else:
-                logging.critical("Invalid Add Entry.  Should be <name> <url> <Sync Tags optional default=False>")
-                return -3
-
-    if(args.input_config_file is not None):
-        (count, input_config_remotes) = AddEntriesFromConfig(omnicache_config, args.input_config_file)
-        if(count > 0):
-            auto_fetch = True
-
-    if len(args.remove) > 0:
-        for inputdata in args.remove:
-            RemoveEntry(omnicache_config, inputdata)
-
     # if we need to scan
+    reposFound = None
     if args.scan is not None:
-        logging.critical("OMNICACHE is scanning the folder %s.")
+        logging.critical("OMNICACHE is scanning the folder %s." % args.scan)
         if not os.path.isdir(args.scan):
             logging.error("Invalid scan directory")
             return -4
-        reposFound = dict()
-        # iterate through top level directories
-        dirs = os.listdir(args.scan)
-        while len(dirs) > 0:
-            item = dirs.pop()
-            itemDir = os.path.join(args.scan, item)
-            if os.path.isfile(itemDir):
-                continue
-            logging.info("Scanning %s for a git repo" % item)
-            gitDir = os.path.join(itemDir, ".git")
-            # Check if it's a directory or a file (submodules usually have a file instead of a folder)
-            if os.path.isdir(gitDir) or os.path.isfile(gitDir):
-                repo = MuGit.Repo(itemDir)
-                if repo.url:
-                    if repo.url not in reposFound:
-                        reposFound[repo.url] = item
-                    else:
-                        logging.warning("Skipping previously found repo at %s with url %s" % (item, repo.url))
-                else:  # if repo.url is none
-                    logging.error("Url not found for git repo at: %s" % itemDir)
-                # check for submodules
-                if repo.submodules:
-                    for submodule in repo.submodules:
-                        dirs.append(os.path.join(item, submodule))
-            else:
-                logging.error("Git repo not found at %s" % itemDir)
-        # go through all the URL's I found
-        for url in reposFound:
-            omnicache_config.Add(reposFound[url], url)
-
-    omnicache_config.Save()
+        reposFound = ScanForRepos(args.scan, args.jobs if args.jobs is not None else 8)
+
+    # changes to the config are made while holding the omnicache lock (fetches are not) so
+    # that processes sharing the omnicache don't overwrite each other's changes
+    with OmniCacheLock(args.cache_dir):
+        # load config.  An old config is migrated here while the lock is held.
+        omnicache_config = OmniCacheConfig(omnicache_config_file, migrate=True)
+
+        os.chdir(args.cache_dir)
+
+        if(len(args.add) > 0):
+            auto_fetch = True
+            entries = []
+            for inputdata in args.add:
+                if len(inputdata) == 2:
+                    entries.append((inputdata[0], inputdata[1], False))
+                elif len(inputdata) == 3:
+                    entries.append((inputdata[0], inputdata[1], bool(inputdata[2])))
+                else:
+                    logging.critical("Invalid Add Entry.  Should be <name> <url> <Sync Tags optional default=False>")
+                    return -3
+            if UpdateEntries(omnicache_config, entries) != 0:
+                logging.error("Failed to add remotes")
+
+        if(args.input_config_file is not None):
+            (count, input_config_remotes) = AddEntriesFromConfig(omnicache_config, args.input_config_file)
+            if(count > 0):
+                auto_fetch = True
+
+        if len(args.remove) > 0:
+            if UpdateEntries(omnicache_config, remove=args.remove) != 0:
+                logging.error("Failed to remove remotes")
+
+        if reposFound is not None:
+            entries = [(name, url, False) for (url, name) in reposFound.items()
+                       if not omnicache_config.Contains_url(url)]
+            logging.info("Found %d repos, %d not in OMNICACHE" % (len(reposFound), len(entries)))
+            if UpdateEntries(omnicache_config, entries) != 0:
+                logging.error("Failed to add scanned remotes")
+
+        omnicache_config.Save()
 
     if(args.fetch or (auto_fetch and not args.no_fetch)):
         logging.critical("Updating OMNICACHE")
+        fetch_jobs = args.jobs if args.jobs is not None else 1
         # as an optimization, if input config file provided, only fetch remotes specified in input config
         # otherwise, fetch all remotes in the OmniCache
         if (input_config_remotes is not None):
             remotes = (x["name"] for x in input_config_remotes)
         else:
             remotes = omnicache_config.remotes.keys()
-        for remote in remotes:
-            ret = FetchEntry(omnicache_config.remotes[remote]["name"], ("tag" in omnicache_config.remotes[remote]))
-            if(ret != 0) and (ErrorCode == 0):
-                ErrorCode = ret
+        if args.incremental:
+            refstate = OmniCacheRefState(os.path.join(args.cache_dir, OMNICACHE_REFSTATE_FILENAME))
+            (remotes, digests) = GetChangedEntries(omnicache_config, refstate, remotes, fetch_jobs, args.timeout)
+            fetched = []
+        results = FetchEntries(omnicache_config, remotes, fetch_jobs, args.timeout, args.retry)
+        LogFetchSummary(results)
+        for result in results:
+            if(result.returncode != 0):
+                if(ErrorCode == 0):
+                    ErrorCode = result.returncode
+            elif args.incremental and digests[result.name] is not None:
+                # record the refs seen before the fetch.  If the remote changed since then the next
+                # incremental update will see the difference and fetch it again.
+                refstate.Set(result.name, omnicache_config.remotes[result.name]["url"], digests[result.name])
+                fetched.append(result.name)
+        if args.incremental:
+            with OmniCacheLock(args.cache_dir):
+                # merge with the changes made by other processes since the snapshot was loaded
+                latest = OmniCacheRefState(refstate.filepath)
+                for name in fetched:
+                    latest.states[name] = refstate.states[name]
+                latest.Save(OmniCacheConfig(omnicache_config_file))
+
+    if args.maintain:
+        logging.critical("Maintaining OMNICACHE")
+        logging.warning("Objects pruned from the OMNICACHE can't be used by repos cloned with --reference to it")
+        if args.benchmark is not None:
+            before_seconds = BenchmarkClone(args.cache_dir, args.benchmark)
+        (ret, before, after) = MaintainCache(omnicache_config, args.prune_expire, args.full_repack,
+                                             args.batch_size)
+        LogMaintenanceSummary(before, after)
+        if args.benchmark is not None:
+            after_seconds = BenchmarkClone(args.cache_dir, args.benchmark)
+            if before_seconds is not None and after_seconds is not None:
+                logging.info("  Clone of {0}: {1:.2f}s -> {2:.2f}s".format(
+                    args.benchmark, before_seconds, after_seconds))
+        if (ret != 0) and (ErrorCode == 0):
+            ErrorCode = ret
+
+    # once served the views are kept in sync with every update
+    if args.serve or args.daemon or os.path.isdir(os.path.join(args.cache_dir, OMNICACHE_SERVE_DIRNAME)):
+        logging.critical("Updating OMNICACHE serve views")
+        with OmniCacheLock(args.cache_dir):
+            omnicache_config = OmniCacheConfig(omnicache_config_file)
+            ret = UpdateServeViews(omnicache_config, args.cache_dir)
+        if (ret != 0) and (ErrorCode == 0):
+            ErrorCode = ret
 
     if args.list:
-        ret = ConsistencyCheckCacheConfig(omnicache_config)
+        with OmniCacheLock(args.cache_dir):
+            omnicache_config = OmniCacheConfig(omnicache_config_file)
+            ret = ConsistencyCheckCacheConfig(omnicache_config)
         if (ret != 0) and (ErrorCode == 0):
             ErrorCode = ret
         print("List OMNICACHE content\n")
@@ -423,6 +1401,9 @@ def main():
     print("To use your OMNICACHE with Project Mu builds set the env variable:")
     print("set OMNICACHE_PATH=" + args.cache_dir)
 
+    if args.daemon and ErrorCode == 0:
+        ErrorCode = RunDaemon(args.cache_dir, args.port)
+
     return ErrorCode
 
 
@@ -0,0 +1,155 @@
+# @file ParseCache.py
+# This module caches the results of parsing build files like the DSC, FDF and target.txt.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from MuPythonLibrary.Uefi.EdkII.Parsers.DscParser import DscParser
+
+
+class RecordingDscParser(DscParser):
+    '''
+    DscParser that records every path it resolves, so a ParseCache can tell
+    whether the files it read (or would read) have changed.
+    '''
+
+    def __init__(self):
+        super(RecordingDscParser, self).__init__()
+        self.ResolvedPaths = []
+
+    def FindPath(self, *p):
+        path = super(RecordingDscParser, self).FindPath(*p)
+        self.ResolvedPaths.append([list(p), path])
+        return path
+
+
+class ParseCache(object):
+    '''
+    Cache of the results of parsing a file (like the platform DSC, FDF or target.txt).
+    An entry is only used if the key (the file and all parser inputs) matches, every file
+    that was read has the same content, and every path that was resolved still resolves
+    to the same file.  Only the most recent entry is kept for each cache name.
+    '''
+    VERSION = 1
+
+    def __init__(self, cache_dir, name):
+        self.Logger = logging.getLogger("ParseCache")
+        self.CacheDir = cache_dir
+        self.CachePath = os.path.join(cache_dir, "mu_" + name + "_parse_cache.json")
+
+    @staticmethod
+    def GetKey(*inputs):
+        '''
+        Get a cache key for the parser inputs.  Inputs must be JSON serializable.
+        '''
+        data = json.dumps([ParseCache.VERSION, inputs], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _HashFile(path):
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except (OSError, IOError):
+            return None
+
+    @staticmethod
+    def _GetReadFiles(file_path, resolved_paths):
+        # Paths to INF files are only resolved, never read.  All other
+        # resolved paths are !include files.
+        files = [file_path]
+        for (args, path) in resolved_paths:
+            if not args[-1].lower().endswith(".inf") and path not in files:
+                files.append(path)
+        return files
+
+    def Load(self, key, file_path, parser=None):
+        '''
+        Get the cached result for key.
+        parser must be set up the same way as it was for Save() so paths resolve the same.
+
+        return the result or None if there isn't a valid entry.
+        '''
+        try:
+            with open(self.CachePath, 'r') as f:
+                entry = json.load(f)
+        except (OSError, IOError, ValueError):
+            return None
+
+        try:
+            if entry['key'] != key:
+                self.Logger.debug("Parse cache %s is for different inputs.", self.CachePath)
+                return None
+
+            if parser is not None:
+                # FindPath looks relative to the file being parsed.
+                parser.TargetFilePath = os.path.dirname(os.path.abspath(file_path))
+                for (args, path) in entry['resolved']:
+                    if DscParser.FindPath(parser, *args) != path:
+                        self.Logger.debug("Parse cache %s is out of date. %s moved.", self.CachePath, args)
+                        return None
+
+            for (path, digest) in entry['files'].items():
+                if self._HashFile(path) != digest:
+                    self.Logger.debug("Parse cache %s is out of date. %s changed.", self.CachePath, path)
+                    return None
+
+            return entry['result']
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def Save(self, key, file_path, result, parser=None):
+        '''
+        Save the result of parsing file_path.  If parser resolved any paths (see
+        RecordingDscParser) they are saved as well.
+
+        return True if the cache was written.
+        '''
+        resolved = getattr(parser, "ResolvedPaths", [])
+        entry = {
+            'key': key,
+            'resolved': resolved,
+            'files': {path: self._HashFile(path) for path in self._GetReadFiles(file_path, resolved)},
+            'result': result
+        }
+
+        temp_path = None
+        try:
+            os.makedirs(self.CacheDir, exist_ok=True)
+            # Write to a temp file first so a reader never sees a partial entry.
+            (fd, temp_path) = tempfile.mkstemp(dir=self.CacheDir, prefix=".parse_cache_")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(temp_path, self.CachePath)
+        except (OSError, IOError, TypeError, ValueError) as e:
+            self.Logger.debug("Unable to save parse cache %s: %s", self.CachePath, e)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        return True
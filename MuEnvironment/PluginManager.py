@@ -24,10 +24,16 @@
 # OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ##
+import re
 import sys
 import os
-import imp
 import logging
+import importlib.util
+import threading
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from MuEnvironment import BuildTrace
 
 
 class PluginDescriptor(object):
@@ -35,6 +41,13 @@ class PluginDescriptor(object):
         self.descriptor = t
         self.Obj = None
         self.Name = t["name"]
+        # Names of the plugin interfaces the plugin class inherits from, found without
+        # importing it.  None if they couldn't be found.
+        self.Interfaces = None
+        # True if the plugin hasn't been loaded yet because it wasn't needed.
+        self.Deferred = False
+        # Seconds it took to import the plugin module.  None until it is imported.
+        self.ImportTime = None
 
     def __str__(self):
         return "PLUGIN DESCRIPTOR:{0}".format(self.Name)
@@ -42,62 +55,197 @@ class PluginDescriptor(object):
 
 class PluginManager(object):
 
-    def __init__(self):
+    #
+    # @param max_import_workers - most plugin modules to import at the same time.
+    #                             None lets ThreadPoolExecutor pick.
+    #
+    def __init__(self, max_import_workers=None):
         self.Descriptors = []
+        self.MaxImportWorkers = max_import_workers
+        self._Lock = threading.RLock()
+        # Plugins that haven't been loaded because they weren't needed yet.
+        self._Deferred = []
+        # Loaded plugins of each class, in the order they were added.  The plugin
+        # interfaces are indexed as plugins are added.  Other classes are added
+        # the first time they are asked for.
+        self._Index = {c: [] for c in PLUGIN_INTERFACES}
 
     #
     # Pass tuple of Environment Descriptor dictionaries to be loaded as plugins
     #
-    def SetListOfEnvironmentDescriptors(self, newlist):
+    # @param interfaces - optional list of the plugin classes (like IUefiBuildPlugin) that
+    #                     will be used.  Plugins that don't implement any of them aren't
+    #                     imported until they are asked for.
+    #
+    # The plugin modules are imported at the same time on a thread pool.  The plugins
+    # are then instantiated and added one at a time in the order of the list.
+    #
+    # @return list of the descriptors that failed to load
+    #
+    def SetListOfEnvironmentDescriptors(self, newlist, interfaces=None):
         failed = []
         if newlist is None:
             return []
+        names = None if interfaces is None else set(i.__name__ for i in interfaces)
+        descriptors = []
         for a in newlist:
             b = PluginDescriptor(a)
-            if(self._load(b) == 0):
-                self.Descriptors.append(b)
+            b.descriptor["module_file"] = self._GetModulePath(b)
+            b.Interfaces = self._ScanInterfaces(b)
+            if(names is not None and b.Interfaces is not None and not (b.Interfaces & names)):
+                logging.debug("Not loading plugin %s until it is needed", b.Name)
+                b.Deferred = True
+            descriptors.append(b)
+
+        imports = [b for b in descriptors if not b.Deferred]
+        if(len(imports) > 1 and self.MaxImportWorkers != 1):
+            with ThreadPoolExecutor(max_workers=self.MaxImportWorkers) as pool:
+                modules = dict(zip(imports, pool.map(self._Import, imports)))
+        else:
+            modules = {b: self._Import(b) for b in imports}
+
+        for b in descriptors:
+            if(b.Deferred):
+                with self._Lock:
+                    self.Descriptors.append(b)
+                    self._Deferred.append(b)
+            elif(self._Instantiate(b, *modules[b]) == 0):
+                with self._Lock:
+                    self.Descriptors.append(b)
+                    for (classobj, plugins) in self._Index.items():
+                        if(isinstance(b.Obj, classobj)):
+                            plugins.append(b)
             else:
-                failed.append(a)
+                failed.append(b.descriptor)
+        self.LogImportTimes(imports)
         return failed
 
+    #
+    # Log how long it took to import each plugin, slowest first.
+    #
+    def LogImportTimes(self, descriptors=None, level=logging.DEBUG):
+        if descriptors is None:
+            descriptors = self.Descriptors
+        timed = sorted([a for a in descriptors if a.ImportTime is not None], key=lambda a: -a.ImportTime)
+        if(len(timed) == 0):
+            return
+        logging.log(level, "Plugin import times:")
+        for a in timed:
+            logging.log(level, "  %8.3fs  %s", a.ImportTime, a.Name)
+
     #
     # Return List of all plugins of a given class
     #
     def GetPluginsOfClass(self, classobj):
-        temp = []
-        for a in self.Descriptors:
-            if(isinstance(a.Obj, classobj)):
-                temp.append(a)
-        return temp
+        # a deferred plugin can only be skipped if it's known not to implement the interface
+        for a in list(self._Deferred):
+            if(a.Interfaces is None or classobj not in PLUGIN_INTERFACES or classobj.__name__ in a.Interfaces):
+                self._LoadDeferred(a)
+
+        with self._Lock:
+            if(classobj not in self._Index):
+                self._Index[classobj] = self._FindPluginsOfClass(classobj)
+            # a copy so callers can't change the index
+            return list(self._Index[classobj])
 
     #
     # Return List of all plugins
     #
     def GetAllPlugins(self):
-        return self.Descriptors
+        for a in list(self._Deferred):
+            self._LoadDeferred(a)
+        return [a for a in self.Descriptors if a.Obj is not None]
 
     #
-    # Load and Instantiate the plugin
+    # Load a plugin that wasn't needed when it was added.  Raises an exception if it
+    # fails to load, the same way a plugin that fails to load up front halts the build.
     #
-    def _load(self, PluginDescriptor):
-        PluginDescriptor.Obj = None
+    def _LoadDeferred(self, PluginDescriptor):
+        with self._Lock:
+            if(PluginDescriptor.Deferred):
+                if(self._load(PluginDescriptor) != 0):
+                    # it stays deferred so every caller that needs it finds out
+                    raise Exception("Plugin {0} failed to load.".format(PluginDescriptor.Name))
+                PluginDescriptor.Deferred = False
+                self._Deferred.remove(PluginDescriptor)
+                # rebuild the index so it stays in the order the plugins were added
+                for classobj in self._Index:
+                    self._Index[classobj] = self._FindPluginsOfClass(classobj)
+
+    def _FindPluginsOfClass(self, classobj):
+        return [a for a in self.Descriptors if a.Obj is not None and isinstance(a.Obj, classobj)]
+
+    @staticmethod
+    def _GetModulePath(PluginDescriptor):
         PythonFileName = PluginDescriptor.descriptor["module"] + ".py"
-        PyModulePath = os.path.join(os.path.dirname(os.path.abspath(
+        return os.path.join(os.path.dirname(os.path.abspath(
             PluginDescriptor.descriptor["descriptor_file"])), PythonFileName)
+
+    #
+    # Find the plugin interfaces the plugin class inherits from by looking at its source.
+    # Returns None unless every base class is a plugin interface (or object).
+    #
+    @staticmethod
+    def _ScanInterfaces(PluginDescriptor):
+        try:
+            with open(PluginDescriptor.descriptor["module_file"], "r") as plugin_file:
+                source = plugin_file.read()
+        except (OSError, IOError, UnicodeDecodeError):
+            return None
+
+        matches = re.findall(r"^class\s+" + re.escape(PluginDescriptor.descriptor["module"]) + r"\s*\(([^)]*)\)\s*:",
+                             source, re.MULTILINE)
+        if(len(matches) != 1):
+            return None
+        bases = set(b.strip().split(".")[-1] for b in matches[0].split(",") if b.strip())
+        if(not bases.issubset(PLUGIN_INTERFACE_NAMES | {"object"})):
+            return None
+        return bases - {"object"}
+
+    #
+    # Load and Instantiate the plugin
+    #
+    def _load(self, PluginDescriptor):
+        return self._Instantiate(PluginDescriptor, *self._Import(PluginDescriptor))
+
+    #
+    # Import the plugin module.  Safe to call from a worker thread.
+    #
+    # @return tuple of (module, None) or (None, exc_info) if the import failed
+    #
+    def _Import(self, PluginDescriptor):
+        PyModulePath = self._GetModulePath(PluginDescriptor)
         PluginDescriptor.descriptor["module_file"] = PyModulePath
-        logging.debug("Loading Plugin from %s", PyModulePath)
+        module_name = "UefiBuild_Plugin_" + PluginDescriptor.descriptor["module"]
+        start = time.perf_counter()
         try:
-            with open(PyModulePath, "r") as plugin_file:
-                _module = imp.load_module(
-                    "UefiBuild_Plugin_" + PluginDescriptor.descriptor["module"],
-                    plugin_file,
-                    PyModulePath,
-                    ("py", "r", imp.PY_SOURCE))
+            # the source loader uses (and writes) the bytecode cache in __pycache__
+            spec = importlib.util.spec_from_file_location(module_name, PyModulePath)
+            _module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = _module
+            spec.loader.exec_module(_module)
+            result = (_module, None)
 
         except Exception:
-            exc_info = sys.exc_info()
+            sys.modules.pop(module_name, None)
+            result = (None, sys.exc_info())
+
+        end = time.perf_counter()
+        PluginDescriptor.ImportTime = end - start
+        BuildTrace.GetBuildTrace().AddSpan(PluginDescriptor.Name, "Plugin Import", start, end)
+        return result
+
+    #
+    # Instantiate the plugin from its imported module.  Errors are logged here
+    # (not in the import threads) so they come out in plugin order.
+    #
+    def _Instantiate(self, PluginDescriptor, _module, import_exc_info):
+        PluginDescriptor.Obj = None
+        PyModulePath = PluginDescriptor.descriptor["module_file"]
+        logging.debug("Loading Plugin from %s", PyModulePath)
+        if(_module is None):
             logging.error("Failed to import plugin: %s",
-                          PyModulePath, exc_info=exc_info)
+                          PyModulePath, exc_info=import_exc_info)
             return -1
 
         # Instantiate the plugin
@@ -144,6 +292,21 @@ class IUefiBuildPlugin(object):
         Run Pre build Operation
         '''
         return 0
+
+    ##
+    # Returns true if the pre and post build steps of this plugin can run
+    # at the same time as the steps of other parallel safe plugins.
+    # Plugins that aren't parallel safe run by themselves.
+    ##
+    def IsParallelSafe(self):
+        return False
+
+    ##
+    # Returns a list of the names of plugins whose pre and post build
+    # steps must finish before this plugin's steps run.
+    ##
+    def GetDependencies(self):
+        return []
 ###
 # Plugin that supports Pre and Post Build steps
 ###
@@ -314,6 +477,251 @@ class IMuBuildPlugin(object):
             return []
 
 
+# The plugin interfaces.  PluginManager indexes plugins by these as they are added.
+PLUGIN_INTERFACES = (IUefiBuildPlugin, IDscProcessorPlugin, IUefiHelperPlugin, IMuBuildPlugin)
+# Used to find the kind of a plugin without importing it.
+PLUGIN_INTERFACE_NAMES = frozenset(c.__name__ for c in PLUGIN_INTERFACES)
+
+
+###############################################################################
+##                           PLUGIN SCHEDULER                                ##
+# Supports IUefiBuildPlugin type
+###############################################################################
+class PluginScheduler(object):
+    '''
+    Runs a step (like do_pre_build) for a list of IUefiBuildPlugin descriptors.
+
+    Plugins are run in the order they were loaded, except that a plugin always runs
+    after the plugins named by its GetDependencies().  A plugin that isn't parallel
+    safe runs by itself in the calling thread after everything before it has finished.
+    Parallel safe plugins run on worker threads as soon as their dependencies finish.
+
+    Once a step fails, no new plugins are started.  Log output of the worker threads,
+    and of any threads they start (like the output reader of RunCmd), is held back and
+    written in plugin order, so the log reads the same as if the plugins had run one
+    at a time.
+    '''
+
+    # Guards the threading.Thread.start patch, which is shared by every scheduler
+    # in the process.  See _InheritThreadContext.
+    _ThreadLock = threading.Lock()
+    _ThreadStart = threading.Thread.start
+    _ThreadUsers = 0
+
+    def __init__(self, descriptors, max_workers=None):
+        self.Descriptors = list(descriptors)
+        self.MaxWorkers = max_workers
+        self._Buffers = {}
+
+    @staticmethod
+    def _IsParallelSafe(descriptor):
+        try:
+            return bool(descriptor.Obj.IsParallelSafe())
+        except AttributeError:
+            return False
+
+    @staticmethod
+    def _GetDependencies(descriptor):
+        try:
+            return list(descriptor.Obj.GetDependencies() or [])
+        except AttributeError:
+            return []
+
+    def _GetDependencyIndexes(self):
+        indexes = {d.Name: i for (i, d) in enumerate(self.Descriptors)}
+        dependencies = []
+        for d in self.Descriptors:
+            deps = set()
+            for name in self._GetDependencies(d):
+                if name not in indexes:
+                    logging.warning("Plugin %s depends on %s which isn't loaded.", d.Name, name)
+                elif indexes[name] != indexes[d.Name]:
+                    deps.add(indexes[name])
+            dependencies.append(deps)
+        return dependencies
+
+    #
+    # Return the descriptors in the order they will be started.
+    # Raises ValueError if the dependencies have a cycle.
+    #
+    def GetOrder(self):
+        return [self.Descriptors[i] for i in self._GetOrderIndexes(self._GetDependencyIndexes())]
+
+    def _GetOrderIndexes(self, dependencies):
+        order = []
+        done = set()
+        while len(order) < len(self.Descriptors):
+            ready = [i for i in range(len(self.Descriptors)) if i not in done and dependencies[i] <= done]
+            if len(ready) == 0:
+                names = [self.Descriptors[i].Name for i in range(len(self.Descriptors)) if i not in done]
+                raise ValueError("Plugin dependencies have a cycle: " + ", ".join(names))
+            order.append(ready[0])
+            done.add(ready[0])
+        return order
+
+    def _RunOne(self, step, index):
+        token = _CurrentPlugin.set((self, index))
+        try:
+            return step(self.Descriptors[index])
+        finally:
+            _CurrentPlugin.reset(token)
+
+    #
+    # Threads don't inherit the context of the thread that started them, and RunCmd starts
+    # its output reader itself, so there is no way to hand it the plugin's context.  While
+    # any scheduler runs plugins at the same time, threading.Thread.start is replaced so a
+    # thread started by a plugin worker runs in a copy of the worker's context.  Threads
+    # started by anything else start just like before.  The original start is put back
+    # when the last scheduler is done, unless someone else replaced it in the meantime.
+    #
+    @classmethod
+    def _InheritThreadContext(cls, enable):
+        with cls._ThreadLock:
+            if enable:
+                if cls._ThreadUsers == 0:
+                    cls._ThreadStart = threading.Thread.start
+                    threading.Thread.start = _StartWithContext
+                cls._ThreadUsers += 1
+            else:
+                cls._ThreadUsers -= 1
+                if cls._ThreadUsers == 0 and threading.Thread.start is _StartWithContext:
+                    threading.Thread.start = cls._ThreadStart
+
+    #
+    # Run step(descriptor) for each plugin.  step returns 0 for success.
+    #
+    # @return 0 if all steps succeeded or the return code of the first
+    #         failed step in plugin order.
+    #
+    def Run(self, step):
+        dependencies = self._GetDependencyIndexes()
+        try:
+            order = self._GetOrderIndexes(dependencies)
+        except ValueError as e:
+            logging.error(str(e))
+            return -1
+
+        parallel = [self._IsParallelSafe(d) for d in self.Descriptors]
+        if not any(parallel):
+            # Nothing can run at the same time.  Keep it simple.
+            for index in order:
+                rc = step(self.Descriptors[index])
+                if rc != 0:
+                    return rc
+            return 0
+
+        root = logging.getLogger()
+        router = _PluginLogRouter(self)
+        original_handlers = root.handlers
+        root.handlers = [router]
+        router.OriginalHandlers = original_handlers
+        self._InheritThreadContext(True)
+
+        pending = list(order)
+        running = {}
+        results = {}
+        flushed = 0
+        pool = ThreadPoolExecutor(max_workers=self.MaxWorkers)
+        try:
+            while running or (pending and not any(r != 0 for r in results.values())):
+                failed = any(r != 0 for r in results.values())
+                for index in list(pending):
+                    if failed:
+                        break
+                    if not parallel[index]:
+                        # Runs by itself once everything before it is done.
+                        if index == pending[0] and not running:
+                            pending.remove(index)
+                            try:
+                                results[index] = step(self.Descriptors[index])
+                            except Exception as e:
+                                results[index] = e
+                        break
+                    if dependencies[index] <= set(results.keys()):
+                        pending.remove(index)
+                        self._Buffers[index] = []
+                        running[pool.submit(self._RunOne, step, index)] = index
+
+                if running:
+                    (done, _) = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = running.pop(future)
+                        try:
+                            results[index] = future.result()
+                        except Exception as e:
+                            results[index] = e
+
+                # Write the held back log output of the plugins that are done, in order.
+                while flushed < len(order) and order[flushed] in results:
+                    router.Flush(self._Buffers.pop(order[flushed], []))
+                    flushed += 1
+        finally:
+            pool.shutdown(wait=True)
+            self._InheritThreadContext(False)
+            added_handlers = [h for h in root.handlers if h is not router]
+            root.handlers = original_handlers + added_handlers
+            for index in order[flushed:]:
+                router.Flush(self._Buffers.pop(index, []))
+
+        for index in order:
+            if index in results and results[index] != 0:
+                if isinstance(results[index], Exception):
+                    raise results[index]
+                return results[index]
+        return 0
+
+
+# The (scheduler, plugin index) of the plugin the current thread is running for.
+_CurrentPlugin = contextvars.ContextVar("_CurrentPlugin", default=None)
+
+
+def _StartWithContext(thread):
+    # a thread started for a running plugin runs in a copy of the plugin's context
+    if _CurrentPlugin.get() is not None:
+        context = contextvars.copy_context()
+        run = thread.run
+        thread.run = lambda: context.run(run)
+    PluginScheduler._ThreadStart(thread)
+
+
+class _PluginLogRouter(logging.Handler):
+    '''
+    Root logging handler used while plugins run.  Records logged for a plugin
+    running on a worker thread are held back by the scheduler.  Everything else
+    goes straight to the original handlers.
+    '''
+
+    def __init__(self, scheduler):
+        super(_PluginLogRouter, self).__init__()
+        self.Scheduler = scheduler
+        self.OriginalHandlers = []
+
+    def emit(self, record):
+        # handlers are called on the thread that logged the record
+        current = _CurrentPlugin.get()
+        buffer = None
+        if current is not None and current[0] is self.Scheduler:
+            # None if the plugin is done and its output has been written
+            buffer = self.Scheduler._Buffers.get(current[1])
+        if buffer is not None:
+            buffer.append(record)
+            # Handlers added while the plugins run (like an output stream
+            # opened by the plugin itself) get the record right away.
+            for h in logging.getLogger().handlers:
+                if h is not self and record.levelno >= h.level:
+                    h.handle(record)
+        else:
+            for h in self.OriginalHandlers + logging.getLogger().handlers:
+                if h is not self and record.levelno >= h.level:
+                    h.handle(record)
+
+    def Flush(self, records):
+        for record in records:
+            for h in self.OriginalHandlers:
+                if record.levelno >= h.level:
+                    h.handle(record)
+
+
 ###############################################################################
 ##                           PLUGIN HELPER SUPPORT                           ##
 # Supports IUefiHelperPlugin type
@@ -31,6 +31,7 @@ from MuEnvironment.MuGit import Repo
 import shutil
 import stat
 from MuEnvironment import MuLogging
+from MuEnvironment import Omnicache
 
 # this follows a documented flow chart
 # TODO: include link to flowchart?
@@ -129,18 +130,27 @@ def resolve(file_system_path, dependency, force=False, ignore=False, update_ok=F
 
 ##
 # dependencies is a list of objects - it has Path, Commit, Branch,
+# worktree - materialize commit dependencies as git worktrees of the omnicache rather than full clones
+# serve - clone thru the serve views of the omnicache (omnicache --serve) rather than from the upstream remote
 
 
-def resolve_all(WORKSPACE_PATH, dependencies, force=False, ignore=False, update_ok=False, omnicache_dir=None):
+def resolve_all(WORKSPACE_PATH, dependencies, force=False, ignore=False, update_ok=False, omnicache_dir=None,
+                worktree=False, serve=False):
     logger = logging.getLogger("git")
     packages = []
     if force:
         logger.info("Resolving dependencies by force")
     if update_ok:
         logger.info("Resolving dependencies with updates as needed")
+    if worktree:
+        logger.info("Resolving dependencies as worktrees of the omnicache")
     for dependency in dependencies:
         if "ReferencePath" not in dependency and omnicache_dir:
             dependency["ReferencePath"] = omnicache_dir
+        if "Worktree" not in dependency and worktree:
+            dependency["Worktree"] = True
+        if "Serve" not in dependency and serve:
+            dependency["Serve"] = True
         if "ReferencePath" in dependency:  # make sure that the omnicache dir is relative to the working directory
             dependency["ReferencePath"] = os.path.join(WORKSPACE_PATH, dependency["ReferencePath"])
         git_path = os.path.join(WORKSPACE_PATH, dependency["Path"])
@@ -198,13 +208,40 @@ def clone_repo(abs_file_system_path, DepObj):
     reference = None
     if "ReferencePath" in DepObj and os.path.exists(DepObj["ReferencePath"]):
         reference = os.path.abspath(DepObj["ReferencePath"])
-    result = Repo.clone_from(DepObj["Url"], dest, shallow=shallow, reference=reference)
+
+    if "Worktree" in DepObj and DepObj["Worktree"] is True:
+        # a worktree only costs the checkout since all objects live in the shared bare mirror
+        if reference is None or "Commit" not in DepObj:
+            logger.warning("Worktree requires a ReferencePath and a Commit. Cloning {0} instead.".format(
+                DepObj["Url"]))
+        elif Repo.worktree_from(DepObj["Url"], dest, reference, DepObj["Commit"]) is not None:
+            return dest
+        else:
+            logger.warning("Reattempting to clone instead of adding a worktree. {0}".format(DepObj["Url"]))
+            clear_folder(dest)
+            os.makedirs(dest, exist_ok=True)
+
+    sparse = None
+    if "Sparse" in DepObj and DepObj["Sparse"]:
+        sparse = DepObj["Sparse"]
+
+    serve_url = None
+    if "Serve" in DepObj and DepObj["Serve"] is True and reference is not None:
+        serve_url = Omnicache.GetServeUrl(reference, DepObj["Url"])
+        if serve_url is None:
+            logger.info("{0} is not served by the omnicache. Cloning from the remote.".format(DepObj["Url"]))
+
+    result = Repo.clone_from(DepObj["Url"], dest, shallow=shallow, reference=reference, sparse=sparse,
+                             serve_url=serve_url)
 
     if result is None:
         if "ReferencePath" in DepObj:
             # attempt a retry without the reference
             logger.warning("Reattempting to clone without a reference. {0}".format(DepObj["Url"]))
-            result = Repo.clone_from(DepObj["Url"], dest, shallow=shallow)
+            if os.path.isdir(dest):
+                # a clone that failed to set up its sparse checkout is left behind
+                clear_folder(dest)
+            result = Repo.clone_from(DepObj["Url"], dest, shallow=shallow, sparse=sparse)
             if result is None:
                 return None
 
@@ -213,11 +250,29 @@ def clone_repo(abs_file_system_path, DepObj):
 
 def checkout(abs_file_system_path, dep, repo, update_ok=False, ignore_dep_state_mismatch=False, force=False):
     logger = logging.getLogger("git")
+    sparse = dep["Sparse"] if "Sparse" in dep and dep["Sparse"] else None
+    if update_ok or force:
+        current_sparse = repo.get_sparse_checkout()
+        if sparse is not None and current_sparse != sparse:
+            repo.sparse_checkout(sparse)
+        elif sparse is None and current_sparse is not None:
+            # the descriptor doesn't want a sparse checkout anymore
+            repo.sparse_checkout_disable()
+
     if "Commit" in dep:
         if update_ok or force:
-            repo.fetch()
+            if (repo.worktree or ("Serve" in dep and dep["Serve"] is True)) and repo.has_commit(dep["Commit"]):
+                # the commit came from the omnicache so there is no need to go to the network
+                logger.debug("Commit {0} already present. Skipping fetch".format(dep["Commit"]))
+            elif repo.worktree:
+                # objects land in the shared mirror so only fetch the commit we need
+                repo.fetch("origin", dep["Commit"])
+            else:
+                repo.fetch()
             repo.checkout(commit=dep["Commit"])
-            repo.submodule("update", "--init", "--recursive")
+            if sparse is None:
+                # submodules aren't initialized for a sparse dependency
+                repo.submodule("update", "--init", "--recursive")
         else:
             if repo.head.commit == dep["Commit"]:
                 logger.debug(
@@ -237,7 +292,8 @@ def checkout(abs_file_system_path, dep, repo, update_ok=False, ignore_dep_state_
         if update_ok or force:
             repo.fetch()
             repo.checkout(branch=dep["Branch"])
-            repo.submodule("update", "--init", "--recursive")
+            if sparse is None:
+                repo.submodule("update", "--init", "--recursive")
         else:
             if repo.active_branch == dep["Branch"]:
                 logger.debug(
@@ -27,14 +27,23 @@
 ##
 import os
 import sys
+import json
+import hashlib
 import logging
+import tempfile
 from MuEnvironment import ShellEnvironment
 from MuEnvironment import EnvironmentDescriptorFiles as EDF
 from MuEnvironment import ExternalDependency
+from MuEnvironment import VersionAggregator
 from MuPythonLibrary.UtilityFunctions import GetHostInfo
 
 ENVIRONMENT_BOOTSTRAP_COMPLETE = False
 ENV_STATE = None
+ENV_VERIFIED = False
+ENV_FROM_SNAPSHOT = False
+
+ENV_SNAPSHOT_FILENAME = "ENV_SNAPSHOT.json"
+ENV_SNAPSHOT_VERSION = 1
 
 
 class SelfDescribingEnvironment(object):
@@ -61,6 +70,11 @@ class SelfDescribingEnvironment(object):
         self.extdeps = None
         self.plugins = None
 
+        # Every directory searched and descriptor file found by load_workspace().
+        # Used to tell whether a saved snapshot of the environment is still valid.
+        self.scanned_dirs = []
+        self.descriptor_files = []
+
     def _gather_env_files(self, ext_strings, base_path):
         # Make sure that the search extension matches easily.
         search_files = tuple(ext_string.lower() for ext_string in ext_strings)
@@ -69,6 +83,8 @@ class SelfDescribingEnvironment(object):
         # matching the extension.
         matches = {}
         for root, dirs, files in os.walk(base_path, topdown=True):
+            self.scanned_dirs.append(root)
+
             # Check to see whether any of these directories should be skipped.
             # TODO: Allow these to be passed in via arguments.
             for index, dir in enumerate(dirs):
@@ -97,6 +113,7 @@ class SelfDescribingEnvironment(object):
         #
         env_files = self._gather_env_files(
             ('path_env', 'ext_dep', 'plug_in'), self.workspace)
+        self.descriptor_files = [f for file_list in env_files.values() for f in file_list]
 
         #
         # Now that the files have been found, load them, sort them, and filter them
@@ -258,23 +275,27 @@ def BootstrapEnvironment(workspace, scopes=()):
         # ENVIRONMENT BOOTSTRAP STAGE 2
         # Parse all of the PATH-related descriptor files to make sure that
         # any required tools or Python modules are now available.
+        # The changes are batched so os.environ and sys.path are only updated
+        # once at the end of each stage.
         #
         shell_env = ShellEnvironment.GetEnvironment()
-        build_env.update_simple_paths(shell_env)
+        with shell_env.batch():
+            build_env.update_simple_paths(shell_env)
 
         #
         # ENVIRONMENT BOOTSTRAP STAGE 3
         # Now that the preliminary paths have been loaded,
         # we can load the modules that had greater dependencies.
         #
-        build_env.update_extdep_paths(shell_env)
+        with shell_env.batch():
+            build_env.update_extdep_paths(shell_env)
 
-        # Bind our current execution environment into the shell vars.
-        shell_env.set_shell_var("PYTHON_HOME", os.path.dirname(sys.executable))
-        # MU_DEPRECATED - Support legacy variable for older releases.
-        shell_env.set_shell_var("PYTHON3", sys.executable)
-        # PYTHON_COMMAND is required to be set for Linux
-        shell_env.set_shell_var("PYTHON_COMMAND", sys.executable)
+            # Bind our current execution environment into the shell vars.
+            shell_env.set_shell_var("PYTHON_HOME", os.path.dirname(sys.executable))
+            # MU_DEPRECATED - Support legacy variable for older releases.
+            shell_env.set_shell_var("PYTHON3", sys.executable)
+            # PYTHON_COMMAND is required to be set for Linux
+            shell_env.set_shell_var("PYTHON_COMMAND", sys.executable)
 
         # Debug the environment that was produced.
         shell_env.log_environment()
@@ -287,24 +308,188 @@ def BootstrapEnvironment(workspace, scopes=()):
 
 
 def CleanEnvironment(workspace, scopes=()):
+    global ENV_VERIFIED
+
     # Bootstrap the environment.
     (build_env, shell_env) = BootstrapEnvironment(workspace, scopes)
 
+    # The dependencies are about to change so they need to be verified again.
+    ENV_VERIFIED = False
+
     # Clean all the dependencies.
     build_env.clean_extdeps(shell_env)
 
 
 def UpdateDependencies(workspace, scopes=()):
+    global ENV_VERIFIED
+
     # Bootstrap the environment.
     (build_env, shell_env) = BootstrapEnvironment(workspace, scopes)
 
+    # The dependencies are about to change so they need to be verified again.
+    ENV_VERIFIED = False
+
     # Clean all the dependencies.
     build_env.update_extdeps(shell_env)
 
 
 def VerifyEnvironment(workspace, scopes=()):
+    global ENV_VERIFIED
+
     # Bootstrap the environment.
     (build_env, shell_env) = BootstrapEnvironment(workspace, scopes)
 
+    # An environment restored from a snapshot was verified when it was saved.
+    if ENV_FROM_SNAPSHOT and ENV_VERIFIED:
+        return True
+
     # Clean all the dependencies.
-    return build_env.verify_extdeps(shell_env)
+    ENV_VERIFIED = build_env.verify_extdeps(shell_env)
+    return ENV_VERIFIED
+
+
+#
+# Environment snapshots.
+# A snapshot holds the result of bootstrapping and verifying the environment along with
+# a fingerprint of everything it was built from: the workspace directories, the descriptor
+# files, the extdep state files, the host and the starting PATH/PYTHONPATH.
+# If none of that has changed, the next process can apply the snapshot instead of
+# searching the workspace and parsing the descriptors again.
+#
+def _get_snapshot_fingerprint(build_env, shell_env, dirs, files):
+    initial = shell_env.checkpoints[ShellEnvironment.ShellEnvironment.INITIAL_CHECKPOINT]
+    host = GetHostInfo()
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps([ENV_SNAPSHOT_VERSION, build_env.workspace, list(build_env.scopes), sys.executable,
+                              sys.version, [host.os, host.arch, host.bit], initial['path'],
+                              list(initial['pypath'])]).encode('utf-8'))
+
+    # A directory's mtime changes when anything is added to or removed from it.
+    for d in dirs:
+        try:
+            state = os.stat(d).st_mtime_ns
+        except OSError:
+            state = None
+        hasher.update(json.dumps([d, state]).encode('utf-8'))
+
+    for f in files:
+        try:
+            st = os.stat(f)
+            state = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            state = None
+        hasher.update(json.dumps([f, state]).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+
+def SaveEnvironmentSnapshot(snapshot_path):
+    '''
+    Save the current environment to snapshot_path.
+    Only a bootstrapped and verified environment is saved.
+
+    return True if the snapshot was written.
+    '''
+    if not ENVIRONMENT_BOOTSTRAP_COMPLETE or not ENV_VERIFIED or ENV_FROM_SNAPSHOT:
+        return False
+
+    (build_env, shell_env) = ENV_STATE
+    extdeps = list(build_env._get_extdeps())
+    state_files = [extdep.state_file_path for extdep in extdeps]
+    files = build_env.descriptor_files + state_files
+
+    # The directory holding the snapshot (normally Build) changes on every build,
+    # so it and everything under it are left out of the fingerprint.
+    # Create it first so its parent doesn't change after the fingerprint is taken.
+    snapshot_dir = os.path.dirname(os.path.abspath(snapshot_path))
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+    except OSError as e:
+        logging.warning("Unable to save the environment snapshot '%s': %s" % (snapshot_path, e))
+        return False
+    dirs = [d for d in build_env.scanned_dirs
+            if os.path.abspath(d) != snapshot_dir and not os.path.abspath(d).startswith(snapshot_dir + os.sep)]
+
+    snapshot = {
+        'version': ENV_SNAPSHOT_VERSION,
+        'fingerprint': _get_snapshot_fingerprint(build_env, shell_env, dirs, files),
+        'dirs': dirs,
+        'descriptor_files': build_env.descriptor_files,
+        'state_files': state_files,
+        'extdep_versions': [[extdep.name, extdep.version] for extdep in extdeps],
+        'paths': build_env.paths,
+        'extdeps': build_env.extdeps,
+        'plugins': build_env.plugins,
+        'environment': shell_env.get_snapshot()
+    }
+
+    try:
+        # Write to a temp file first so a reader never sees a partial snapshot.
+        (fd, temp_path) = tempfile.mkstemp(dir=snapshot_dir, prefix=".snapshot_")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(temp_path, snapshot_path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning("Unable to save the environment snapshot '%s': %s" % (snapshot_path, e))
+        return False
+
+    logging.debug("Saved environment snapshot '%s'." % snapshot_path)
+    return True
+
+
+def LoadEnvironmentSnapshot(workspace, scopes=(), snapshot_path=None):
+    '''
+    Restore the environment from snapshot_path if the snapshot is still valid.
+    On success, the environment is bootstrapped and verified.
+
+    return (build_env, shell_env) or None if the environment must be bootstrapped.
+    '''
+    global ENVIRONMENT_BOOTSTRAP_COMPLETE, ENV_STATE, ENV_VERIFIED, ENV_FROM_SNAPSHOT
+
+    if ENVIRONMENT_BOOTSTRAP_COMPLETE:
+        return ENV_STATE
+
+    try:
+        with open(snapshot_path, 'r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get('version') != ENV_SNAPSHOT_VERSION:
+        logging.debug("Environment snapshot '%s' has an unknown version." % snapshot_path)
+        return None
+
+    build_env = SelfDescribingEnvironment(workspace, scopes)
+    shell_env = ShellEnvironment.GetEnvironment()
+    try:
+        files = snapshot['descriptor_files'] + snapshot['state_files']
+        fingerprint = _get_snapshot_fingerprint(build_env, shell_env, snapshot['dirs'], files)
+    except (KeyError, TypeError):
+        fingerprint = None
+    if fingerprint is None or fingerprint != snapshot.get('fingerprint'):
+        logging.debug("Environment snapshot '%s' is out of date." % snapshot_path)
+        return None
+
+    build_env.scanned_dirs = snapshot['dirs']
+    build_env.paths = tuple(snapshot['paths']) if snapshot['paths'] is not None else None
+    build_env.extdeps = tuple(snapshot['extdeps']) if snapshot['extdeps'] is not None else None
+    build_env.plugins = tuple(snapshot['plugins']) if snapshot['plugins'] is not None else None
+    build_env.descriptor_files = snapshot['descriptor_files']
+
+    shell_env.apply_snapshot(snapshot['environment'])
+    shell_env.log_environment()
+
+    # Report the versions that would have been reported while verifying.
+    for (name, version) in snapshot['extdep_versions']:
+        VersionAggregator.GetVersionAggregator().ReportVersion(name, version, VersionAggregator.VersionTypes.INFO)
+
+    logging.debug("Restored environment from snapshot '%s'." % snapshot_path)
+    ENVIRONMENT_BOOTSTRAP_COMPLETE = True
+    ENV_VERIFIED = True
+    ENV_FROM_SNAPSHOT = True
+    ENV_STATE = (build_env, shell_env)
+    return ENV_STATE
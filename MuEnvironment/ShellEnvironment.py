@@ -29,6 +29,7 @@ import os
 import sys
 import copy
 import logging
+import contextlib
 from MuEnvironment import VarDict
 
 LOGGING_GROUP = "EnvDict"
@@ -63,6 +64,17 @@ class ShellEnvironment(metaclass=Singleton):
         self.active_pypath = None
         self.active_buildvars = VarDict.VarDict()
         self.checkpoints = []
+        # True when active_environ is shared with a checkpoint.
+        self._environ_shared = False
+
+        # Change tracking for batched updates.  See batch() and sync().
+        self._batch_depth = 0
+        self._dirty_vars = set()
+        self._path_dirty = False
+        self._pypath_dirty = False
+        # Set indexes for fast PATH/PYTHONPATH membership checks.
+        self._path_index = None
+        self._pypath_index = None
 
         # Grab a copy of the environment as it exists.
         self.import_environment()
@@ -77,6 +89,7 @@ class ShellEnvironment(metaclass=Singleton):
     def import_environment(self):
         # Create a complete copy of os.environ
         self.active_environ = dict()
+        self._environ_shared = False
         for key, value in os.environ.items():
             self.active_environ[key] = value
 
@@ -98,19 +111,63 @@ class ShellEnvironment(metaclass=Singleton):
 
     def export_environment(self):
         # Purge all keys that aren't in the export.
-        for key, value in os.environ.items():
-            if key not in self.active_environ:
-                os.environ.pop(key)
+        for key in [x for x in os.environ.keys() if x not in self.active_environ and x not in ("PATH", "PYTHONPATH")]:
+            os.environ.pop(key)
 
-        # Export all internal keys.
+        # Export all internal keys that changed.
         for key, value in self.active_environ.items():
-            os.environ[key] = value
+            if os.environ.get(key) != value:
+                os.environ[key] = value
 
         # Set the PATH and PYTHONPATH vars.
-        os.environ["PATH"] = os.pathsep.join(self.active_path)
-        os.environ["PYTHONPATH"] = os.pathsep.join(self.active_pypath)
-
+        self._export_path()
+        self._export_pypath()
+        self._dirty_vars.clear()
+
+    def _export_path(self):
+        path = os.pathsep.join(self.active_path)
+        if os.environ.get("PATH") != path:
+            os.environ["PATH"] = path
+        self._path_dirty = False
+
+    def _export_pypath(self):
+        pypath = os.pathsep.join(self.active_pypath)
+        if os.environ.get("PYTHONPATH") != pypath:
+            os.environ["PYTHONPATH"] = pypath
         sys.path = self.active_pypath
+        self._pypath_dirty = False
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        Context manager that holds back changes to os.environ and sys.path
+        until the outermost batch ends.  Use it around a series of updates
+        (like applying all of the environment descriptors) that don't need
+        the live environment.  Call sync() within a batch before anything
+        that needs the live environment (like starting a process).
+        '''
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.sync()
+
+    def sync(self):
+        '''
+        Apply the changes made since the last sync to os.environ and sys.path.
+        '''
+        for key in self._dirty_vars:
+            if key in self.active_environ:
+                os.environ[key] = self.active_environ[key]
+            else:
+                os.environ.pop(key, None)
+        self._dirty_vars.clear()
+        if self._path_dirty:
+            self._export_path()
+        if self._pypath_dirty:
+            self._export_pypath()
 
     def log_environment(self):
         self.logger.debug("FINAL PATH:")
@@ -125,10 +182,14 @@ class ShellEnvironment(metaclass=Singleton):
             environ_list.append("({0}:{1})".format(key, value))
         self.logger.debug(", ".join(environ_list))
 
+    # Checkpoints are copy-on-write.  The environ dict and the VarDict are shared
+    # with the checkpoint until the next change, so checkpoint and restore don't
+    # have to copy every var.
     def checkpoint(self):
         new_index = len(self.checkpoints)
+        self._environ_shared = True
         self.checkpoints.append({
-            'environ': copy.copy(self.active_environ),
+            'environ': self.active_environ,
             'path': self.active_path,
             'pypath': self.active_pypath,
             'buildvars': copy.copy(self.active_buildvars)
@@ -139,7 +200,8 @@ class ShellEnvironment(metaclass=Singleton):
     def restore_checkpoint(self, index):
         if index < len(self.checkpoints):
             chkpt = self.checkpoints[index]
-            self.active_environ = copy.copy(chkpt['environ'])
+            self.active_environ = chkpt['environ']
+            self._environ_shared = True
             self.active_path = chkpt['path']
             self.active_pypath = chkpt['pypath']
             self.active_buildvars = copy.copy(chkpt['buildvars'])
@@ -152,18 +214,71 @@ class ShellEnvironment(metaclass=Singleton):
     def restore_initial_checkpoint(self):
         self.restore_checkpoint(ShellEnvironment.INITIAL_CHECKPOINT)
 
+    #
+    # Snapshot methods.
+    # These methods convert the changes made since the initial checkpoint to and from
+    # plain data, so they can be saved and then applied again by a later process.
+    #
+    def get_snapshot(self):
+        initial_environ = self.checkpoints[ShellEnvironment.INITIAL_CHECKPOINT]['environ']
+        return {
+            'environ': {k: v for (k, v) in self.active_environ.items() if initial_environ.get(k) != v},
+            'removed': [k for k in initial_environ if k not in self.active_environ],
+            'path': list(self.active_path),
+            'pypath': list(self.active_pypath),
+            'buildvars': [[k, en.Value, en.Comment, en.Overrideable]
+                          for (k, en) in self.active_buildvars.Dstore.items()]
+        }
+
+    def apply_snapshot(self, snapshot):
+        environ = dict(self.active_environ)
+        for key in snapshot['removed']:
+            environ.pop(key, None)
+        environ.update(snapshot['environ'])
+
+        buildvars = VarDict.VarDict()
+        for (key, value, comment, overridable) in snapshot['buildvars']:
+            buildvars.SetValue(key, value, comment, overridable)
+
+        self.active_environ = environ
+        self._environ_shared = False
+        self.active_path = list(snapshot['path'])
+        self.active_pypath = list(snapshot['pypath'])
+        self.active_buildvars = buildvars
+
+        self.export_environment()
+
     #
     # Environment manipulation methods.
     # These methods interact with the current environment.
     #
     def _internal_set_path(self, path_elements):
         self.active_path = list(path_elements)
-        os.environ["PATH"] = os.pathsep.join(self.active_path)
+        self._path_index = (self.active_path, len(self.active_path), set(self.active_path))
+        self._path_dirty = True
+        if self._batch_depth == 0:
+            self._export_path()
 
     def _internal_set_pypath(self, path_elements):
         self.active_pypath = list(path_elements)
-        os.environ["PYTHONPATH"] = os.pathsep.join(self.active_pypath)
-        sys.path = self.active_pypath
+        self._pypath_index = (self.active_pypath, len(self.active_pypath), set(self.active_pypath))
+        self._pypath_dirty = True
+        if self._batch_depth == 0:
+            self._export_pypath()
+
+    def _in_path(self, path_element):
+        # The index is rebuilt if active_path was replaced or changed size behind our back.
+        if self._path_index is None or self._path_index[0] is not self.active_path or \
+           self._path_index[1] != len(self.active_path):
+            self._path_index = (self.active_path, len(self.active_path), set(self.active_path))
+        return path_element in self._path_index[2]
+
+    def _in_pypath(self, path_element):
+        # active_pypath is usually sys.path which anyone can change.
+        if self._pypath_index is None or self._pypath_index[0] is not self.active_pypath or \
+           self._pypath_index[1] != len(self.active_pypath):
+            self._pypath_index = (self.active_pypath, len(self.active_pypath), set(self.active_pypath))
+        return path_element in self._pypath_index[2]
 
     def set_path(self, new_path):
         self.logger.debug("Overriding PATH with new value.")
@@ -179,22 +294,22 @@ class ShellEnvironment(metaclass=Singleton):
 
     def append_path(self, path_element):
         self.logger.debug("Appending PATH element '%s'." % path_element)
-        if path_element not in self.active_path:
+        if not self._in_path(path_element):
             self._internal_set_path(self.active_path + [path_element])
 
     def insert_path(self, path_element):
         self.logger.debug("Inserting PATH element '%s'." % path_element)
-        if path_element not in self.active_path:
+        if not self._in_path(path_element):
             self._internal_set_path([path_element] + self.active_path)
 
     def append_pypath(self, path_element):
         self.logger.debug("Appending PYTHONPATH element '%s'." % path_element)
-        if path_element not in self.active_pypath:
+        if not self._in_pypath(path_element):
             self._internal_set_pypath(self.active_pypath + [path_element])
 
     def insert_pypath(self, path_element):
         self.logger.debug("Inserting PYTHONPATH element '%s'." % path_element)
-        if path_element not in self.active_pypath:
+        if not self._in_pypath(path_element):
             self._internal_set_pypath([path_element] + self.active_pypath)
 
     def replace_path_element(self, old_path_element, new_path_element):
@@ -242,8 +357,14 @@ class ShellEnvironment(metaclass=Singleton):
         else:
             self.logger.debug(
                 "Updating SHELL VAR element '%s': '%s'." % (var_name, var_data))
+            if self._environ_shared:
+                self.active_environ = dict(self.active_environ)
+                self._environ_shared = False
             self.active_environ[var_name] = var_data
-            os.environ[var_name] = var_data
+            if self._batch_depth > 0:
+                self._dirty_vars.add(var_name)
+            else:
+                os.environ[var_name] = var_data
 
 
 def GetEnvironment():
@@ -30,18 +30,24 @@
 ##
 
 import os
+import copy
 import logging
 from MuEnvironment.MultipleWorkspace import MultipleWorkspace
 from MuEnvironment import ConfMgmt
 import traceback
 import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from MuEnvironment import ShellEnvironment
+from MuEnvironment import BuildTrace
+from MuEnvironment import BuildThreads
+from MuEnvironment.BuildFingerprint import BuildFingerprint
 from MuPythonLibrary.Uefi.EdkII.Parsers.TargetTxtParser import TargetTxtParser
-from MuPythonLibrary.Uefi.EdkII.Parsers.DscParser import DscParser
+from MuEnvironment.ParseCache import ParseCache, RecordingDscParser
 from MuPythonLibrary.UtilityFunctions import RunCmd
 from MuEnvironment import MuLogging
 from MuEnvironment import PluginManager
+from MuEnvironment import VersionAggregator
 import datetime
 
 
@@ -66,6 +72,8 @@ class UefiBuilder(object):
         self.OutputBuildEnvBeforeBuildToFile = None
         self.Clean = False
         self.UpdateConf = False
+        self.BuildLogFile = None
+        self.ConfPath = None
         self.Helper = PInHelper
         self.PluginManager = PInManager
         if(BuildConfigFile is not None):
@@ -85,15 +93,22 @@ class UefiBuilder(object):
 
             self.Helper.DebugLogRegisteredFunctions()
 
-            ret = self.SetEnv()
+            with BuildTrace.GetBuildTrace().Span("SetEnv"):
+                ret = self.SetEnv()
             if(ret != 0):
                 logging.critical("SetEnv failed")
                 return ret
 
+            targets = self.GetBuildTargets()
+            if(len(targets) > 1):
+                ret = self.BuildTargets(targets)
+                return ret
+
             # clean
             if(self.Clean):
                 MuLogging.log_progress("Cleaning")
-                ret = self.CleanTree()
+                with BuildTrace.GetBuildTrace().Span("Clean"):
+                    ret = self.CleanTree()
                 if(ret != 0):
                     logging.critical("Clean failed")
                     return ret
@@ -102,7 +117,8 @@ class UefiBuilder(object):
             if(self.SkipPreBuild):
                 MuLogging.log_progress("Skipping Pre Build")
             else:
-                ret = self.PreBuild()
+                with BuildTrace.GetBuildTrace().Span("PreBuild"):
+                    ret = self.PreBuild()
                 if(ret != 0):
                     logging.critical("Pre Build failed")
                     return ret
@@ -127,7 +143,8 @@ class UefiBuilder(object):
             if(self.SkipBuild):
                 MuLogging.log_progress("Skipping Build")
             else:
-                ret = self.Build()
+                with BuildTrace.GetBuildTrace().Span("Build"):
+                    ret = self.Build()
 
                 if(ret != 0):
                     logging.critical("Build failed")
@@ -137,7 +154,8 @@ class UefiBuilder(object):
             if(self.SkipPostBuild):
                 MuLogging.log_progress("Skipping Post Build")
             else:
-                ret = self.PostBuild()
+                with BuildTrace.GetBuildTrace().Span("PostBuild"):
+                    ret = self.PostBuild()
                 if(ret != 0):
                     logging.critical("Post Build failed")
                     return ret
@@ -145,7 +163,8 @@ class UefiBuilder(object):
             # flash
             if(self.FlashImage):
                 MuLogging.log_progress("Flashing Image")
-                ret = self.FlashRomImage()
+                with BuildTrace.GetBuildTrace().Span("Flash"):
+                    ret = self.FlashRomImage()
                 if(ret != 0):
                     logging.critical("Flash Image failed")
                     return ret
@@ -207,7 +226,6 @@ class UefiBuilder(object):
         params = "-p " + self.env.GetValue("ACTIVE_PLATFORM")
         params += " -b " + BuildType
         params += " -t " + self.env.GetValue("TOOL_CHAIN_TAG")
-        params += " -n " + self.env.GetValue("MAX_CONCURRENT_THREAD_NUMBER")
 
         # Set the arch flags.  Multiple are split by space
         rt = self.env.GetValue("TARGET_ARCH").split(" ")
@@ -233,34 +251,119 @@ class UefiBuilder(object):
         buildvars = self.env.GetAllBuildKeyValues(BuildType)
         for key, value in buildvars.items():
             params += " -D " + key + "=" + value
-        output_stream = MuLogging.create_output_stream()
-
-        env = ShellEnvironment.ShellEnvironment()
-        # WORKAROUND - Pin the PYTHONHASHSEED so that TianoCore build tools
-        #               have consistent ordering. Addresses incremental builds.
-        pre_build_env_chk = env.checkpoint()
-        env.set_shell_var('PYTHONHASHSEED', '0')
-        env.log_environment()
-        ret = RunCmd("build", params)
-        # WORKAROUND - Undo the workaround.
-        env.restore_checkpoint(pre_build_env_chk)
-
-        problems = MuLogging.scan_compiler_output(output_stream)
-        MuLogging.remove_output_stream(output_stream)
+
+        # skip the build if nothing that goes into it has changed since the last successful one
+        fingerprint = None
+        fingerprint_path = os.path.join(self.env.GetValue("BUILD_OUTPUT_BASE"), "BUILD_FINGERPRINT.json")
+        if(self.env.GetValue("SKIP_BUILD_IF_UNCHANGED", "FALSE").upper() == "TRUE"):
+            with BuildTrace.GetBuildTrace().Span("BuildFingerprint", "Build"):
+                fingerprint = self.GetBuildFingerprint(params)
+                up_to_date = fingerprint.Matches(fingerprint_path)
+            if(up_to_date):
+                MuLogging.log_progress("Build inputs are unchanged since the last build.  Skipping Build")
+                return 0
+        # the outputs are about to change so the old record no longer applies
+        BuildFingerprint.Remove(fingerprint_path)
+
+        # the thread count doesn't change the output so it isn't part of the fingerprint
+        params += " -n " + self.env.GetValue("MAX_CONCURRENT_THREAD_NUMBER")
+        if(self.BuildLogFile is None):
+            output_stream = MuLogging.create_compiler_output_handler()
+
+            env = ShellEnvironment.ShellEnvironment()
+            # WORKAROUND - Pin the PYTHONHASHSEED so that TianoCore build tools
+            #               have consistent ordering. Addresses incremental builds.
+            pre_build_env_chk = env.checkpoint()
+            env.set_shell_var('PYTHONHASHSEED', '0')
+            env.log_environment()
+            ret = RunCmd("build", params)
+            # WORKAROUND - Undo the workaround.
+            env.restore_checkpoint(pre_build_env_chk)
+
+            problems = output_stream.get_problems()
+            MuLogging.remove_output_stream(output_stream)
+        else:
+            # Other targets are building at the same time (see BuildTargets).  The output
+            # goes to this target's own log file, and the shell environment can't change
+            # under the other builds, so the workaround is passed to this build only.
+            environ = dict(os.environ)
+            environ['PYTHONHASHSEED'] = '0'
+            if(self.ConfPath is not None):
+                environ['CONF_PATH'] = self.ConfPath
+            os.makedirs(os.path.dirname(self.BuildLogFile), exist_ok=True)
+            ret = RunCmd("build", params, outfile=self.BuildLogFile, environ=environ, logging_level=logging.DEBUG)
+            with open(self.BuildLogFile, "r") as f:
+                problems = MuLogging.scan_compiler_output(f)
+            problems = [(level, BuildType + ": " + problem) for (level, problem) in problems]
+
         for level, problem in problems:
             logging.log(level, problem)
 
         if(ret != 0):
             return ret
 
+        if(fingerprint is not None):
+            outputs = self.GetBuildOutputs()
+            if(len(outputs) > 0):
+                fingerprint.Save(fingerprint_path, outputs)
+            else:
+                # without outputs there is no way to tell the build output was deleted
+                logging.info("No build outputs found.  The next build won't be skipped.")
+
         return 0
 
+    #
+    # Get the fingerprint of everything that goes into the build: the build command line
+    # (with all -D build vars), the DSC/FDF and all the modules they use, the Conf/*.txt files,
+    # the tool versions that were reported and the environment vars that pick the tools.
+    #
+    def GetBuildFingerprint(self, params):
+        pps = self.pp.split(os.pathsep) if self.pp is not None else []
+        fingerprint = BuildFingerprint(self.ws, pps, self.GetDscInputVars())
+        fingerprint.AddValue("params", params)
+        versions = VersionAggregator.GetVersionAggregator().GetAggregatedVersionInformation()
+        fingerprint.AddValue("versions", sorted(
+            [v["name"], v["version"]] for v in versions.values()
+            if v["type"] in (VersionAggregator.VersionTypes.TOOL.name, VersionAggregator.VersionTypes.BINARY.name)))
+        fingerprint.AddValue("environment", sorted(
+            [k, v] for (k, v) in os.environ.items()
+            if k in ("PATH", "WORKSPACE", "PACKAGES_PATH") or k.endswith(("_PREFIX", "_PATH", "_BIN"))))
+
+        conf = os.path.join(self.ws, "Conf")
+        if(os.path.isdir(conf)):
+            for name in os.listdir(conf):
+                if(name.lower().endswith(".txt")):
+                    fingerprint.AddFile(os.path.join(conf, name))
+
+        fdf = self.env.GetValue("FLASH_DEFINITION")
+        fingerprint.AddPlatform(self.mws.join(self.ws, self.env.GetValue("ACTIVE_PLATFORM")),
+                                self.mws.join(self.ws, fdf) if fdf is not None else None)
+        return fingerprint
+
+    #
+    # Get the files the build made that must be there to skip the next build.
+    # These are the module .efi files of each arch and the flash images if there is an FDF.
+    #
+    def GetBuildOutputs(self):
+        outputs = []
+        output_base = self.env.GetValue("BUILD_OUTPUT_BASE")
+        for arch in (self.env.GetValue("TARGET_ARCH") or "").split():
+            arch_dir = os.path.join(output_base, arch)
+            if(os.path.isdir(arch_dir)):
+                outputs.extend(os.path.join(arch_dir, f) for f in sorted(os.listdir(arch_dir))
+                               if f.lower().endswith(".efi"))
+        fv = os.path.join(output_base, "FV")
+        for (root, dirs, files) in os.walk(fv):
+            outputs.extend(os.path.join(root, f) for f in files)
+        return outputs
+
     def PreBuild(self):
         MuLogging.log_progress("Running Pre Build")
         #
         # Run the plaform pre-build steps.
         #
-        ret = self.PlatformPreBuild()
+        with BuildTrace.GetBuildTrace().Span("PlatformPreBuild", "PreBuild"):
+            ret = self.PlatformPreBuild()
 
         if(ret != 0):
             logging.critical("PlatformPreBuild failed %d" % ret)
@@ -268,29 +371,15 @@ class UefiBuilder(object):
         #
         # run all loaded UefiBuild Plugins
         #
-        for Descriptor in self.PluginManager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin):
-
-            rc = Descriptor.Obj.do_pre_build(self)
-            if(rc != 0):
-                if(rc is None):
-                    logging.error(
-                        "Plugin Failed: %s returned NoneType" % Descriptor.Name)
-                    ret = -1
-                else:
-                    logging.error("Plugin Failed: %s returned %d" %
-                                  (Descriptor.Name, rc))
-                    ret = rc
-                break  # fail on plugin error
-            else:
-                logging.debug("Plugin Success: %s" % Descriptor.Name)
-        return ret
+        return self.RunBuildPlugins(lambda Descriptor: Descriptor.Obj.do_pre_build(self), "PreBuild")
 
     def PostBuild(self):
         MuLogging.log_progress("Running Post Build")
         #
         # Run the platform post-build steps.
         #
-        ret = self.PlatformPostBuild()
+        with BuildTrace.GetBuildTrace().Span("PlatformPostBuild", "PostBuild"):
+            ret = self.PlatformPostBuild()
 
         if(ret != 0):
             logging.critical("PlatformPostBuild failed %d" % ret)
@@ -299,23 +388,34 @@ class UefiBuilder(object):
         #
         # run all loaded UefiBuild Plugins
         #
-        for Descriptor in self.PluginManager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin):
+        return self.RunBuildPlugins(lambda Descriptor: Descriptor.Obj.do_post_build(self), "PostBuild")
 
-            rc = Descriptor.Obj.do_post_build(self)
+    #
+    # Run a build step for all loaded UefiBuild Plugins.  Plugins that are parallel
+    # safe may run at the same time.  Stops at the first plugin that fails.
+    #
+    # @param step - function that runs the step for a plugin descriptor
+    # @param step_name - name of the build step, used for the build trace
+    #
+    # @return 0 for success NonZero for error.
+    #
+    def RunBuildPlugins(self, step, step_name="Plugins"):
+        def run_one(Descriptor):
+            with BuildTrace.GetBuildTrace().Span(Descriptor.Name, "Plugin", step=step_name):
+                rc = step(Descriptor)
             if(rc != 0):
                 if(rc is None):
                     logging.error(
                         "Plugin Failed: %s returned NoneType" % Descriptor.Name)
-                    ret = -1
-                else:
-                    logging.error("Plugin Failed: %s returned %d" %
-                                  (Descriptor.Name, rc))
-                    ret = rc
-                break  # fail on plugin error
-            else:
-                logging.debug("Plugin Success: %s" % Descriptor.Name)
+                    return -1
+                logging.error("Plugin Failed: %s returned %d" %
+                              (Descriptor.Name, rc))
+                return rc
+            logging.debug("Plugin Success: %s" % Descriptor.Name)
+            return 0
 
-        return ret
+        plugins = self.PluginManager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin)
+        return PluginManager.PluginScheduler(plugins).Run(run_one)
 
     def SetEnv(self):
         MuLogging.log_progress("Setting up the Environment")
@@ -354,35 +454,66 @@ class UefiBuilder(object):
             TemplatesForConf = self.mws.join(self.ws, TemplatesForConf)
             logging.debug(
                 "Platform defined override for Template Conf Files: %s", TemplatesForConf)
-        e = ConfMgmt.ConfMgmt(self.UpdateConf, TemplatesForConf)
+        with BuildTrace.GetBuildTrace().Span("ConfMgmt", "SetEnv"):
+            e = ConfMgmt.ConfMgmt(self.UpdateConf, TemplatesForConf)
 
         # parse target file
-        ret = self.ParseTargetFile()
+        with BuildTrace.GetBuildTrace().Span("ParseTargetFile", "SetEnv"):
+            ret = self.ParseTargetFile()
         if(ret != 0):
             logging.critical("ParseTargetFile failed")
             return ret
 
-        ret = e.ToolsDefConfigure()
+        with BuildTrace.GetBuildTrace().Span("ToolsDefConfigure", "SetEnv"):
+            ret = e.ToolsDefConfigure()
         if(ret != 0):
             logging.critical("ParseTargetFile failed")
             return ret
 
-        # parse DSC file
-        ret = self.ParseDscFile()
+        ret = self.SetAutoThreadCount()
+        if(ret != 0):
+            logging.critical("SetAutoThreadCount failed")
+            return ret
+
+        # set environment variables for the build process
+        os.environ["EFI_SOURCE"] = self.ws
+
+        # when building more than one target, BuildTargets sets up each one
+        targets = self.GetBuildTargets()
+        if(len(targets) > 1):
+            return 0
+        if(len(targets) == 1 and not self.env.SetValue("TARGET", targets[0], "From MU_BUILD_TARGETS")):
+            logging.critical("MU_BUILD_TARGETS doesn't match TARGET")
+            return -1
+
+        ret = self.SetDscEnv()
         if(ret != 0):
-            logging.critical("ParseDscFile failed")
             return ret
 
-        # parse FDF file
-        ret = self.ParseFdfFile()
+        return self.SetTargetEnv()
+
+    #
+    # Parse the DSC and FDF files for the current TARGET and set the build vars that come
+    # from them.  The DSC can use $(TARGET) and BLD_<TARGET>_ vars so BuildTargets runs
+    # this again for each target.
+    #
+    def SetDscEnv(self):
+        # parse DSC and FDF files
+        trace = BuildTrace.GetBuildTrace()
+        with trace.Span("ParseDscAndFdfFiles", "SetEnv", target=self.env.GetValue("TARGET")):
+            ret = self.ParseDscAndFdfFiles()
         if(ret != 0):
-            logging.critical("ParseFdfFile failed")
             return ret
 
         # set build output base envs for all builds
         self.env.SetValue("BUILD_OUT_TEMP", os.path.join(
             self.ws, self.env.GetValue("OUTPUT_DIRECTORY")), "Computed in SetEnv")
+        return 0
 
+    #
+    # Set the build vars that depend on TARGET.
+    #
+    def SetTargetEnv(self):
         target = self.env.GetValue("TARGET")
         self.env.SetValue("BUILD_OUTPUT_BASE", os.path.join(self.env.GetValue(
             "BUILD_OUT_TEMP"), target + "_" + self.env.GetValue("TOOL_CHAIN_TAG")), "Computed in SetEnv")
@@ -397,11 +528,182 @@ class UefiBuilder(object):
         self.env.SetValue("BUILDREPORT_FILE", os.path.join(
             self.env.GetValue("BUILD_OUTPUT_BASE"), "BUILD_REPORT.TXT"), True)
 
-        # set environment variables for the build process
-        os.environ["EFI_SOURCE"] = self.ws
+        return 0
+
+    #
+    # If MAX_CONCURRENT_THREAD_NUMBER is AUTO, replace it with a thread count that fits the
+    # cpus and memory this build can use.  MEMORY_PER_BUILD_THREAD_MB is how much memory each
+    # thread is expected to need.  The count and what it was based on are reported to the
+    # VersionAggregator.
+    #
+    def SetAutoThreadCount(self):
+        if((self.env.GetValue("MAX_CONCURRENT_THREAD_NUMBER") or "").upper() != "AUTO"):
+            return 0
+
+        memory_per_thread = self.env.GetValue("MEMORY_PER_BUILD_THREAD_MB",
+                                              str(BuildThreads.DEFAULT_MEMORY_PER_THREAD_MB))
+        if(not memory_per_thread.isdigit() or int(memory_per_thread) < 1):
+            logging.error("MEMORY_PER_BUILD_THREAD_MB must be a number of MB.  Not %s" % memory_per_thread)
+            return -1
+
+        (count, inputs) = BuildThreads.GetAutoThreadCount(int(memory_per_thread))
+        logging.info("Using %d build threads based on %s" % (count, inputs))
+        self.env.AllowOverride("MAX_CONCURRENT_THREAD_NUMBER")
+        self.env.SetValue("MAX_CONCURRENT_THREAD_NUMBER", str(count), "Picked from cpus and memory (AUTO)")
+
+        versions = VersionAggregator.GetVersionAggregator()
+        versions.ReportVersion("MAX_CONCURRENT_THREAD_NUMBER", str(count), VersionAggregator.VersionTypes.INFO)
+        versions.ReportVersion("MAX_CONCURRENT_THREAD_NUMBER inputs",
+                               ", ".join("%s=%s" % (k, v) for (k, v) in sorted(inputs.items())),
+                               VersionAggregator.VersionTypes.INFO)
+        return 0
+
+    #
+    # Get the list of targets from the MU_BUILD_TARGETS build var (like "DEBUG,RELEASE").
+    # An empty list means build the one TARGET.  This isn't BUILD_TARGETS because
+    # that's the list of targets a platform supports in the [Defines] of its DSC.
+    #
+    def GetBuildTargets(self):
+        targets = self.env.GetValue("MU_BUILD_TARGETS")
+        if(targets is None):
+            return []
+        return [t.upper() for t in targets.replace(",", " ").split()]
+
+    #
+    # Build more than one target with the environment SetEnv prepared.
+    # Each target gets its own checkpoint of the build vars and its own parse of the DSC and FDF.
+    # Clean, PreBuild and PostBuild run one target at a time, but the edk2 builds all run at
+    # the same time, each with its share of MAX_CONCURRENT_THREAD_NUMBER, its own log file
+    # and its own copy of Conf (see CopyConf).
+    #
+    # @param targets - list of TARGETs to build
+    #
+    # @return 0 for success NonZero for error.
+    #
+    def BuildTargets(self, targets):
+        if(self.FlashImage):
+            logging.critical("Flash Image only works with a single target")
+            return -1
+
+        trace = BuildTrace.GetBuildTrace()
+        env = ShellEnvironment.GetEnvironment()
+        base = env.checkpoint()
+
+        # split the threads between the targets
+        threads = self.env.GetValue("MAX_CONCURRENT_THREAD_NUMBER")
+        shares = [threads] * len(targets)
+        if(threads is not None and threads.isdigit()):
+            (share, extra) = divmod(int(threads), len(targets))
+            shares = [str(max(1, share + (1 if i < extra else 0))) for i in range(len(targets))]
+
+        checkpoints = []
+        for (target, share) in zip(targets, shares):
+            MuLogging.log_progress("Setting up target %s" % target)
+            env.restore_checkpoint(base)
+            if(not self.env.SetValue("TARGET", target, "From MU_BUILD_TARGETS")):
+                logging.critical("MU_BUILD_TARGETS can't be used when TARGET is set")
+                return -1
+            if(share is not None):
+                # the thread count is the budget for all the targets, even if it was set on the command line
+                self.env.AllowOverride("MAX_CONCURRENT_THREAD_NUMBER")
+                self.env.SetValue("MAX_CONCURRENT_THREAD_NUMBER", share, "Split between MU_BUILD_TARGETS")
+            ret = self.SetDscEnv()
+            if(ret != 0):
+                logging.critical("SetDscEnv failed for %s" % target)
+                return ret
+            ret = self.SetTargetEnv()
+            if(ret != 0):
+                logging.critical("SetTargetEnv failed for %s" % target)
+                return ret
+
+            if(self.Clean):
+                with trace.Span("Clean", target=target):
+                    ret = self.CleanTree()
+                if(ret != 0):
+                    logging.critical("Clean failed for %s" % target)
+                    return ret
+
+            if(not self.SkipPreBuild):
+                with trace.Span("PreBuild", target=target):
+                    ret = self.PreBuild()
+                if(ret != 0):
+                    logging.critical("Pre Build failed for %s" % target)
+                    return ret
+
+            if(self.OutputBuildEnvBeforeBuildToFile is not None):
+                (root, ext) = os.path.splitext(self.OutputBuildEnvBeforeBuildToFile)
+                self.env.PrintAll(root + "_" + target + ext)
+
+            checkpoints.append(env.checkpoint())
+
+        if(self.env.GetValue("GATEDBUILD") is not None) and (self.env.GetValue("GATEDBUILD").upper() == "TRUE"):
+            ShouldGatedBuildRun = self.PlatformGatedBuildShouldHappen()
+            logging.debug("Platform Gated Build Should Run returned: %s" % str(ShouldGatedBuildRun))
+            if(not self.SkipBuild):
+                self.SkipBuild = not ShouldGatedBuildRun
+            if(not self.SkipPostBuild):
+                self.SkipPostBuild = not ShouldGatedBuildRun
+
+        if(self.SkipBuild):
+            MuLogging.log_progress("Skipping Build")
+        else:
+            # each build gets a copy of the builder with its own build vars
+            builders = []
+            for (target, chk) in zip(targets, checkpoints):
+                env.restore_checkpoint(chk)
+                builder = copy.copy(self)
+                builder.env = copy.copy(env.active_buildvars)
+                builder.BuildLogFile = os.path.join(self.ws, "Build", "BUILDLOG_" + target + ".txt")
+                builder.ConfPath = self.CopyConf(os.path.join(builder.env.GetValue("BUILD_OUTPUT_BASE"), "Conf"))
+                builders.append(builder)
+
+            def build_one(builder):
+                with trace.Span("Build", target=builder.env.GetValue("TARGET")):
+                    return builder.Build()
+
+            with ThreadPoolExecutor(max_workers=len(builders)) as pool:
+                results = list(pool.map(build_one, builders))
+
+            for (target, builder) in zip(targets, builders):
+                MuLogging.log_progress("Build log for %s at %s" % (target, builder.BuildLogFile))
+                # a single module build skips post build
+                self.SkipPostBuild = self.SkipPostBuild or builder.SkipPostBuild
+            for (target, ret) in zip(targets, results):
+                if(ret != 0):
+                    logging.critical("Build failed for %s" % target)
+                    return ret
+
+        if(self.SkipPostBuild):
+            MuLogging.log_progress("Skipping Post Build")
+        else:
+            for (target, chk) in zip(targets, checkpoints):
+                env.restore_checkpoint(chk)
+                with trace.Span("PostBuild", target=target):
+                    ret = self.PostBuild()
+                if(ret != 0):
+                    logging.critical("Post Build failed for %s" % target)
+                    return ret
 
         return 0
 
+    #
+    # edk2 build keeps its own cache in Conf/.cache, which builds running at the same time
+    # can't share.  Copy the Conf/*.txt files to a Conf just for one build.  The copy's
+    # .cache is kept between builds and removed with the rest of BUILD_OUTPUT_BASE by CleanTree.
+    #
+    # @param dest - path of the Conf directory to create
+    #
+    # @return dest
+    #
+    def CopyConf(self, dest):
+        conf = os.path.join(self.ws, "Conf")
+        os.makedirs(dest, exist_ok=True)
+        if(os.path.isdir(conf)):
+            for name in os.listdir(conf):
+                if(name.endswith(".txt")):
+                    shutil.copy2(os.path.join(conf, name), dest)
+        return dest
+
     def ParseCustomConfigFile(self):
         fp = self.BuildConfig
         if(os.path.isfile(fp)):
@@ -472,12 +774,21 @@ class UefiBuilder(object):
     # set them so they can be overridden.
     #
     def ParseTargetFile(self):
-        if(os.path.isfile(self.mws.join(self.ws, "Conf", "target.txt"))):
-            # parse TargetTxt File
-            logging.debug("Parse Target.txt file")
-            ttp = TargetTxtParser()
-            ttp.ParseFile(self.mws.join(self.ws, "Conf", "target.txt"))
-            for key, value in ttp.Dict.items():
+        target_file_path = self.mws.join(self.ws, "Conf", "target.txt")
+        if(os.path.isfile(target_file_path)):
+            cache = ParseCache(self.GetParseCacheDir(), "target")
+            key = cache.GetKey(os.path.abspath(target_file_path))
+            target_vars = cache.Load(key, target_file_path)
+            if(target_vars is None):
+                # parse TargetTxt File
+                logging.debug("Parse Target.txt file")
+                ttp = TargetTxtParser()
+                ttp.ParseFile(target_file_path)
+                target_vars = ttp.Dict
+                cache.Save(key, target_file_path, target_vars)
+            else:
+                logging.debug("Using cached parse of Target.txt file")
+            for key, value in target_vars.items():
                 # set env as overrideable
                 self.env.SetValue(key, value, "From Target.txt", True)
 
@@ -499,12 +810,8 @@ class UefiBuilder(object):
             # parse DSC File
             logging.debug(
                 "Parse Active Platform DSC file: {0}".format(dsc_file_path))
-            dscp = DscParser().SetBaseAbsPath(self.ws).SetPackagePaths(
-                self.pp.split(os.pathsep)).SetInputVars(self.env.GetAllBuildKeyValues())
-            dscp.ParseFile(dsc_file_path)
-            for key, value in dscp.LocalVars.items():
-                # set env as overrideable
-                self.env.SetValue(key, value, "From Platform DSC File", True)
+            local_vars = self.ParseDscWithCache("dsc", self.GetDscParser(), dsc_file_path)
+            self.SetDscVars(local_vars)
 
         else:
             logging.error("Failed to find DSC file")
@@ -525,12 +832,9 @@ class UefiBuilder(object):
         if(os.path.isfile(self.mws.join(self.ws, self.env.GetValue("FLASH_DEFINITION")))):
             # parse the FDF file- fdf files have similar syntax to DSC and therefore parser works for both.
             logging.debug("Parse Active Flash Definition (FDF) file")
-            fdfp = DscParser().SetBaseAbsPath(self.ws).SetPackagePaths(
-                self.pp.split(os.pathsep)).SetInputVars(self.env.GetAllBuildKeyValues())
             pa = self.mws.join(self.ws, self.env.GetValue("FLASH_DEFINITION"))
-            fdfp.ParseFile(pa)
-            for key, value in fdfp.LocalVars.items():
-                self.env.SetValue(key, value, "From Platform FDF File", True)
+            local_vars = self.ParseDscWithCache("fdf", self.GetDscParser(), pa)
+            self.SetFdfVars(local_vars)
 
         else:
             logging.error("Failed to find FDF file")
@@ -538,6 +842,119 @@ class UefiBuilder(object):
 
         return 0
 
+    #
+    # Parse the Active platform DSC and FDF files.
+    # If the FDF is already known, both are parsed at the same time.  The FDF parse
+    # assumes the DSC won't change FLASH_DEFINITION or the build vars it was given.
+    # If the DSC does, the FDF is parsed again so the result always matches parsing
+    # them one after the other.
+    #
+    def ParseDscAndFdfFiles(self, parallel=True):
+        fdf = self.env.GetValue("FLASH_DEFINITION")
+        if(parallel and fdf is not None and self.env.GetValue("ACTIVE_PLATFORM") is not None):
+            dsc_file_path = self.mws.join(self.ws, self.env.GetValue("ACTIVE_PLATFORM"))
+            fdf_file_path = self.mws.join(self.ws, fdf)
+            # Platforms that override either parse step get them one at a time.
+            overridden = type(self).ParseDscFile is not UefiBuilder.ParseDscFile
+            overridden = overridden or type(self).ParseFdfFile is not UefiBuilder.ParseFdfFile
+            parallel = (not overridden and os.path.isfile(dsc_file_path) and os.path.isfile(fdf_file_path))
+        else:
+            parallel = False
+
+        if(not parallel):
+            ret = self.ParseDscFile()
+            if(ret != 0):
+                logging.critical("ParseDscFile failed")
+                return ret
+
+            ret = self.ParseFdfFile()
+            if(ret != 0):
+                logging.critical("ParseFdfFile failed")
+                return ret
+            return 0
+
+        logging.debug("Parse Active Platform DSC file: {0}".format(dsc_file_path))
+        logging.debug("Parse Active Flash Definition (FDF) file")
+        dscp = self.GetDscParser()
+        fdfp = self.GetDscParser()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            dsc_job = pool.submit(self.ParseDscWithCache, "dsc", dscp, dsc_file_path)
+            fdf_job = pool.submit(self.ParseDscWithCache, "fdf", fdfp, fdf_file_path)
+            dsc_vars = dsc_job.result()
+            fdf_error = fdf_job.exception()
+
+        self.SetDscVars(dsc_vars)
+
+        if(self.env.GetValue("FLASH_DEFINITION") != fdf or self.GetDscInputVars() != fdfp.InputVars):
+            logging.debug("The DSC file changed the FDF parse inputs.  Parsing the FDF file again.")
+            ret = self.ParseFdfFile()
+            if(ret != 0):
+                logging.critical("ParseFdfFile failed")
+                return ret
+            return 0
+
+        if(fdf_error is not None):
+            raise fdf_error
+        self.SetFdfVars(fdf_job.result())
+        return 0
+
+    #
+    # Get a parser for the DSC or FDF set up with the current build vars.
+    # FDF files have similar syntax to DSC and therefore the parser works for both.
+    #
+    def GetDscParser(self):
+        return RecordingDscParser().SetBaseAbsPath(self.ws).SetPackagePaths(
+            self.pp.split(os.pathsep)).SetInputVars(self.GetDscInputVars())
+
+    #
+    # Get the vars the DSC and FDF are parsed with: the build vars for the current TARGET
+    # plus the TARGET and TOOL_CHAIN_TAG macros edk2 build defines.
+    #
+    def GetDscInputVars(self):
+        input_vars = self.env.GetAllBuildKeyValues()
+        for key in ("TARGET", "TOOL_CHAIN_TAG"):
+            value = self.env.GetValue(key)
+            if(value is not None):
+                input_vars.setdefault(key, value)
+        return input_vars
+
+    def SetDscVars(self, local_vars):
+        for key, value in local_vars.items():
+            # set env as overrideable
+            self.env.SetValue(key, value, "From Platform DSC File", True)
+
+    def SetFdfVars(self, local_vars):
+        for key, value in local_vars.items():
+            self.env.SetValue(key, value, "From Platform FDF File", True)
+
+    #
+    # The parse results are cached in Conf/.cache, which is removed by CleanTree.
+    #
+    def GetParseCacheDir(self):
+        return os.path.join(self.ws, "Conf", ".cache")
+
+    #
+    # Parse a DSC or FDF file with a parser that has been set up but not run.
+    # If the file, its includes, and the parser inputs haven't changed since the
+    # last time, the LocalVars from that parse are returned without parsing.
+    #
+    def ParseDscWithCache(self, name, parser, file_path):
+        cache = ParseCache(self.GetParseCacheDir(), name)
+        key = cache.GetKey(os.path.abspath(file_path), parser.RootPath, parser.PPs, parser.InputVars)
+        start = time.perf_counter()
+        local_vars = cache.Load(key, file_path, parser)
+        if(local_vars is not None):
+            logging.debug("Using cached parse of {0}".format(file_path))
+            BuildTrace.GetBuildTrace().AddSpan("Parse " + name.upper(), "SetEnv", start, time.perf_counter(),
+                                               file=file_path, cached=True)
+            return local_vars
+
+        parser.ParseFile(file_path)
+        cache.Save(key, file_path, parser.LocalVars, parser)
+        BuildTrace.GetBuildTrace().AddSpan("Parse " + name.upper(), "SetEnv", start, time.perf_counter(),
+                                           file=file_path, cached=False)
+        return parser.LocalVars
+
     #
     # Function used to set default values for numerous build
     # flow control variables
@@ -565,6 +982,9 @@ class UefiBuilder(object):
         print(" --skipbuild                 - Skip the build process ")
         print(" --skipprebuild              - Skip prebuild process")
         print(" --skippostbuild             - Skip postbuild process")
+        print(" MAX_CONCURRENT_THREAD_NUMBER=AUTO - Pick the number of build threads from the cpus and memory")
+        print(" MU_BUILD_TARGETS=<t1>,<t2>  - Build more than one TARGET at the same time.  "
+              "MAX_CONCURRENT_THREAD_NUMBER is split between them")
         print(" --FlashRom                  - Flash rom after build.  Only works with single target")
         print(" --FlashOnly                 - Flash rom.  Rom must be built previously.  Only works with single target")
         print(" --UpdateConf                - Update Conf.  Builders Conf files will be "
@@ -32,6 +32,8 @@ import logging
 
 
 class EnvEntry(object):
+    __slots__ = ('Value', 'Comment', 'Overrideable')
+
     def __init__(self, value, comment, overridable=False):
         self.Value = value
         self.Comment = comment
@@ -53,8 +55,8 @@ class EnvEntry(object):
             return True
 
         if(not self.Overrideable):
-            logging.debug("Can't set value [%s] as it isn't overrideable. Previous comment %s" % (
-                value, self.Comment))
+            logging.debug("Can't set value [%s] as it isn't overrideable. Previous comment %s",
+                          value, self.Comment)
             return False
 
         self.Value = value
@@ -70,45 +72,85 @@ class VarDict(object):
     def __init__(self):
         self.Logger = logging.getLogger("EnvDict")
         self.Dstore = {}  # a set of envs
+        # Keys in Dstore that start with BLD_, in Dstore order.
+        self._BuildKeys = {}
+        # Cache of GetAllBuildKeyValues results by build type.
+        self._BuildKeyValues = {}
+        # True when Dstore may be shared with a copy of this VarDict.
+        self._Shared = False
 
     def GetEntry(self, key):
         return self.Dstore.get(key.upper())
 
+    #
+    # Copies are copy-on-write.  The copy shares Dstore (and the EnvEntry objects in it)
+    # with the original until one of them is changed, so making a checkpoint is cheap.
+    # Entries in a shared Dstore must never be changed in place.
+    #
     def __copy__(self):
         new_copy = VarDict()
         new_copy.Logger = self.Logger
 
-        new_copy.Dstore = {}
-        for key in self.Dstore:
-            entry = self.GetEntry(key)
-            value = entry.Value
-            comment = entry.Comment
-            override = entry.Overrideable
-            new_copy.SetValue(key, value, comment, override)
+        new_copy.Dstore = self.Dstore
+        new_copy._BuildKeys = self._BuildKeys
+        # Cached results are never changed in place so the copy can start with them.
+        new_copy._BuildKeyValues = dict(self._BuildKeyValues)
+        new_copy._Shared = True
+        self._Shared = True
         return new_copy
 
+    def _OwnStore(self):
+        if(self._Shared):
+            self.Dstore = dict(self.Dstore)
+            self._BuildKeys = dict(self._BuildKeys)
+            self._Shared = False
+
+    def _StoreEntry(self, key, en):
+        self._OwnStore()
+        self.Dstore[key] = en
+        if(key.startswith("BLD_")):
+            self._BuildKeys[key] = None
+            self._BuildKeyValues = {}
+
     def GetValue(self, k, default=None):
         key = k.upper()
         en = self.GetEntry(key)
         if(en is not None):
-            self.Logger.debug("Key %s found.  Value %s" % (key, en.GetValue()))
-            return en.GetValue()
+            self.Logger.debug("Key %s found.  Value %s", key, en.Value)
+            return en.Value
         else:
-            self.Logger.debug("Key %s not found" % key)
+            self.Logger.debug("Key %s not found", key)
             return default
 
     def SetValue(self, k, v, comment, overridable=False):
         key = k.upper()
         en = self.GetEntry(key)
         value = str(v)
-        self.Logger.debug("Trying to set key %s to value %s" % (k, v))
+        self.Logger.debug("Trying to set key %s to value %s", k, v)
         if(en is None):
             # new entry
-            en = EnvEntry(value, comment, overridable)
-            self.Dstore[key] = en
+            self._StoreEntry(key, EnvEntry(value, comment, overridable))
             return True
 
-        return en.SetValue(value, comment, overridable)
+        if(value == en.Value or not en.Overrideable):
+            # Nothing will change.  Let the entry decide the result.
+            return en.SetValue(value, comment, overridable)
+
+        # Replace rather than update the entry since it may be shared with a copy.
+        self._StoreEntry(key, EnvEntry(value, comment, overridable))
+        return True
+
+    #
+    # Let the next SetValue change a key even if it was set as not overrideable.
+    #
+    def AllowOverride(self, k):
+        key = k.upper()
+        en = self.GetEntry(key)
+        if(en is not None):
+            self.Logger.debug("Allowing override for %s", key)
+            self._StoreEntry(key, EnvEntry(en.Value, en.Comment, True))
+            return True
+        return False
 
     #
     # function used to get a build var value for given key and buildtype
@@ -129,12 +171,12 @@ class VarDict(object):
 
         if(BuildType is None):
             logging.debug(
-                "GetBuildValue - Invalid Parameter BuildType is None and Target Not set. Key is: " + key)
+                "GetBuildValue - Invalid Parameter BuildType is None and Target Not set. Key is: %s", key)
             return None
 
         if(key is None):
             logging.debug(
-                "GetBuildValue - Invalid Parameter key is None. BuildType is: " + BuildType)
+                "GetBuildValue - Invalid Parameter key is None. BuildType is: %s", BuildType)
             return None
 
         ty = BuildType.upper().strip()
@@ -159,6 +201,9 @@ class VarDict(object):
     #  BLD_RELEASE_<YOUR VAR HERE> means build of release type
     #  etc
     #
+    # The result for each build type is cached until a build var is set.
+    # The caller gets its own copy of the dictionary.
+    #
     def GetAllBuildKeyValues(self, BuildType=None):
         returndict = {}
         if(BuildType is None):
@@ -170,23 +215,29 @@ class VarDict(object):
             return returndict
 
         ty = BuildType.upper().strip()
-        logging.debug("Getting all build keys for build type " + ty)
+        cached = self._BuildKeyValues.get(ty)
+        if(cached is not None):
+            return dict(cached)
+
+        logging.debug("Getting all build keys for build type %s", ty)
 
         # get all the generic build options
-        for key, value in self.Dstore.items():
+        for key in self._BuildKeys:
             if(key.startswith("BLD_*_")):
                 k = key[6:]
-                returndict[k] = value.GetValue()
+                returndict[k] = self.Dstore[key].Value
 
         # will override with specific for this build type
         # figure out offset part of key name to strip
         ks = len(ty) + 5
-        for key, value in self.Dstore.items():
-            if(key.startswith("BLD_" + ty + "_")):
+        prefix = "BLD_" + ty + "_"
+        for key in self._BuildKeys:
+            if(key.startswith(prefix)):
                 k = key[ks:]
-                returndict[k] = value.GetValue()
+                returndict[k] = self.Dstore[key].Value
 
-        return returndict
+        self._BuildKeyValues[ty] = returndict
+        return dict(returndict)
 
     def PrintAll(self, fp=None):
         f = None
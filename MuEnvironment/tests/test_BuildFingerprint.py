@@ -0,0 +1,153 @@
+## @file test_BuildFingerprint.py
+# Unit test suite for the BuildFingerprint class.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import os
+import shutil
+import tempfile
+import unittest
+from MuEnvironment.BuildFingerprint import BuildFingerprint
+
+TEST_DSC = """
+[Defines]
+  PLATFORM_NAME = TestPlatform
+
+[LibraryClasses]
+  TestLib|TestPkg/Library/TestLib.inf
+
+[Components]
+  TestPkg/Module/Module.inf
+"""
+
+TEST_FDF = """
+[FV.TestFv]
+  INF  TestPkg/FdfModule/FdfModule.inf
+  FILE FREEFORM = 7E175642-F3AD-490A-9F8A-2E9FC6933DDD {
+    SECTION RAW = TestPkg/Bin/Raw.bin
+  }
+"""
+
+TEST_INF = """
+[Defines]
+  BASE_NAME = {0}
+
+[Sources]
+  {0}.c
+
+[Packages]
+  TestPkg/TestPkg.dec
+"""
+
+FILES = {
+    "TestPkg/Test.dsc": TEST_DSC,
+    "TestPkg/Test.fdf": TEST_FDF,
+    "TestPkg/TestPkg.dec": "[Defines]\n",
+    "TestPkg/Include/Header.h": "#define HEADER 1\n",
+    "TestPkg/Library/TestLib.inf": TEST_INF.format("TestLib"),
+    "TestPkg/Library/TestLib.c": "",
+    "TestPkg/Module/Module.inf": TEST_INF.format("Module"),
+    "TestPkg/Module/Module.c": "",
+    "TestPkg/FdfModule/FdfModule.inf": TEST_INF.format("FdfModule"),
+    "TestPkg/FdfModule/FdfModule.c": "",
+    "TestPkg/Bin/Raw.bin": "raw",
+    "OtherPkg/Other.c": "",
+}
+
+
+class TestBuildFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.ws = tempfile.mkdtemp()
+        for (path, contents) in FILES.items():
+            self.write(path, contents)
+        self.record = os.path.join(self.ws, "Build", "BUILD_FINGERPRINT.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.ws)
+
+    def write(self, path, contents):
+        path = os.path.join(self.ws, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(contents)
+        # make sure the modified time changes even on file systems with coarse times
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+    def get_fingerprint(self, params="-p TestPkg/Test.dsc"):
+        fingerprint = BuildFingerprint(self.ws, [], {"TARGET": "DEBUG"})
+        fingerprint.AddValue("params", params)
+        fingerprint.AddPlatform(os.path.join(self.ws, "TestPkg", "Test.dsc"),
+                                os.path.join(self.ws, "TestPkg", "Test.fdf"))
+        return fingerprint
+
+    def test_closure(self):
+        fingerprint = self.get_fingerprint()
+        files = set(os.path.relpath(f, self.ws).replace(os.sep, "/") for f in fingerprint.Files)
+        self.assertEqual(files, set(f for f in FILES if not f.endswith(".h") and not f.startswith("OtherPkg")))
+        self.assertEqual(fingerprint._GetTrees(), [os.path.join(self.ws, "TestPkg")])
+
+    def test_unchanged_inputs_should_match(self):
+        self.assertTrue(self.get_fingerprint().Save(self.record))
+        self.assertTrue(self.get_fingerprint().Matches(self.record))
+
+    def test_no_record_should_not_match(self):
+        self.assertFalse(self.get_fingerprint().Matches(self.record))
+
+    def test_changed_inputs_should_not_match(self):
+        for path in ["TestPkg/Module/Module.c", "TestPkg/Library/TestLib.c", "TestPkg/Include/Header.h",
+                     "TestPkg/FdfModule/FdfModule.c", "TestPkg/Bin/Raw.bin", "TestPkg/Test.fdf"]:
+            self.get_fingerprint().Save(self.record)
+            self.write(path, FILES[path] + "\n// changed\n")
+            self.assertFalse(self.get_fingerprint().Matches(self.record), path)
+
+    def test_changed_value_should_not_match(self):
+        self.get_fingerprint().Save(self.record)
+        self.assertFalse(self.get_fingerprint("-p TestPkg/Test.dsc -D NEW=1").Matches(self.record))
+
+    def test_unused_file_should_match(self):
+        self.get_fingerprint().Save(self.record)
+        self.write("OtherPkg/Other.c", "// changed\n")
+        self.assertTrue(self.get_fingerprint().Matches(self.record))
+
+    def test_missing_output_should_not_match(self):
+        output = os.path.join(self.ws, "Build", "FV", "TEST.fd")
+        os.makedirs(os.path.dirname(output))
+        open(output, 'w').close()
+        self.get_fingerprint().Save(self.record, [output])
+        self.assertTrue(self.get_fingerprint().Matches(self.record))
+        os.remove(output)
+        self.assertFalse(self.get_fingerprint().Matches(self.record))
+
+    def test_remove(self):
+        self.get_fingerprint().Save(self.record)
+        BuildFingerprint.Remove(self.record)
+        self.assertFalse(os.path.exists(self.record))
+        BuildFingerprint.Remove(self.record)
+
+
+if __name__ == '__main__':
+    unittest.main()
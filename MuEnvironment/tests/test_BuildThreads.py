@@ -0,0 +1,103 @@
+## @file test_BuildThreads.py
+# Unit test suite for the BuildThreads module.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from MuEnvironment import BuildThreads
+
+MB = 1024 * 1024
+
+
+class TestBuildThreads(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.meminfo = os.path.join(self.root, "meminfo")
+        self.write("meminfo", "MemTotal:       32000000 kB\nMemAvailable:    8388608 kB\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, contents):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def get_count(self, memory_per_thread_mb=1024):
+        with mock.patch("MuEnvironment.BuildThreads.GetCpuCount", return_value=(32, 16)):
+            return BuildThreads.GetAutoThreadCount(memory_per_thread_mb, self.root, self.meminfo)
+
+    def test_cgroup_v2_cpu_limit(self):
+        self.write("cpu.max", "250000 100000\n")
+        self.assertEqual(BuildThreads.GetCgroupCpuLimit(self.root), 2.5)
+        self.write("cpu.max", "max 100000\n")
+        self.assertIsNone(BuildThreads.GetCgroupCpuLimit(self.root))
+
+    def test_cgroup_v1_cpu_limit(self):
+        self.write("cpu/cpu.cfs_quota_us", "400000\n")
+        self.write("cpu/cpu.cfs_period_us", "100000\n")
+        self.assertEqual(BuildThreads.GetCgroupCpuLimit(self.root), 4)
+        self.write("cpu/cpu.cfs_quota_us", "-1\n")
+        self.assertIsNone(BuildThreads.GetCgroupCpuLimit(self.root))
+
+    def test_cgroup_memory(self):
+        self.assertIsNone(BuildThreads.GetCgroupMemoryAvailable(self.root))
+        self.write("memory.max", str(4096 * MB))
+        self.write("memory.current", str(1024 * MB))
+        self.assertEqual(BuildThreads.GetCgroupMemoryAvailable(self.root), 3072 * MB)
+        self.write("memory.max", "max")
+        self.assertIsNone(BuildThreads.GetCgroupMemoryAvailable(self.root))
+
+    def test_memory_available(self):
+        self.assertEqual(BuildThreads.GetMemoryAvailable(self.meminfo), 8192 * MB)
+
+    def test_auto_thread_count(self):
+        # 16 cpus allowed and 8GB available
+        (count, inputs) = self.get_count()
+        self.assertEqual(count, 8)
+        self.assertEqual(inputs, {"cpu_count": 32, "cpu_affinity": 16, "cgroup_cpu_limit": None,
+                                  "memory_available_mb": 8192, "memory_per_thread_mb": 1024})
+        self.assertEqual(self.get_count(512)[0], 16)
+
+    def test_auto_thread_count_in_cgroup(self):
+        self.write("cpu.max", "250000 100000\n")
+        self.assertEqual(self.get_count(512)[0], 3)
+        self.write("memory.max", str(2048 * MB))
+        self.write("memory.current", "0")
+        self.assertEqual(self.get_count(512)[0], 3)
+        self.assertEqual(self.get_count(1024)[0], 2)
+
+    def test_auto_thread_count_is_at_least_one(self):
+        self.assertEqual(self.get_count(1024 * 1024)[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+## @file test_BuildTrace.py
+# Unit test suite for the BuildTrace module.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+from MuEnvironment import BuildTrace
+
+
+class TestBuildTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.trace = BuildTrace.BuildTrace()
+
+    def test_span_records_complete_event(self):
+        with self.trace.Span("SetEnv", "build", file="a.dsc"):
+            pass
+        self.assertEqual(len(self.trace.Events), 1)
+        event = self.trace.Events[0]
+        self.assertEqual(event["name"], "SetEnv")
+        self.assertEqual(event["cat"], "build")
+        self.assertEqual(event["ph"], "X")
+        self.assertEqual(event["args"], {"file": "a.dsc"})
+        self.assertGreaterEqual(event["ts"], 0)
+        self.assertGreaterEqual(event["dur"], 0)
+
+    def test_span_records_on_exception(self):
+        with self.assertRaises(ValueError):
+            with self.trace.Span("Build"):
+                raise ValueError("failed")
+        self.assertEqual([e["name"] for e in self.trace.Events], ["Build"])
+
+    def test_nested_spans_are_contained(self):
+        with self.trace.Span("SetEnv"):
+            with self.trace.Span("ParseTargetFile", "SetEnv"):
+                pass
+        events = self.trace.GetChromeTrace()["traceEvents"]
+        self.assertEqual([e["name"] for e in events], ["SetEnv", "ParseTargetFile"])
+        (outer, inner) = events
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+    def test_spans_from_threads(self):
+        # keep every thread alive until all spans are done so thread ids aren't reused
+        barrier = threading.Barrier(8)
+
+        def worker(index):
+            with self.trace.Span("Plugin%d" % index, "Plugin"):
+                pass
+            barrier.wait()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(e["name"] for e in self.trace.Events), sorted("Plugin%d" % i for i in range(8)))
+        self.assertEqual(len(set(e["tid"] for e in self.trace.Events)), 8)
+
+    def test_summary_adds_spans_with_the_same_name(self):
+        self.trace.AddSpan("Lint", "Plugin", 1.0, 2.0)
+        self.trace.AddSpan("Build", "build", 2.0, 5.0)
+        self.trace.AddSpan("Lint", "Plugin", 6.0, 6.5)
+        summary = self.trace.GetSummary()
+        self.assertEqual([(c, n, n2) for (c, n, s, n2) in summary], [("Plugin", "Lint", 2), ("build", "Build", 1)])
+        self.assertAlmostEqual(summary[0][2], 1.5)
+        self.assertAlmostEqual(summary[1][2], 3.0)
+
+    def test_write_chrome_trace(self):
+        with self.trace.Span("Build"):
+            pass
+        temp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp, "BUILDLOG_TRACE.json")
+            self.trace.WriteChromeTrace(path)
+            with open(path, "r") as f:
+                data = json.load(f)
+        finally:
+            shutil.rmtree(temp)
+        self.assertEqual(len(data["traceEvents"]), 1)
+        for field in ("name", "cat", "ph", "ts", "dur", "pid", "tid", "args"):
+            self.assertIn(field, data["traceEvents"][0])
+
+    def test_log_summary(self):
+        self.trace.AddSpan("Build", "build", 0.0, 1.25)
+        with self.assertLogs(level=logging.INFO) as logs:
+            self.trace.LogSummary()
+        self.assertIn("| build | Build | 1.250 | 1 |", logs.output[-1])
+
+    def test_get_build_trace_is_singleton(self):
+        self.assertIs(BuildTrace.GetBuildTrace(), BuildTrace.GetBuildTrace())
+
+
+if __name__ == '__main__':
+    unittest.main()
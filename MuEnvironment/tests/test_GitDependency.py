@@ -34,7 +34,12 @@ import tempfile
 from MuEnvironment import EnvironmentDescriptorFiles as EDF
 from MuEnvironment.GitDependency import GitDependency
 from MuEnvironment import ShellEnvironment
+from MuEnvironment.MuGit import Repo
+from MuPythonLibrary.UtilityFunctions import RunCmd
 import copy
+import json
+import pathlib
+from unittest import mock
 
 test_dir = None
 uptodate_version = "7fd1a60b01f91b314f59955a4e4d4e80d8edf11d"
@@ -258,6 +263,81 @@ class TestGitDependency(unittest.TestCase):
         self.assertFalse(os.path.isdir(ext_dep.contents_dir))
 
 
+class TestGitDependencySparseCheckout(unittest.TestCase):
+    def setUp(self):
+        prep_workspace()
+        # local upstream with a small tools folder and a big folder we don't want
+        self.upstream = os.path.join(test_dir, "upstream")
+        for folder in ["tools", "big"]:
+            os.makedirs(os.path.join(self.upstream, folder))
+            with open(os.path.join(self.upstream, folder, "file.txt"), "w") as out_file:
+                out_file.write(folder)
+        RunCmd("git", "init", workingdir=self.upstream)
+        RunCmd("git", "add .", workingdir=self.upstream)
+        RunCmd("git", "-c user.name=test -c user.email=test@example.com commit -m initial", workingdir=self.upstream)
+        self.commit = Repo(self.upstream).head.commit
+
+    @classmethod
+    def tearDownClass(cls):
+        clean_workspace()
+
+    def _make_ext_dep(self, sparse_checkout):
+        ext_dep_file_path = os.path.join(test_dir, "sparse_ext_dep.json")
+        with open(ext_dep_file_path, "w+") as ext_dep_file:
+            json.dump({"scope": "global", "type": "git", "name": "Sparse",
+                       "source": pathlib.Path(self.upstream).as_uri(), "version": self.commit,
+                       "sparse_checkout": sparse_checkout, "flags": []}, ext_dep_file)
+        ext_dep_descriptor = EDF.ExternDepDescriptor(ext_dep_file_path).descriptor_contents
+        return GitDependency(ext_dep_descriptor)
+
+    def test_fetch_only_sparse_paths(self):
+        ext_dep = self._make_ext_dep(["tools/"])
+        ext_dep.fetch()
+        self.assertTrue(ext_dep.verify(logversion=False))
+        self.assertTrue(os.path.isfile(os.path.join(ext_dep._local_repo_root_path, "tools", "file.txt")))
+        self.assertFalse(os.path.exists(os.path.join(ext_dep._local_repo_root_path, "big")))
+
+    def test_verify_fails_when_sparse_paths_change(self):
+        ext_dep = self._make_ext_dep(["tools"])
+        ext_dep.fetch()
+        self.assertTrue(ext_dep.verify(logversion=False))
+        ext_dep = self._make_ext_dep(["tools", "big"])
+        self.assertFalse(ext_dep.verify(logversion=False))
+        ext_dep.clean()
+        ext_dep.fetch()
+        self.assertTrue(ext_dep.verify(logversion=False))
+        self.assertTrue(os.path.isfile(os.path.join(ext_dep._local_repo_root_path, "big", "file.txt")))
+
+    def test_removing_sparse_checkout_checks_out_everything(self):
+        ext_dep = self._make_ext_dep(["tools"])
+        ext_dep.fetch()
+        ext_dep = self._make_ext_dep(None)
+        self.assertFalse(ext_dep.verify(logversion=False))
+        ext_dep.fetch()
+        self.assertTrue(ext_dep.verify(logversion=False))
+        self.assertIsNone(Repo(ext_dep._local_repo_root_path).get_sparse_checkout())
+        self.assertTrue(os.path.isfile(os.path.join(ext_dep._local_repo_root_path, "big", "file.txt")))
+
+    def test_sparse_checkout_skips_submodules(self):
+        self._make_ext_dep(["tools"]).fetch()
+        with mock.patch.object(Repo, "submodule") as submodule:
+            self._make_ext_dep(["tools", "big"]).fetch()
+            submodule.assert_not_called()
+            self._make_ext_dep(None).fetch()
+            submodule.assert_called_with("update", "--init", "--recursive")
+
+    def test_nested_sparse_paths(self):
+        ext_dep = self._make_ext_dep(["tools/sub", "tools", "big/sub/"])
+        self.assertEqual(ext_dep.sparse_checkout, ["big/sub", "tools"])
+        ext_dep.fetch()
+        self.assertTrue(ext_dep.verify(logversion=False))
+
+    def test_failed_sparse_checkout_fails_the_clone(self):
+        with mock.patch.object(Repo, "sparse_checkout", return_value=False):
+            self.assertIsNone(Repo.clone_from(pathlib.Path(self.upstream).as_uri(),
+                                              os.path.join(test_dir, "failed_sparse"), sparse=["tools"]))
+
+
 class TestGitDependencyUrlPatching(unittest.TestCase):
     TEST_DESCRIPTOR = {
         "descriptor_file": os.path.abspath(__file__),
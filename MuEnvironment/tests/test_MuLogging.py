@@ -3,6 +3,27 @@ from MuEnvironment import MuLogging
 import tempfile
 import unittest
 import logging
+import time
+
+COMPILER_OUTPUT = [
+    "Building ... MdePkg/Library/BaseLib/BaseLib.inf [X64]",
+    "x.c(12): error C2065: 'y': undeclared identifier",
+    "x.c(40): warning C4244: conversion from 'UINT64' to 'UINT32'",
+    "x.obj : error LNK2001: unresolved external symbol",
+    "GenFds.py...  error F000: Failed to generate",
+    "build.py... : error 7000E: Failed to execute command",
+    "   z.c(1): error C1083: cannot open, warning C4005: macro redefinition   ",
+    "no problems here: the errors were fixed",
+]
+EXPECTED_PROBLEMS = [
+    (logging.ERROR, "Compile: Error: x.c(12): error C2065: 'y': undeclared identifier"),
+    (logging.WARNING, "Compile: Warning: x.c(40): warning C4244: conversion from 'UINT64' to 'UINT32'"),
+    (logging.ERROR, "Linker: Error: x.obj : error LNK2001: unresolved external symbol"),
+    (logging.ERROR, "EDK2: Error: GenFds.py...  error F000: Failed to generate"),
+    (logging.ERROR, "Build.py: Error: build.py... : error 7000E: Failed to execute command"),
+    (logging.ERROR, "Compile: Error: z.c(1): error C1083: cannot open, warning C4005: macro redefinition"),
+    (logging.WARNING, "Compile: Warning: z.c(1): error C1083: cannot open, warning C4005: macro redefinition"),
+]
 
 
 class TestMuLogging(unittest.TestCase):
@@ -48,5 +69,66 @@ class TestMuLogging(unittest.TestCase):
         self.assertEqual(num_lines, num_lines2, "We should only have one line")
 
 
+class TestCompilerOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("test_compiler_output")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def test_scan_compiler_output(self):
+        output_stream = MuLogging.create_output_stream(logging_namespace="test_compiler_output")
+        for line in COMPILER_OUTPUT:
+            self.logger.info(line)
+        MuLogging.remove_output_stream(output_stream, "test_compiler_output")
+        self.assertEqual(MuLogging.scan_compiler_output(output_stream), EXPECTED_PROBLEMS)
+
+    def test_compiler_output_handler(self):
+        handler = MuLogging.create_compiler_output_handler(logging_namespace="test_compiler_output")
+        for line in COMPILER_OUTPUT[:3]:
+            self.logger.info(line)
+        # problems are available while the build is still going
+        self.assertEqual(handler.get_problems(), EXPECTED_PROBLEMS[:2])
+        for line in COMPILER_OUTPUT[3:]:
+            self.logger.info(line)
+        MuLogging.remove_output_stream(handler, "test_compiler_output")
+        self.assertEqual(handler.get_problems(), EXPECTED_PROBLEMS)
+
+    def test_compiler_output_handler_multiline_record(self):
+        handler = MuLogging.create_compiler_output_handler(logging_namespace="test_compiler_output")
+        self.logger.info("\n".join(COMPILER_OUTPUT))
+        self.logger.debug(COMPILER_OUTPUT[1])
+        MuLogging.remove_output_stream(handler, "test_compiler_output")
+        self.assertEqual(handler.problems, EXPECTED_PROBLEMS)
+
+    @unittest.skipUnless(os.environ.get("MU_RUN_BENCHMARKS"), "set MU_RUN_BENCHMARKS to run benchmarks")
+    def test_benchmark_compiler_output(self):
+        # records go straight to the handlers so the time is spent on the output, not the logger
+        lines = 2000000
+        output = [COMPILER_OUTPUT[0]] * 999 + COMPILER_OUTPUT[1:2]
+        records = [self.logger.makeRecord(self.logger.name, logging.INFO, __file__, 0, line, None, None)
+                   for line in output]
+
+        output_stream = MuLogging.create_output_stream(logging_namespace="test_compiler_output")
+        MuLogging.remove_output_stream(output_stream, "test_compiler_output")
+        start = time.perf_counter()
+        for i in range(lines):
+            output_stream.handle(records[i % len(records)])
+        problems = MuLogging.scan_compiler_output(output_stream)
+        stream_time = time.perf_counter() - start
+        stream_size = output_stream.stream.tell()
+
+        handler = MuLogging.CompilerOutputHandler()
+        start = time.perf_counter()
+        for i in range(lines):
+            handler.handle(records[i % len(records)])
+        handler_time = time.perf_counter() - start
+
+        self.assertEqual(len(problems), lines // len(output))
+        self.assertEqual(handler.get_problems(), problems)
+        print("\n{0} lines: output stream + scan {1:.2f}s ({2} bytes kept), compiler output handler {3:.2f}s".format(
+            lines, stream_time, stream_size, handler_time))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,139 @@
+## @file test_ParseCache.py
+# Unit test suite for the ParseCache class.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import os
+import shutil
+import tempfile
+import unittest
+from MuEnvironment.ParseCache import ParseCache, RecordingDscParser
+
+TEST_DSC = """
+[Defines]
+  PLATFORM_NAME = TestPlatform
+  OUTPUT_DIRECTORY = Build/$(PLATFORM_NAME)
+  FLASH_DEFINITION = TestPkg/Test.fdf
+!include TestPkg/Include.dsc.inc
+
+[LibraryClasses]
+  TestLib|TestPkg/Library/TestLib.inf
+"""
+
+TEST_INCLUDE = """
+  INCLUDED_VAR = $(TARGET)_included
+"""
+
+
+def write_file(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.ws = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.ws, "Conf", ".cache")
+        self.dsc_path = os.path.join(self.ws, "TestPkg", "Test.dsc")
+        self.include_path = os.path.join(self.ws, "TestPkg", "Include.dsc.inc")
+        write_file(self.dsc_path, TEST_DSC)
+        write_file(self.include_path, TEST_INCLUDE)
+
+    def tearDown(self):
+        shutil.rmtree(self.ws)
+
+    def get_parser(self, target="DEBUG"):
+        return RecordingDscParser().SetBaseAbsPath(self.ws).SetPackagePaths([]).SetInputVars({"TARGET": target})
+
+    def parse(self, parser):
+        cache = ParseCache(self.cache_dir, "dsc")
+        key = cache.GetKey(self.dsc_path, parser.RootPath, parser.PPs, parser.InputVars)
+        result = cache.Load(key, self.dsc_path, parser)
+        if result is not None:
+            return (True, result)
+        parser.ParseFile(self.dsc_path)
+        self.assertTrue(cache.Save(key, self.dsc_path, parser.LocalVars, parser))
+        return (False, parser.LocalVars)
+
+    def test_unchanged_files_should_use_cache(self):
+        (cached, result) = self.parse(self.get_parser())
+        self.assertFalse(cached)
+        self.assertEqual(result["PLATFORM_NAME"], "TestPlatform")
+        self.assertEqual(result["OUTPUT_DIRECTORY"], "Build/TestPlatform")
+        self.assertEqual(result["INCLUDED_VAR"], "DEBUG_included")
+
+        (cached, cached_result) = self.parse(self.get_parser())
+        self.assertTrue(cached)
+        self.assertEqual(cached_result, result)
+
+    def test_recording_parser_should_record_includes(self):
+        parser = self.get_parser()
+        parser.ParseFile(self.dsc_path)
+        resolved = [path for (args, path) in parser.ResolvedPaths]
+        self.assertIn(self.include_path, resolved)
+
+    def test_changed_include_should_invalidate_cache(self):
+        self.parse(self.get_parser())
+        write_file(self.include_path, TEST_INCLUDE + "  NEW_VAR = new\n")
+        (cached, result) = self.parse(self.get_parser())
+        self.assertFalse(cached)
+        self.assertEqual(result["NEW_VAR"], "new")
+
+    def test_changed_dsc_should_invalidate_cache(self):
+        self.parse(self.get_parser())
+        write_file(self.dsc_path, TEST_DSC.replace("TestPlatform", "OtherPlatform"))
+        (cached, result) = self.parse(self.get_parser())
+        self.assertFalse(cached)
+        self.assertEqual(result["PLATFORM_NAME"], "OtherPlatform")
+
+    def test_changed_input_vars_should_invalidate_cache(self):
+        self.parse(self.get_parser())
+        (cached, result) = self.parse(self.get_parser("RELEASE"))
+        self.assertFalse(cached)
+        self.assertEqual(result["INCLUDED_VAR"], "RELEASE_included")
+
+    def test_changed_path_resolution_should_invalidate_cache(self):
+        # Without a workspace path, the include is found next to the DSC.
+        write_file(self.dsc_path, TEST_DSC.replace("!include TestPkg/Include.dsc.inc", "!include Include.dsc.inc"))
+        (cached, result) = self.parse(self.get_parser())
+        self.assertEqual(result["INCLUDED_VAR"], "DEBUG_included")
+        self.assertTrue(self.parse(self.get_parser())[0])
+
+        # A file in the workspace root takes precedence.
+        write_file(os.path.join(self.ws, "Include.dsc.inc"), "  INCLUDED_VAR = root\n")
+        (cached, result) = self.parse(self.get_parser())
+        self.assertFalse(cached)
+        self.assertEqual(result["INCLUDED_VAR"], "root")
+
+    def test_bad_cache_file_should_be_ignored(self):
+        write_file(os.path.join(self.cache_dir, "mu_dsc_parse_cache.json"), "{ not json")
+        self.assertFalse(self.parse(self.get_parser())[0])
+        self.assertTrue(self.parse(self.get_parser())[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,437 @@
+## @file test_PluginManager.py
+# Unit test suite for the PluginManager module.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import threading
+import time
+import importlib.util
+import unittest
+from MuPythonLibrary.UtilityFunctions import RunCmd
+from MuEnvironment import PluginManager
+from MuEnvironment import BuildTrace
+
+BUILD_PLUGIN = """
+from MuEnvironment.PluginManager import IUefiBuildPlugin
+
+
+class {0}(IUefiBuildPlugin):
+    def do_pre_build(self, thebuilder):
+        return 0
+"""
+
+MU_BUILD_PLUGIN = """
+from MuEnvironment import PluginManager
+raise RuntimeError("This plugin shouldn't be imported")
+
+
+class {0}(PluginManager.IMuBuildPlugin,
+          object):
+    pass
+"""
+
+HELPER_BUILD_PLUGIN = """
+from MuEnvironment import PluginManager
+
+
+class {0}(PluginManager.IUefiHelperPlugin, PluginManager.IUefiBuildPlugin):
+    pass
+"""
+
+OTHER_BASE_PLUGIN = """
+from MuEnvironment.PluginManager import IUefiBuildPlugin
+
+
+class Base(IUefiBuildPlugin):
+    pass
+
+
+class {0}(Base):
+    pass
+"""
+
+
+class FakeBuildPlugin(PluginManager.IUefiBuildPlugin):
+    def __init__(self, parallel_safe=False, dependencies=(), rc=0, action=None):
+        self.parallel_safe = parallel_safe
+        self.dependencies = list(dependencies)
+        self.rc = rc
+        self.action = action
+
+    def IsParallelSafe(self):
+        return self.parallel_safe
+
+    def GetDependencies(self):
+        return self.dependencies
+
+    def do_pre_build(self, thebuilder):
+        if self.action is not None:
+            self.action()
+        return self.rc
+
+
+def make_descriptor(name, **kwargs):
+    descriptor = PluginManager.PluginDescriptor({"name": name})
+    descriptor.Obj = FakeBuildPlugin(**kwargs)
+    return descriptor
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestPluginScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = ListHandler()
+        self.root = logging.getLogger()
+        self.old_level = self.root.level
+        self.root.setLevel(logging.DEBUG)
+        self.root.addHandler(self.handler)
+
+    def tearDown(self):
+        self.root.removeHandler(self.handler)
+        self.root.setLevel(self.old_level)
+
+    def run_scheduler(self, descriptors):
+        ran = []
+        lock = threading.Lock()
+
+        def step(descriptor):
+            with lock:
+                ran.append(descriptor.Name)
+            return descriptor.Obj.do_pre_build(None)
+
+        rc = PluginManager.PluginScheduler(descriptors).Run(step)
+        return (rc, ran)
+
+    def test_default_plugins_run_in_order(self):
+        descriptors = [make_descriptor(name) for name in ("a", "b", "c")]
+        self.assertEqual(self.run_scheduler(descriptors), (0, ["a", "b", "c"]))
+
+    def test_dependencies_change_the_order(self):
+        descriptors = [make_descriptor("a", dependencies=["c"]), make_descriptor("b"), make_descriptor("c")]
+        scheduler = PluginManager.PluginScheduler(descriptors)
+        self.assertEqual([d.Name for d in scheduler.GetOrder()], ["b", "c", "a"])
+        self.assertEqual(self.run_scheduler(descriptors), (0, ["b", "c", "a"]))
+
+    def test_dependency_cycle_should_fail(self):
+        descriptors = [make_descriptor("a", dependencies=["b"]), make_descriptor("b", dependencies=["a"])]
+        self.assertEqual(self.run_scheduler(descriptors), (-1, []))
+
+    def test_unknown_dependency_should_be_ignored(self):
+        descriptors = [make_descriptor("a", dependencies=["missing"])]
+        self.assertEqual(self.run_scheduler(descriptors), (0, ["a"]))
+
+    def test_parallel_safe_plugins_should_run_together(self):
+        # Each plugin waits for the other one to start.
+        barrier = threading.Barrier(2, timeout=10)
+        descriptors = [make_descriptor("a", parallel_safe=True, action=barrier.wait),
+                       make_descriptor("b", parallel_safe=True, action=barrier.wait)]
+        (rc, ran) = self.run_scheduler(descriptors)
+        self.assertEqual(rc, 0)
+        self.assertEqual(sorted(ran), ["a", "b"])
+
+    def test_plugins_that_are_not_parallel_safe_should_run_alone(self):
+        active = []
+        overlap = []
+        lock = threading.Lock()
+
+        def action():
+            with lock:
+                active.append(1)
+                if len(active) > 1:
+                    overlap.append(True)
+            threading.Event().wait(0.05)
+            with lock:
+                active.pop()
+
+        descriptors = [make_descriptor("a", parallel_safe=True, action=action),
+                       make_descriptor("b", action=action),
+                       make_descriptor("c", parallel_safe=True, action=action)]
+        (rc, ran) = self.run_scheduler(descriptors)
+        self.assertEqual(rc, 0)
+        self.assertEqual(ran, ["a", "b", "c"])
+        self.assertEqual(overlap, [])
+
+    def test_dependent_plugin_should_wait(self):
+        finished = threading.Event()
+
+        def slow():
+            threading.Event().wait(0.05)
+            finished.set()
+
+        def check():
+            self.assertTrue(finished.is_set())
+
+        descriptors = [make_descriptor("a", parallel_safe=True, action=slow),
+                       make_descriptor("b", parallel_safe=True, dependencies=["a"], action=check)]
+        self.assertEqual(self.run_scheduler(descriptors), (0, ["a", "b"]))
+
+    def test_failure_should_stop_later_plugins(self):
+        descriptors = [make_descriptor("a", parallel_safe=True, rc=5),
+                       make_descriptor("b"),
+                       make_descriptor("c", parallel_safe=True)]
+        (rc, ran) = self.run_scheduler(descriptors)
+        self.assertEqual(rc, 5)
+        self.assertEqual(ran, ["a"])
+
+    def test_first_failure_in_order_should_be_returned(self):
+        barrier = threading.Barrier(2, timeout=10)
+        descriptors = [make_descriptor("a", parallel_safe=True, rc=1, action=barrier.wait),
+                       make_descriptor("b", parallel_safe=True, rc=2, action=barrier.wait)]
+        self.assertEqual(self.run_scheduler(descriptors)[0], 1)
+
+    def test_exception_should_be_raised(self):
+        def fail():
+            raise RuntimeError("plugin exception")
+
+        descriptors = [make_descriptor("a", parallel_safe=True, action=fail),
+                       make_descriptor("b", parallel_safe=True)]
+        with self.assertRaises(RuntimeError):
+            self.run_scheduler(descriptors)
+        self.assertIn(self.handler, self.root.handlers)
+
+    def test_log_output_should_be_in_plugin_order(self):
+        b_logged = threading.Event()
+
+        def log_a():
+            # Log after b so the output would be out of order without buffering.
+            b_logged.wait(10)
+            logging.info("a message 1")
+            logging.info("a message 2")
+
+        def log_b():
+            logging.info("b message")
+            b_logged.set()
+
+        descriptors = [make_descriptor("a", parallel_safe=True, action=log_a),
+                       make_descriptor("b", parallel_safe=True, action=log_b)]
+        self.assertEqual(self.run_scheduler(descriptors)[0], 0)
+        messages = [m for m in self.handler.messages if " message" in m]
+        self.assertEqual(messages, ["a message 1", "a message 2", "b message"])
+        self.assertIn(self.handler, self.root.handlers)
+
+    def test_run_cmd_output_should_be_in_plugin_order(self):
+        # RunCmd logs the command output from a thread of its own
+        script = ("import sys, time\n"
+                  "for i in range(3):\n"
+                  "    print(sys.argv[1] + ' out', i, flush=True)\n"
+                  "    time.sleep(0.1)\n")
+        script_path = os.path.join(tempfile.mkdtemp(), "print_lines.py")
+        with open(script_path, "w") as f:
+            f.write(script)
+
+        def run(name):
+            def action():
+                logging.info("%s start" % name)
+                self.assertEqual(RunCmd(sys.executable, '"%s" %s' % (script_path, name)), 0)
+                logging.info("%s end" % name)
+            return action
+
+        def start_thread():
+            thread = threading.Thread(target=lambda: None)
+            thread.start()
+            thread.join()
+            threads.append(thread)
+        threads = []
+
+        start = threading.Thread.start
+        descriptors = [make_descriptor("a", parallel_safe=True, action=run("a")),
+                       make_descriptor("b", parallel_safe=True, action=run("b")),
+                       make_descriptor("c", action=start_thread)]
+        try:
+            self.assertEqual(self.run_scheduler(descriptors)[0], 0)
+        finally:
+            shutil.rmtree(os.path.dirname(script_path))
+        messages = [m for m in self.handler.messages if m.startswith(("a ", "b "))]
+        self.assertEqual(messages, ["a start", "a out 0", "a out 1", "a out 2", "a end",
+                                    "b start", "b out 0", "b out 1", "b out 2", "b end"])
+        self.assertIs(threading.Thread.start, start)
+        # only threads started by plugin workers are changed
+        self.assertNotIn("run", vars(threads[0]))
+
+
+class TestPluginManagerLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        for name in list(sys.modules.keys()):
+            if name.startswith("UefiBuild_Plugin_Test"):
+                del sys.modules[name]
+
+    def add_plugin(self, module, source):
+        path = os.path.join(self.root, module)
+        os.makedirs(path)
+        with open(os.path.join(path, module + ".py"), "w") as f:
+            f.write(source.format(module))
+        return {"name": module + " Name", "module": module,
+                "descriptor_file": os.path.join(path, module + "_plug_in.json")}
+
+    def test_load_plugin(self):
+        descriptor = self.add_plugin("TestBuild", BUILD_PLUGIN)
+        manager = PluginManager.PluginManager()
+        self.assertEqual(manager.SetListOfEnvironmentDescriptors([descriptor]), [])
+        plugins = manager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin)
+        self.assertEqual([p.Name for p in plugins], ["TestBuild Name"])
+        self.assertEqual(plugins[0].Interfaces, {"IUefiBuildPlugin"})
+        self.assertIn("UefiBuild_Plugin_TestBuild", sys.modules)
+        if not sys.dont_write_bytecode:
+            self.assertTrue(os.path.isfile(importlib.util.cache_from_source(descriptor["module_file"])))
+
+    def test_failed_plugin(self):
+        descriptor = self.add_plugin("TestFailed", BUILD_PLUGIN + "\nraise RuntimeError('failed')\n")
+        manager = PluginManager.PluginManager()
+        with self.assertLogs(level=logging.ERROR):
+            self.assertEqual(manager.SetListOfEnvironmentDescriptors([descriptor]), [descriptor])
+        self.assertNotIn("UefiBuild_Plugin_TestFailed", sys.modules)
+        self.assertEqual(manager.GetAllPlugins(), [])
+
+    def test_unneeded_plugin_is_not_imported(self):
+        build = self.add_plugin("TestBuild", BUILD_PLUGIN)
+        mu_build = self.add_plugin("TestMuBuild", MU_BUILD_PLUGIN)
+        manager = PluginManager.PluginManager()
+        failed = manager.SetListOfEnvironmentDescriptors([build, mu_build], [PluginManager.IUefiBuildPlugin])
+        self.assertEqual(failed, [])
+        self.assertEqual(len(manager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin)), 1)
+        self.assertNotIn("UefiBuild_Plugin_TestMuBuild", sys.modules)
+
+        # it is imported (and fails) once it is asked for
+        with self.assertLogs(level=logging.ERROR):
+            with self.assertRaisesRegex(Exception, "TestMuBuild Name failed to load"):
+                manager.GetPluginsOfClass(PluginManager.IMuBuildPlugin)
+            with self.assertRaises(Exception):
+                manager.GetAllPlugins()
+        # plugins that don't need it still work
+        self.assertEqual(len(manager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin)), 1)
+
+    def test_plugin_with_other_base_is_imported(self):
+        descriptor = self.add_plugin("TestOtherBase", OTHER_BASE_PLUGIN)
+        manager = PluginManager.PluginManager()
+        self.assertEqual(manager.SetListOfEnvironmentDescriptors([descriptor], [PluginManager.IMuBuildPlugin]), [])
+        self.assertIn("UefiBuild_Plugin_TestOtherBase", sys.modules)
+        self.assertIsNone(manager.Descriptors[0].Interfaces)
+        self.assertEqual(len(manager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin)), 1)
+
+    def test_plugins_of_class_are_indexed_in_order(self):
+        mu_build = MU_BUILD_PLUGIN.replace("raise RuntimeError", "# raise RuntimeError")
+        descriptors = [self.add_plugin("TestBuild1", BUILD_PLUGIN),
+                       self.add_plugin("TestMuBuild", mu_build),
+                       self.add_plugin("TestHelperBuild", HELPER_BUILD_PLUGIN),
+                       self.add_plugin("TestBuild2", BUILD_PLUGIN)]
+        manager = PluginManager.PluginManager()
+        self.assertEqual(manager.SetListOfEnvironmentDescriptors(descriptors, [PluginManager.IUefiBuildPlugin]), [])
+
+        build = manager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin)
+        self.assertEqual([p.Name for p in build], ["TestBuild1 Name", "TestHelperBuild Name", "TestBuild2 Name"])
+        helper = manager.GetPluginsOfClass(PluginManager.IUefiHelperPlugin)
+        self.assertEqual([p.Name for p in helper], ["TestHelperBuild Name"])
+        self.assertEqual(manager.GetPluginsOfClass(PluginManager.IDscProcessorPlugin), [])
+
+        # the caller gets a copy
+        build.clear()
+        self.assertEqual(len(manager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin)), 3)
+
+        # other classes are indexed the first time they're asked for
+        helper_class = type(helper[0].Obj)
+        self.assertNotIn(helper_class, manager._Index)
+        self.assertEqual(manager.GetPluginsOfClass(helper_class), helper)
+        self.assertIn(helper_class, manager._Index)
+
+    def test_deferred_plugin_is_indexed_in_order(self):
+        mu_build = MU_BUILD_PLUGIN.replace("raise RuntimeError", "# raise RuntimeError")
+        descriptors = [self.add_plugin("TestMuBuild", mu_build),
+                       self.add_plugin("TestBuild", BUILD_PLUGIN)]
+        manager = PluginManager.PluginManager()
+        self.assertEqual(manager.SetListOfEnvironmentDescriptors(descriptors, [PluginManager.IUefiBuildPlugin]), [])
+        self.assertEqual(manager.GetPluginsOfClass(PluginManager.IUefiBuildPlugin), [manager.Descriptors[1]])
+        self.assertTrue(manager.Descriptors[0].Deferred)
+        self.assertEqual(manager.GetPluginsOfClass(PluginManager.IMuBuildPlugin), [manager.Descriptors[0]])
+        self.assertEqual(manager.GetPluginsOfClass(object), manager.Descriptors)
+
+    def test_plugins_are_imported_at_the_same_time(self):
+        slow = "import time\ntime.sleep(0.5)\n" + BUILD_PLUGIN
+        descriptors = [self.add_plugin("TestSlow%d" % i, slow) for i in range(4)]
+        manager = PluginManager.PluginManager(max_import_workers=4)
+        start = time.perf_counter()
+        self.assertEqual(manager.SetListOfEnvironmentDescriptors(descriptors), [])
+        self.assertLess(time.perf_counter() - start, 1.5)
+        self.assertEqual([p.Name for p in manager.GetAllPlugins()], [d["name"] for d in descriptors])
+
+    def test_failed_import_keeps_the_order(self):
+        failing = BUILD_PLUGIN + "\nraise RuntimeError('failed')\n"
+        descriptors = [self.add_plugin("TestBuild1", BUILD_PLUGIN),
+                       self.add_plugin("TestFailed1", failing),
+                       self.add_plugin("TestBuild2", BUILD_PLUGIN),
+                       self.add_plugin("TestFailed2", failing),
+                       self.add_plugin("TestBuild3", BUILD_PLUGIN)]
+        for workers in (None, 1):
+            manager = PluginManager.PluginManager(max_import_workers=workers)
+            with self.assertLogs(level=logging.ERROR) as logs:
+                failed = manager.SetListOfEnvironmentDescriptors(descriptors)
+            self.assertEqual(failed, [descriptors[1], descriptors[3]])
+            self.assertEqual([p.Name for p in manager.GetAllPlugins()],
+                             ["TestBuild1 Name", "TestBuild2 Name", "TestBuild3 Name"])
+            self.assertIn("TestFailed1", logs.output[0])
+            self.assertIn("TestFailed2", logs.output[1])
+
+    def test_import_times_are_reported(self):
+        descriptors = [self.add_plugin("TestBuild1", BUILD_PLUGIN),
+                       self.add_plugin("TestMuBuild", MU_BUILD_PLUGIN)]
+        manager = PluginManager.PluginManager()
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            manager.SetListOfEnvironmentDescriptors(descriptors, [PluginManager.IUefiBuildPlugin])
+        self.assertIsNotNone(manager.Descriptors[0].ImportTime)
+        self.assertIsNone(manager.Descriptors[1].ImportTime)
+        report = logs.output[logs.output.index("DEBUG:root:Plugin import times:") + 1:]
+        self.assertEqual(len(report), 1)
+        self.assertIn("TestBuild1 Name", report[0])
+        spans = [e for e in BuildTrace.GetBuildTrace().GetChromeTrace()["traceEvents"]
+                 if e["cat"] == "Plugin Import" and e["name"] == "TestBuild1 Name"]
+        self.assertNotEqual(spans, [])
+
+    def test_deferred_plugin_is_loaded_for_other_classes(self):
+        mu_build = MU_BUILD_PLUGIN.replace("raise RuntimeError", "# raise RuntimeError")
+        descriptors = [self.add_plugin("TestMuBuild", mu_build)]
+        manager = PluginManager.PluginManager()
+        self.assertEqual(manager.SetListOfEnvironmentDescriptors(descriptors, [PluginManager.IUefiBuildPlugin]), [])
+        self.assertEqual(manager.GetPluginsOfClass(object), manager.Descriptors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,11 @@ import logging
 import os
 import unittest
 from MuEnvironment import RepoResolver
+from MuEnvironment import Omnicache
+from MuEnvironment.MuGit import Repo
+from MuPythonLibrary.UtilityFunctions import RunCmd
 import tempfile
+from io import StringIO
 
 
 branch_dependency = {
@@ -73,6 +77,23 @@ def get_first_file(folder):
     return None
 
 
+def make_local_upstream(folder):
+    # create a repo on disk with a single commit so tests don't need the network
+    os.makedirs(folder)
+    RunCmd("git", "init", workingdir=folder)
+    with open(os.path.join(folder, "readme.txt"), "w") as out_file:
+        out_file.write("local upstream")
+    RunCmd("git", "add readme.txt", workingdir=folder)
+    RunCmd("git", "-c user.name=test -c user.email=test@example.com commit -m initial", workingdir=folder)
+    return Repo(folder).head.commit
+
+
+def make_cache(folder):
+    os.makedirs(folder)
+    RunCmd("git", "init --bare", workingdir=folder)
+    return folder
+
+
 class TestRepoResolver(unittest.TestCase):
     def setUp(self):
         prep_workspace()
@@ -256,6 +277,114 @@ class TestRepoResolver(unittest.TestCase):
         details = RepoResolver.get_details(folder_path)
         self.assertEqual(details['Url'], microsoft_branch_dependency['Url'])
 
+    def test_worktree_commit_repo(self):
+        upstream = os.path.join(test_dir, "upstream")
+        commit = make_local_upstream(upstream)
+        cache = make_cache(os.path.join(test_dir, "cache"))
+        worktree_dependency = {
+            "Url": upstream,
+            "Path": "test_repo",
+            "Commit": commit,
+            "ReferencePath": cache,
+            "Worktree": True
+        }
+        RepoResolver.resolve(test_dir, worktree_dependency)
+        folder_path = os.path.join(test_dir, worktree_dependency["Path"])
+        details = RepoResolver.get_details(folder_path)
+        self.assertEqual(details['Url'], worktree_dependency['Url'])
+        self.assertEqual(details['Commit'], worktree_dependency['Commit'])
+        repo = Repo(folder_path)
+        self.assertTrue(repo.initalized)
+        self.assertTrue(repo.worktree)
+        self.assertFalse(repo.dirty)
+        # the objects were fetched into the cache rather than the workspace
+        self.assertTrue(Repo(cache).has_commit(commit))
+
+    def test_worktrees_share_cache(self):
+        upstream = os.path.join(test_dir, "upstream")
+        commit = make_local_upstream(upstream)
+        cache = make_cache(os.path.join(test_dir, "cache"))
+        for workspace in ["ws1", "ws2"]:
+            worktree_dependency = {
+                "Url": upstream,
+                "Path": "test_repo",
+                "Commit": commit,
+                "ReferencePath": cache,
+                "Worktree": True
+            }
+            RepoResolver.resolve(os.path.join(test_dir, workspace), worktree_dependency, update_ok=True)
+            details = RepoResolver.get_details(os.path.join(test_dir, workspace, "test_repo"))
+            self.assertEqual(details['Commit'], commit)
+        self.assertEqual(len(os.listdir(os.path.join(cache, "worktrees"))), 2)
+
+    def test_worktree_of_bare_clone_is_not_dirty(self):
+        upstream = os.path.join(test_dir, "upstream")
+        commit = make_local_upstream(upstream)
+        mirror = os.path.join(test_dir, "mirror")
+        RunCmd("git", "clone --bare {0} {1}".format(upstream, mirror))
+        worktree_dependency = {
+            "Url": upstream,
+            "Path": "test_repo",
+            "Commit": commit,
+            "ReferencePath": mirror,
+            "Worktree": True
+        }
+        RepoResolver.resolve_all(test_dir, [worktree_dependency])
+        repo = Repo(os.path.join(test_dir, worktree_dependency["Path"]))
+        self.assertTrue(repo.worktree)
+        self.assertFalse(repo.dirty)
+        # resolving again finds the worktree in the right state
+        RepoResolver.resolve_all(test_dir, [worktree_dependency])
+        config = StringIO()
+        RunCmd("git", "config --get extensions.worktreeConfig", workingdir=mirror, outstream=config)
+        self.assertEqual(config.getvalue().strip(), "true")
+
+    def test_worktree_falls_back_to_clone_for_branch(self):
+        upstream = os.path.join(test_dir, "upstream")
+        make_local_upstream(upstream)
+        cache = make_cache(os.path.join(test_dir, "cache"))
+        worktree_dependency = {
+            "Url": upstream,
+            "Path": "test_repo",
+            "Branch": Repo(upstream).active_branch,
+            "ReferencePath": cache,
+            "Worktree": True
+        }
+        RepoResolver.resolve(test_dir, worktree_dependency)
+        repo = Repo(os.path.join(test_dir, worktree_dependency["Path"]))
+        self.assertFalse(repo.worktree)
+        self.assertEqual(repo.active_branch, worktree_dependency["Branch"])
+
+    def test_serve_clone_without_upstream(self):
+        upstream = os.path.join(test_dir, "upstream")
+        commit = make_local_upstream(upstream)
+        cache = os.path.join(test_dir, "cache")
+        Omnicache.InitOmnicache(cache)
+        config = Omnicache.OmniCacheConfig(os.path.join(cache, Omnicache.OMNICACHE_FILENAME))
+        current_dir = os.getcwd()
+        os.chdir(cache)
+        try:
+            Omnicache.AddEntry(config, "upstream", upstream)
+            self.assertEqual(Omnicache.FetchEntry("upstream"), 0)
+            # from now on the upstream can't be reached
+            url = "https://example.invalid/upstream.git"
+            Omnicache.UpdateEntries(config, [("upstream", url, False)])
+            config.Save()
+            Omnicache.UpdateServeViews(config, cache)
+        finally:
+            os.chdir(current_dir)
+
+        serve_dependency = {
+            "Url": url,
+            "Path": "test_repo",
+            "Commit": commit
+        }
+        RepoResolver.resolve_all(test_dir, [serve_dependency], omnicache_dir=cache, serve=True)
+        details = RepoResolver.get_details(os.path.join(test_dir, serve_dependency["Path"]))
+        # origin is still the upstream url
+        self.assertEqual(details['Url'], url)
+        self.assertEqual(details['Commit'], commit)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,153 @@
+## @file test_SelfDescribingEnvironment.py
+# Unit test suite for SelfDescribingEnvironment.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from MuEnvironment import SelfDescribingEnvironment as SDE
+from MuEnvironment import ShellEnvironment as SE
+
+
+def reset_bootstrap():
+    SDE.ENVIRONMENT_BOOTSTRAP_COMPLETE = False
+    SDE.ENV_STATE = None
+    SDE.ENV_VERIFIED = False
+    SDE.ENV_FROM_SNAPSHOT = False
+
+
+def write_path_env(path, var_name, var_value):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, var_name.lower() + "_path_env.json"), 'w') as f:
+        json.dump({"scope": "global", "flags": ["set_path", "set_build_var"], "var_name": var_name}, f)
+    # Make sure the change can be seen even on file systems with coarse timestamps.
+    t = time.time() + var_value
+    os.utime(path, (t, t))
+    os.utime(os.path.dirname(path), (t, t))
+
+
+class TestEnvironmentSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        SE.ShellEnvironment().restore_initial_checkpoint()
+        reset_bootstrap()
+        self.workspace = tempfile.mkdtemp()
+        self.tools_path = os.path.join(self.workspace, "Tools")
+        write_path_env(self.tools_path, "SDE_TEST_TOOLS", 1)
+        self.snapshot_path = os.path.join(self.workspace, "Build", SDE.ENV_SNAPSHOT_FILENAME)
+
+    def tearDown(self):
+        SE.ShellEnvironment().restore_initial_checkpoint()
+        reset_bootstrap()
+        shutil.rmtree(self.workspace)
+
+    def bootstrap_and_save(self):
+        SDE.BootstrapEnvironment(self.workspace)
+        self.assertTrue(SDE.VerifyEnvironment(self.workspace))
+        self.assertTrue(SDE.SaveEnvironmentSnapshot(self.snapshot_path))
+        # Start over like a new process would.
+        SE.ShellEnvironment().restore_initial_checkpoint()
+        reset_bootstrap()
+
+    def test_load_should_restore_the_environment(self):
+        self.bootstrap_and_save()
+        shell_env = SE.ShellEnvironment()
+        self.assertNotIn(self.tools_path, shell_env.active_path)
+        self.assertIsNone(shell_env.get_build_var("SDE_TEST_TOOLS"))
+
+        env_state = SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path)
+        self.assertIsNotNone(env_state)
+        (build_env, shell_env) = env_state
+        self.assertIn(self.tools_path, shell_env.active_path)
+        self.assertIn(self.tools_path, os.environ["PATH"].split(os.pathsep))
+        self.assertEqual(shell_env.get_build_var("SDE_TEST_TOOLS"), self.tools_path)
+        self.assertEqual(len(build_env.paths), 1)
+        self.assertTrue(SDE.ENV_FROM_SNAPSHOT)
+        self.assertTrue(SDE.VerifyEnvironment(self.workspace))
+        # Nothing changed, so there's nothing to save.
+        self.assertFalse(SDE.SaveEnvironmentSnapshot(self.snapshot_path))
+
+    def test_load_should_fail_without_a_snapshot(self):
+        self.assertIsNone(SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path))
+        os.makedirs(os.path.dirname(self.snapshot_path))
+        with open(self.snapshot_path, 'w') as f:
+            f.write("{ not json")
+        self.assertIsNone(SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path))
+        with open(self.snapshot_path, 'w') as f:
+            json.dump({"version": SDE.ENV_SNAPSHOT_VERSION}, f)
+        self.assertIsNone(SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path))
+        self.assertFalse(SDE.ENVIRONMENT_BOOTSTRAP_COMPLETE)
+
+    def test_changed_descriptor_should_invalidate_snapshot(self):
+        self.bootstrap_and_save()
+        descriptor = os.path.join(self.tools_path, "sde_test_tools_path_env.json")
+        with open(descriptor, 'w') as f:
+            json.dump({"scope": "global", "flags": ["set_path"]}, f)
+        t = time.time() + 10
+        os.utime(descriptor, (t, t))
+        self.assertIsNone(SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path))
+
+    def test_new_descriptor_should_invalidate_snapshot(self):
+        self.bootstrap_and_save()
+        write_path_env(os.path.join(self.tools_path, "More"), "SDE_TEST_MORE", 10)
+        self.assertIsNone(SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path))
+
+    def test_different_scopes_should_invalidate_snapshot(self):
+        self.bootstrap_and_save()
+        self.assertIsNone(SDE.LoadEnvironmentSnapshot(self.workspace, ("sde-test-scope",), self.snapshot_path))
+
+    def test_build_output_should_not_invalidate_snapshot(self):
+        self.bootstrap_and_save()
+        os.makedirs(os.path.join(os.path.dirname(self.snapshot_path), "DEBUG_GCC5"))
+        self.assertIsNotNone(SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path))
+
+    def test_verify_after_clean_or_update_should_verify_again(self):
+        self.bootstrap_and_save()
+        self.assertIsNotNone(SDE.LoadEnvironmentSnapshot(self.workspace, (), self.snapshot_path))
+        with mock.patch.object(SDE.SelfDescribingEnvironment, "verify_extdeps", return_value=False) as verify:
+            self.assertTrue(SDE.VerifyEnvironment(self.workspace))
+            verify.assert_not_called()
+            SDE.UpdateDependencies(self.workspace)
+            self.assertFalse(SDE.VerifyEnvironment(self.workspace))
+            verify.return_value = True
+            self.assertTrue(SDE.VerifyEnvironment(self.workspace))
+            SDE.CleanEnvironment(self.workspace)
+            verify.return_value = False
+            self.assertFalse(SDE.VerifyEnvironment(self.workspace))
+            self.assertEqual(verify.call_count, 3)
+
+    def test_unverified_environment_should_not_be_saved(self):
+        SDE.BootstrapEnvironment(self.workspace)
+        self.assertFalse(SDE.SaveEnvironmentSnapshot(self.snapshot_path))
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
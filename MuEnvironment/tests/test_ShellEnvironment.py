@@ -27,6 +27,7 @@
 
 import os
 import sys
+import json
 import unittest
 from MuEnvironment import ShellEnvironment as SE
 
@@ -345,6 +346,74 @@ class TestShellEnvironmenCheckpoints(unittest.TestCase):
         shell_env.restore_checkpoint(chkpt1)
         self.assertEqual(shell_env.get_build_var(test_var1_name), test_var1_data)
 
+    def test_checkpoints_should_not_share_changes(self):
+        shell_env = SE.ShellEnvironment()
+
+        shell_env.set_shell_var('SE-TEST-COW-VAR', 'first')
+        shell_env.set_build_var('SE_TEST_COW_BUILD_VAR', 'first')
+        chkpt1 = shell_env.checkpoint()
+
+        shell_env.set_shell_var('SE-TEST-COW-VAR', 'second')
+        shell_env.set_build_var('SE_TEST_COW_BUILD_VAR', 'second')
+        chkpt2 = shell_env.checkpoint()
+
+        # Restore and change again.  The checkpoints must not be affected.
+        shell_env.restore_checkpoint(chkpt1)
+        self.assertEqual(shell_env.get_shell_var('SE-TEST-COW-VAR'), 'first')
+        self.assertEqual(shell_env.get_build_var('SE_TEST_COW_BUILD_VAR'), 'first')
+        shell_env.set_shell_var('SE-TEST-COW-VAR', 'third')
+        shell_env.set_build_var('SE_TEST_COW_BUILD_VAR', 'third')
+        self.assertEqual(os.environ['SE-TEST-COW-VAR'], 'third')
+
+        shell_env.restore_checkpoint(chkpt2)
+        self.assertEqual(shell_env.get_shell_var('SE-TEST-COW-VAR'), 'second')
+        self.assertEqual(shell_env.get_build_var('SE_TEST_COW_BUILD_VAR'), 'second')
+        self.assertEqual(os.environ['SE-TEST-COW-VAR'], 'second')
+
+        shell_env.restore_checkpoint(chkpt1)
+        self.assertEqual(shell_env.get_shell_var('SE-TEST-COW-VAR'), 'first')
+        self.assertEqual(shell_env.get_build_var('SE_TEST_COW_BUILD_VAR'), 'first')
+
+        shell_env.restore_initial_checkpoint()
+        self.assertIsNone(shell_env.get_shell_var('SE-TEST-COW-VAR'))
+        self.assertNotIn('SE-TEST-COW-VAR', os.environ)
+
+    def test_snapshot_should_restore_changes(self):
+        shell_env = SE.ShellEnvironment()
+        test_path_change = '/SE/TEST/SNAPSHOT/PATH'
+        test_pypath_change = '/SE/TEST/SNAPSHOT/PYPATH'
+
+        shell_env.insert_path(test_path_change)
+        shell_env.append_pypath(test_pypath_change)
+        shell_env.set_shell_var('SE-TEST-SNAPSHOT-VAR', 'shell_value')
+        shell_env.set_build_var('SE_TEST_SNAPSHOT_VAR', 'build_value')
+        shell_env.active_buildvars.SetValue('SE_TEST_SNAPSHOT_FIXED', 'fixed', 'a comment')
+
+        # Only the changes should be in the snapshot and it should survive JSON.
+        snapshot = json.loads(json.dumps(shell_env.get_snapshot()))
+        self.assertEqual(snapshot['environ'], {'SE-TEST-SNAPSHOT-VAR': 'shell_value'})
+        self.assertEqual(snapshot['removed'], [])
+
+        shell_env.restore_initial_checkpoint()
+        self.assertNotIn(test_path_change, shell_env.active_path)
+        self.assertIsNone(shell_env.get_build_var('SE_TEST_SNAPSHOT_VAR'))
+
+        shell_env.apply_snapshot(snapshot)
+        self.assertEqual(shell_env.active_path[0], test_path_change)
+        self.assertEqual(os.environ["PATH"].split(os.pathsep)[0], test_path_change)
+        self.assertEqual(sys.path[-1], test_pypath_change)
+        self.assertEqual(os.environ['SE-TEST-SNAPSHOT-VAR'], 'shell_value')
+        self.assertEqual(shell_env.get_build_var('SE_TEST_SNAPSHOT_VAR'), 'build_value')
+        entry = shell_env.active_buildvars.GetEntry('SE_TEST_SNAPSHOT_FIXED')
+        self.assertEqual(entry.Comment, 'a comment')
+        self.assertFalse(entry.Overrideable)
+        self.assertTrue(shell_env.active_buildvars.GetEntry('SE_TEST_SNAPSHOT_VAR').Overrideable)
+
+        # The initial checkpoint should not be affected.
+        shell_env.restore_initial_checkpoint()
+        self.assertNotIn(test_path_change, shell_env.active_path)
+        self.assertNotIn('SE-TEST-SNAPSHOT-VAR', os.environ)
+
 
 class TestShellEnvironmenSpecialBuildVars(unittest.TestCase):
 
@@ -446,5 +515,120 @@ class TestShellEnvironmenSpecialBuildVars(unittest.TestCase):
         self.assertEqual(shell_env.get_build_var(test_var1_name), test_var1_data)
 
 
+class TestShellEnvironmentBatching(unittest.TestCase):
+
+    def setUp(self):
+        # Grab the singleton and restore the initial checkpoint.
+        shell_env = SE.ShellEnvironment()
+        shell_env.restore_initial_checkpoint()
+        # For testing, purge all checkpoints each time.
+        shell_env.checkpoints = [shell_env.checkpoints[SE.ShellEnvironment.INITIAL_CHECKPOINT]]
+
+    def tearDown(self):
+        SE.ShellEnvironment().restore_initial_checkpoint()
+
+    def test_batch_should_defer_os_environ_updates(self):
+        shell_env = SE.ShellEnvironment()
+        test_path_change = '/SE/TEST/BATCH/PATH'
+        test_pypath_change = '/SE/TEST/BATCH/PYPATH'
+
+        with shell_env.batch():
+            shell_env.insert_path(test_path_change)
+            shell_env.insert_pypath(test_pypath_change)
+            shell_env.set_shell_var('SE-TEST-BATCH-VAR', 'batch_value')
+
+            # Internal state should be updated right away...
+            self.assertIn(test_path_change, shell_env.active_path)
+            self.assertEqual(shell_env.get_shell_var('SE-TEST-BATCH-VAR'), 'batch_value')
+            # ...but the live environment should not.
+            self.assertNotIn(test_path_change, os.environ["PATH"].split(os.pathsep))
+            self.assertNotIn(test_pypath_change, sys.path)
+            self.assertNotIn('SE-TEST-BATCH-VAR', os.environ)
+
+        self.assertEqual(os.environ["PATH"].split(os.pathsep)[0], test_path_change)
+        self.assertEqual(sys.path[0], test_pypath_change)
+        self.assertEqual(os.environ["PYTHONPATH"].split(os.pathsep)[0], test_pypath_change)
+        self.assertEqual(os.environ['SE-TEST-BATCH-VAR'], 'batch_value')
+
+    def test_nested_batches_should_sync_at_the_outermost_exit(self):
+        shell_env = SE.ShellEnvironment()
+        test_path_change = '/SE/TEST/BATCH/NESTED'
+
+        with shell_env.batch():
+            with shell_env.batch():
+                shell_env.append_path(test_path_change)
+            self.assertNotIn(test_path_change, os.environ["PATH"].split(os.pathsep))
+
+        self.assertIn(test_path_change, os.environ["PATH"].split(os.pathsep))
+
+    def test_sync_should_apply_changes_within_a_batch(self):
+        shell_env = SE.ShellEnvironment()
+
+        with shell_env.batch():
+            shell_env.set_shell_var('SE-TEST-SYNC-VAR', 'sync_value')
+            shell_env.sync()
+            self.assertEqual(os.environ['SE-TEST-SYNC-VAR'], 'sync_value')
+
+    def test_batch_should_sync_when_an_exception_is_raised(self):
+        shell_env = SE.ShellEnvironment()
+        test_path_change = '/SE/TEST/BATCH/EXCEPTION'
+
+        with self.assertRaises(RuntimeError):
+            with shell_env.batch():
+                shell_env.append_path(test_path_change)
+                raise RuntimeError()
+
+        self.assertIn(test_path_change, os.environ["PATH"].split(os.pathsep))
+
+    def test_path_index_should_not_add_duplicates(self):
+        shell_env = SE.ShellEnvironment()
+        test_path_change = '/SE/TEST/BATCH/DUPLICATE'
+
+        shell_env.append_path(test_path_change)
+        shell_env.insert_path(test_path_change)
+        self.assertEqual(shell_env.active_path.count(test_path_change), 1)
+
+        # The index should follow removals and checkpoint restores.
+        shell_env.remove_path_element(test_path_change)
+        shell_env.append_path(test_path_change)
+        self.assertEqual(shell_env.active_path.count(test_path_change), 1)
+        shell_env.restore_initial_checkpoint()
+        self.assertNotIn(test_path_change, shell_env.active_path)
+        shell_env.insert_path(test_path_change)
+        self.assertIn(test_path_change, shell_env.active_path)
+
+    def test_pypath_index_should_see_external_sys_path_changes(self):
+        shell_env = SE.ShellEnvironment()
+        test_pypath_change = '/SE/TEST/BATCH/EXTERNAL'
+
+        # Something else adds to sys.path directly.
+        sys.path.append(test_pypath_change)
+        shell_env.append_pypath(test_pypath_change)
+        self.assertEqual(shell_env.active_pypath.count(test_pypath_change), 1)
+
+    def test_export_environment_should_only_write_changed_values(self):
+        shell_env = SE.ShellEnvironment()
+        shell_env.set_shell_var('SE-TEST-EXPORT-VAR', 'export_value')
+        chkpt = shell_env.checkpoint()
+        os.environ['SE-TEST-EXPORT-EXTRA'] = 'extra'
+
+        written = []
+
+        class WatchedEnviron(dict):
+            def __setitem__(self, key, value):
+                written.append(key)
+                super().__setitem__(key, value)
+
+        real_environ = os.environ
+        os.environ = WatchedEnviron(real_environ)
+        try:
+            shell_env.restore_checkpoint(chkpt)
+            self.assertEqual(written, [])
+            self.assertNotIn('SE-TEST-EXPORT-EXTRA', os.environ)
+        finally:
+            os.environ = real_environ
+            os.environ.pop('SE-TEST-EXPORT-EXTRA', None)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,363 @@
+## @file test_UefiBuild.py
+# Unit test suite for the UefiBuilder class.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from MuEnvironment import ShellEnvironment
+from MuEnvironment import VersionAggregator
+from MuEnvironment.UefiBuild import UefiBuilder
+
+TEST_DSC = """
+[Defines]
+  PLATFORM_NAME = TestPlatform
+  OUTPUT_DIRECTORY = Build/$(PLATFORM_NAME)
+  SHARED_VAR = from_dsc
+  FLASH_DEFINITION = TestPkg/Test.fdf
+!include TestPkg/Include.dsc.inc
+"""
+
+TEST_INCLUDE = """
+  INCLUDED_VAR = $(TEST_INPUT)_included
+"""
+
+TEST_FDF = """
+[Defines]
+  FLASH_BASE = 0xFF000000
+  SHARED_VAR = from_fdf
+  FDF_INPUT = $(TEST_INPUT)
+
+[FD.TestPlatform]
+  BaseAddress = $(FLASH_BASE)
+"""
+
+
+def write_file(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(contents)
+
+
+class TestUefiBuilderParsing(unittest.TestCase):
+
+    def setUp(self):
+        ShellEnvironment.ShellEnvironment().restore_initial_checkpoint()
+        self.ws = tempfile.mkdtemp()
+        write_file(os.path.join(self.ws, "TestPkg", "Test.dsc"), TEST_DSC)
+        write_file(os.path.join(self.ws, "TestPkg", "Include.dsc.inc"), TEST_INCLUDE)
+        write_file(os.path.join(self.ws, "TestPkg", "Test.fdf"), TEST_FDF)
+
+    def tearDown(self):
+        ShellEnvironment.ShellEnvironment().restore_initial_checkpoint()
+        shutil.rmtree(self.ws)
+
+    def parse(self, parallel, flash_definition="TestPkg/Test.fdf", extra_dsc=""):
+        env = ShellEnvironment.ShellEnvironment()
+        env.restore_initial_checkpoint()
+        shutil.rmtree(os.path.join(self.ws, "Conf"), ignore_errors=True)
+        write_file(os.path.join(self.ws, "TestPkg", "Test.dsc"), TEST_DSC + extra_dsc)
+
+        builder = UefiBuilder(self.ws, self.ws, None, None, [])
+        builder.env.SetValue("TARGET", "DEBUG", "test")
+        builder.env.SetValue("BLD_*_TEST_INPUT", "input", "test")
+        builder.env.SetValue("ACTIVE_PLATFORM", "TestPkg/Test.dsc", "test")
+        if flash_definition is not None:
+            builder.env.SetValue("FLASH_DEFINITION", flash_definition, "test", True)
+        self.assertEqual(builder.ParseDscAndFdfFiles(parallel), 0)
+
+        return [(k, e.Value, e.Comment, e.Overrideable) for (k, e) in env.active_buildvars.Dstore.items()]
+
+    def test_parallel_parse_should_match_sequential(self):
+        sequential = self.parse(False)
+        parallel = self.parse(True)
+        self.assertEqual(parallel, sequential)
+        self.assertIn(("SHARED_VAR", "from_fdf", "From Platform FDF File", True), parallel)
+        self.assertIn(("INCLUDED_VAR", "input_included", "From Platform DSC File", True), parallel)
+        self.assertIn(("FDF_INPUT", "input", "From Platform FDF File", True), parallel)
+
+    def test_parallel_parse_with_cache_should_match_sequential(self):
+        sequential = self.parse(False)
+        # The second parse of each kind comes from the cache.
+        self.parse(True)
+        parallel = self.parse(True)
+        self.assertEqual(parallel, sequential)
+
+    def test_dsc_changing_fdf_inputs_should_match_sequential(self):
+        # The DSC sets a build var the FDF parse sees.
+        extra_dsc = "  BLD_*_FDF_INPUT = from_dsc\n"
+        sequential = self.parse(False, extra_dsc=extra_dsc)
+        with self.assertLogs(level='DEBUG') as logs:
+            parallel = self.parse(True, extra_dsc=extra_dsc)
+        self.assertEqual(parallel, sequential)
+        self.assertTrue(any("Parsing the FDF file again" in line for line in logs.output))
+
+    def test_dsc_changing_flash_definition_should_match_sequential(self):
+        write_file(os.path.join(self.ws, "TestPkg", "Other.fdf"), "[Defines]\n  OTHER_FDF = TRUE\n")
+        sequential = self.parse(False, flash_definition="TestPkg/Other.fdf")
+        with self.assertLogs(level='DEBUG') as logs:
+            parallel = self.parse(True, flash_definition="TestPkg/Other.fdf")
+        self.assertEqual(parallel, sequential)
+        self.assertTrue(any("Parsing the FDF file again" in line for line in logs.output))
+        self.assertIn(("SHARED_VAR", "from_fdf", "From Platform FDF File", True), parallel)
+
+    def test_no_flash_definition_should_parse_dsc(self):
+        sequential = self.parse(False, flash_definition=None)
+        parallel = self.parse(True, flash_definition=None)
+        self.assertEqual(parallel, sequential)
+        self.assertIn(("SHARED_VAR", "from_fdf", "From Platform FDF File", True), parallel)
+
+    def test_missing_fdf_should_fail(self):
+        env = ShellEnvironment.ShellEnvironment()
+        env.restore_initial_checkpoint()
+        builder = UefiBuilder(self.ws, self.ws, None, None, [])
+        builder.env.SetValue("TARGET", "DEBUG", "test")
+        builder.env.SetValue("ACTIVE_PLATFORM", "TestPkg/Test.dsc", "test")
+        builder.env.SetValue("FLASH_DEFINITION", "TestPkg/Missing.fdf", "test")
+        self.assertEqual(builder.ParseDscAndFdfFiles(), -2)
+
+
+class TestUefiBuilderSkipUnchanged(unittest.TestCase):
+
+    def setUp(self):
+        ShellEnvironment.ShellEnvironment().restore_initial_checkpoint()
+        self.ws = tempfile.mkdtemp()
+        write_file(os.path.join(self.ws, "TestPkg", "Test.dsc"), TEST_DSC)
+        write_file(os.path.join(self.ws, "TestPkg", "Include.dsc.inc"), TEST_INCLUDE)
+        write_file(os.path.join(self.ws, "TestPkg", "Test.fdf"), TEST_FDF)
+
+    def tearDown(self):
+        ShellEnvironment.ShellEnvironment().restore_initial_checkpoint()
+        shutil.rmtree(self.ws)
+
+    def build(self, skip_unchanged="TRUE", rc=0, outputs=("X64/Test.efi",)):
+        ShellEnvironment.ShellEnvironment().restore_initial_checkpoint()
+        builder = UefiBuilder(self.ws, self.ws, None, None, [])
+        builder.env.SetValue("TARGET", "DEBUG", "test")
+        builder.env.SetValue("ACTIVE_PLATFORM", "TestPkg/Test.dsc", "test")
+        builder.env.SetValue("FLASH_DEFINITION", "TestPkg/Test.fdf", "test")
+        builder.env.SetValue("BLD_*_TEST_INPUT", "input", "test")
+        builder.env.SetValue("TOOL_CHAIN_TAG", "VS2017", "test")
+        builder.env.SetValue("MAX_CONCURRENT_THREAD_NUMBER", "4", "test")
+        builder.env.SetValue("TARGET_ARCH", "X64", "test")
+        builder.env.SetValue("BUILD_OUTPUT_BASE", os.path.join(self.ws, "Build", "DEBUG_VS2017"), "test")
+        if skip_unchanged is not None:
+            builder.env.SetValue("SKIP_BUILD_IF_UNCHANGED", skip_unchanged, "test")
+
+        def fake_build(cmd, params, **kwargs):
+            for output in outputs:
+                write_file(os.path.join(self.ws, "Build", "DEBUG_VS2017", output), "output")
+            return rc
+
+        with mock.patch("MuEnvironment.UefiBuild.RunCmd", side_effect=fake_build) as run:
+            self.assertEqual(builder.Build(), rc)
+        return run.call_count
+
+    def test_unchanged_build_should_be_skipped(self):
+        self.assertEqual(self.build(), 1)
+        self.assertEqual(self.build(), 0)
+        write_file(os.path.join(self.ws, "TestPkg", "Include.dsc.inc"), TEST_INCLUDE + "  NEW_VAR = 1\n")
+        self.assertEqual(self.build(), 1)
+        self.assertEqual(self.build(), 0)
+
+    def test_failed_build_should_not_be_skipped(self):
+        self.assertEqual(self.build(), 1)
+        write_file(os.path.join(self.ws, "TestPkg", "Test.fdf"), TEST_FDF + "\n")
+        self.assertEqual(self.build(rc=1), 1)
+        # the inputs match the failed build but it has to run again
+        self.assertEqual(self.build(), 1)
+        self.assertEqual(self.build(), 0)
+
+    def test_deleted_output_should_not_be_skipped(self):
+        self.assertEqual(self.build(outputs=("X64/Test.efi", "FV/TEST.fd")), 1)
+        os.remove(os.path.join(self.ws, "Build", "DEBUG_VS2017", "X64", "Test.efi"))
+        self.assertEqual(self.build(outputs=()), 1)
+
+    def test_build_without_outputs_should_not_be_skipped(self):
+        self.assertEqual(self.build(outputs=()), 1)
+        self.assertEqual(self.build(outputs=()), 1)
+
+    def test_build_should_not_be_skipped_by_default(self):
+        self.assertEqual(self.build(), 1)
+        self.assertEqual(self.build(None), 1)
+        self.assertEqual(self.build(), 1)
+
+
+class FakePluginManager(object):
+
+    def GetPluginsOfClass(self, classobj):
+        return []
+
+
+class TargetsBuilder(UefiBuilder):
+
+    def __init__(self, ws):
+        super(TargetsBuilder, self).__init__(ws, ws, FakePluginManager(), None, [])
+        self.PostBuilds = []
+
+    def PlatformPreBuild(self):
+        self.env.SetValue("BLD_*_FROM_PREBUILD", self.env.GetValue("TARGET"), "test")
+        return 0
+
+    def PlatformPostBuild(self):
+        self.PostBuilds.append((self.env.GetValue("TARGET"), self.env.GetValue("BUILD_OUTPUT_BASE")))
+        return 0
+
+
+class TestUefiBuilderTargets(unittest.TestCase):
+
+    def setUp(self):
+        ShellEnvironment.ShellEnvironment().restore_initial_checkpoint()
+        self.ws = tempfile.mkdtemp()
+        write_file(os.path.join(self.ws, "TestPkg", "Test.dsc"), TEST_DSC)
+        write_file(os.path.join(self.ws, "TestPkg", "Include.dsc.inc"), TEST_INCLUDE)
+        write_file(os.path.join(self.ws, "TestPkg", "Test.fdf"), TEST_FDF)
+        write_file(os.path.join(self.ws, "Conf", "target.txt"), "TARGET = DEBUG\n")
+        self.builder = TargetsBuilder(self.ws)
+        self.builder.env.SetValue("TARGET", "DEBUG", "From Target.txt", True)
+        self.builder.env.SetValue("ACTIVE_PLATFORM", "TestPkg/Test.dsc", "test")
+        self.builder.env.SetValue("TOOL_CHAIN_TAG", "VS2017", "test")
+        self.builder.env.SetValue("MAX_CONCURRENT_THREAD_NUMBER", "5", "From Target.txt", True)
+        self.builder.env.SetValue("TARGET_ARCH", "X64", "test")
+        self.builder.env.SetValue("BLD_*_TEST_INPUT", "input", "test")
+        self.calls = {}
+
+    def tearDown(self):
+        ShellEnvironment.ShellEnvironment().restore_initial_checkpoint()
+        shutil.rmtree(self.ws)
+
+    def run_build(self, targets, rc={}):
+        # every build has to be running at the same time to get past the barrier
+        barrier = threading.Barrier(len(targets), timeout=10)
+
+        def fake_build(cmd, params, outfile=None, environ=None, logging_level=None):
+            target = params.split(" -b ")[1].split()[0]
+            self.calls[target] = (params, outfile, environ)
+            barrier.wait()
+            with open(outfile, "w") as f:
+                f.write("x.c(1): error C2065: 'y': undeclared identifier\n")
+            return rc.get(target, 0)
+
+        with mock.patch("MuEnvironment.UefiBuild.RunCmd", side_effect=fake_build):
+            return self.builder.BuildTargets(targets)
+
+    def test_targets_build_at_the_same_time(self):
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(self.run_build(["DEBUG", "RELEASE"]), 0)
+        self.assertEqual(sorted(self.calls.keys()), ["DEBUG", "RELEASE"])
+        (debug_params, debug_log, debug_environ) = self.calls["DEBUG"]
+        (release_params, release_log, release_environ) = self.calls["RELEASE"]
+        # each target gets its own build vars, threads and log
+        self.assertIn("-D FROM_PREBUILD=DEBUG", debug_params)
+        self.assertIn("-D FROM_PREBUILD=RELEASE", release_params)
+        self.assertIn("-n 3", debug_params)
+        self.assertIn("-n 2", release_params)
+        self.assertNotEqual(debug_log, release_log)
+        self.assertEqual(debug_environ["PYTHONHASHSEED"], "0")
+        # edk2 build can't share Conf/.cache between builds running at the same time
+        self.assertEqual(debug_environ["CONF_PATH"],
+                         os.path.join(self.ws, "Build", "TestPlatform", "DEBUG_VS2017", "Conf"))
+        self.assertEqual(release_environ["CONF_PATH"],
+                         os.path.join(self.ws, "Build", "TestPlatform", "RELEASE_VS2017", "Conf"))
+        self.assertTrue(os.path.isfile(os.path.join(release_environ["CONF_PATH"], "target.txt")))
+        self.assertTrue(any(line.endswith("DEBUG: Compile: Error: x.c(1): error C2065: 'y': undeclared identifier")
+                            for line in logs.output))
+        self.assertEqual(self.builder.PostBuilds, [
+            ("DEBUG", os.path.join(self.ws, "Build", "TestPlatform", "DEBUG_VS2017")),
+            ("RELEASE", os.path.join(self.ws, "Build", "TestPlatform", "RELEASE_VS2017"))])
+
+    def test_dsc_is_parsed_for_each_target(self):
+        write_file(os.path.join(self.ws, "TestPkg", "Test.dsc"), TEST_DSC + """
+!if $(TARGET) == DEBUG
+  DEBUG_ONLY_VAR = TRUE
+  TARGET_VAR = debug
+!else
+  TARGET_VAR = $(TARGET)_$(TEST_INPUT)
+!endif
+""")
+        self.builder.env.SetValue("BLD_RELEASE_TEST_INPUT", "release_input", "test")
+        self.assertEqual(self.run_build(["DEBUG", "RELEASE"]), 0)
+        self.assertIn("-D TEST_INPUT=input", self.calls["DEBUG"][0])
+        self.assertIn("-D TEST_INPUT=release_input", self.calls["RELEASE"][0])
+        self.assertEqual(self.builder.env.GetValue("TARGET_VAR"), "RELEASE_release_input")
+        self.assertIsNone(self.builder.env.GetValue("DEBUG_ONLY_VAR"))
+
+    def test_failed_target_should_fail(self):
+        self.assertEqual(self.run_build(["DEBUG", "RELEASE"], rc={"RELEASE": 7}), 7)
+        self.assertEqual(self.builder.PostBuilds, [])
+
+    def test_locked_target_should_fail(self):
+        self.builder.env.SetValue("TARGET", "DEBUG", "From CmdLine")
+        self.assertNotEqual(self.builder.BuildTargets(["DEBUG", "RELEASE"]), 0)
+
+    def test_flash_should_fail(self):
+        self.builder.FlashImage = True
+        self.assertNotEqual(self.builder.BuildTargets(["DEBUG", "RELEASE"]), 0)
+
+    def test_locked_thread_count_is_split(self):
+        self.builder.env.SetValue("MAX_CONCURRENT_THREAD_NUMBER", "4", "From CmdLine")
+        self.assertEqual(self.run_build(["DEBUG", "RELEASE"]), 0)
+        self.assertIn("-n 2", self.calls["DEBUG"][0])
+        self.assertIn("-n 2", self.calls["RELEASE"][0])
+
+    def test_auto_thread_count(self):
+        VersionAggregator.VERSION_AGGREGATOR = None
+        self.builder.env.SetValue("MAX_CONCURRENT_THREAD_NUMBER", "auto", "From CmdLine")
+        with mock.patch("MuEnvironment.BuildThreads.GetAutoThreadCount", return_value=(6, {"cpu_count": 8})):
+            self.assertEqual(self.builder.SetAutoThreadCount(), 0)
+        self.assertEqual(self.builder.env.GetValue("MAX_CONCURRENT_THREAD_NUMBER"), "6")
+        versions = VersionAggregator.GetVersionAggregator().GetAggregatedVersionInformation()
+        self.assertEqual(versions["MAX_CONCURRENT_THREAD_NUMBER"]["version"], "6")
+        self.assertEqual(versions["MAX_CONCURRENT_THREAD_NUMBER inputs"]["version"], "cpu_count=8")
+        VersionAggregator.VERSION_AGGREGATOR = None
+
+    def test_auto_thread_count_needs_memory_per_thread(self):
+        self.builder.env.SetValue("MAX_CONCURRENT_THREAD_NUMBER", "AUTO", "test")
+        self.builder.env.SetValue("MEMORY_PER_BUILD_THREAD_MB", "lots", "test")
+        self.assertNotEqual(self.builder.SetAutoThreadCount(), 0)
+
+    def test_get_build_targets(self):
+        self.assertEqual(self.builder.GetBuildTargets(), [])
+        self.builder.env.SetValue("MU_BUILD_TARGETS", "debug, RELEASE NOOPT", "test")
+        self.assertEqual(self.builder.GetBuildTargets(), ["DEBUG", "RELEASE", "NOOPT"])
+
+    def test_dsc_build_targets_should_be_ignored(self):
+        # every edk2 DSC lists the targets it supports in BUILD_TARGETS
+        write_file(os.path.join(self.ws, "TestPkg", "Test.dsc"), TEST_DSC + "  BUILD_TARGETS = DEBUG|RELEASE\n")
+        self.builder.env.SetValue("TARGET", "RELEASE", "From CmdLine")
+        self.assertEqual(self.builder.SetDscEnv(), 0)
+        self.assertEqual(self.builder.env.GetValue("BUILD_TARGETS"), "DEBUG|RELEASE")
+        self.assertEqual(self.builder.GetBuildTargets(), [])
+        self.assertEqual(self.builder.SetTargetEnv(), 0)
+        self.assertEqual(self.builder.env.GetValue("BUILD_OUTPUT_BASE"),
+                         os.path.join(self.ws, "Build", "TestPlatform", "RELEASE_VS2017"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+## @file test_VarDict.py
+# Unit test suite for the VarDict class.
+#
+##
+# Copyright (c) 2019, Microsoft Corporation
+#
+# All rights reserved.
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE
+# OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+##
+
+import copy
+import unittest
+from MuEnvironment import VarDict
+
+
+class TestVarDict(unittest.TestCase):
+
+    def test_set_and_get_value(self):
+        v = VarDict.VarDict()
+        self.assertTrue(v.SetValue("test1", "value1", "test 1 comment"))
+        self.assertEqual(v.GetValue("TEST1"), "value1")
+        self.assertEqual(v.GetValue("test1"), "value1")
+        self.assertIsNone(v.GetValue("test2"))
+
+    def test_non_overridable_value_should_not_change(self):
+        v = VarDict.VarDict()
+        v.SetValue("test1", "value1", "test 1 comment")
+        self.assertFalse(v.SetValue("test1", "value2", "new comment"))
+        self.assertEqual(v.GetValue("test1"), "value1")
+        # Setting the same value is not an error.
+        self.assertTrue(v.SetValue("test1", "value1", "new comment"))
+
+    def test_overridable_value_should_change(self):
+        v = VarDict.VarDict()
+        v.SetValue("test1", "value1", "test 1 comment", True)
+        self.assertTrue(v.SetValue("test1", "value2", "new comment"))
+        self.assertEqual(v.GetValue("test1"), "value2")
+        # The new value was not set as overridable.
+        self.assertFalse(v.SetValue("test1", "value3", "new comment"))
+
+    def test_copy_should_not_see_changes_to_original(self):
+        v = VarDict.VarDict()
+        v.SetValue("test1", "value1", "test 1 comment", True)
+        v.SetValue("test2", "value2", "test 2 comment", True)
+
+        c = copy.copy(v)
+        v.SetValue("test1", "changed", "")
+        v.SetValue("test3", "value3", "")
+
+        self.assertEqual(c.GetValue("test1"), "value1")
+        self.assertIsNone(c.GetValue("test3"))
+        self.assertEqual(v.GetValue("test1"), "changed")
+        self.assertEqual(v.GetValue("test3"), "value3")
+
+    def test_original_should_not_see_changes_to_copy(self):
+        v = VarDict.VarDict()
+        v.SetValue("test1", "value1", "test 1 comment", True)
+
+        c = copy.copy(v)
+        c.SetValue("test1", "changed", "")
+        c.SetValue("test2", "value2", "")
+
+        self.assertEqual(v.GetValue("test1"), "value1")
+        self.assertIsNone(v.GetValue("test2"))
+        self.assertEqual(v.GetEntry("test1").Overrideable, True)
+
+    def test_copy_of_copy_should_be_independent(self):
+        v = VarDict.VarDict()
+        v.SetValue("test1", "value1", "test 1 comment", True)
+
+        c1 = copy.copy(v)
+        c2 = copy.copy(c1)
+        c1.SetValue("test1", "c1", "", True)
+        c2.SetValue("test1", "c2", "", True)
+        v.SetValue("test1", "v", "", True)
+
+        self.assertEqual(c1.GetValue("test1"), "c1")
+        self.assertEqual(c2.GetValue("test1"), "c2")
+        self.assertEqual(v.GetValue("test1"), "v")
+
+    def test_copy_should_not_copy_the_store(self):
+        v = VarDict.VarDict()
+        for i in range(100):
+            v.SetValue("test%d" % i, "value", "")
+
+        c = copy.copy(v)
+        self.assertIs(c.Dstore, v.Dstore)
+        # Failed sets shouldn't force a copy either.
+        c.SetValue("test1", "changed", "")
+        self.assertIs(c.Dstore, v.Dstore)
+        c.SetValue("new", "value", "")
+        self.assertIsNot(c.Dstore, v.Dstore)
+
+    def test_get_all_build_key_values(self):
+        v = VarDict.VarDict()
+        v.SetValue("BLD_*_TEST1", "all", "")
+        v.SetValue("BLD_*_TEST2", "all", "")
+        v.SetValue("BLD_DEBUG_TEST2", "debug", "")
+        v.SetValue("BLD_RELEASE_TEST3", "release", "")
+
+        self.assertEqual(v.GetAllBuildKeyValues("DEBUG"), {"TEST1": "all", "TEST2": "debug"})
+        self.assertEqual(v.GetAllBuildKeyValues("RELEASE"), {"TEST1": "all", "TEST2": "all", "TEST3": "release"})
+        self.assertEqual(v.GetBuildValue("TEST2", "DEBUG"), "debug")
+        self.assertEqual(v.GetBuildValue("TEST2", "RELEASE"), "all")
+
+    def test_get_all_build_key_values_should_see_new_values(self):
+        v = VarDict.VarDict()
+        v.SetValue("TARGET", "DEBUG", "")
+        v.SetValue("BLD_*_TEST1", "all", "", True)
+        self.assertEqual(v.GetAllBuildKeyValues(), {"TEST1": "all"})
+
+        v.SetValue("BLD_DEBUG_TEST1", "debug", "")
+        self.assertEqual(v.GetAllBuildKeyValues(), {"TEST1": "debug"})
+        v.SetValue("BLD_*_TEST1", "changed", "")
+        v.SetValue("BLD_*_TEST2", "all", "")
+        self.assertEqual(v.GetAllBuildKeyValues(), {"TEST1": "debug", "TEST2": "all"})
+        self.assertEqual(v.GetAllBuildKeyValues("RELEASE"), {"TEST1": "changed", "TEST2": "all"})
+
+    def test_get_all_build_key_values_should_return_a_copy(self):
+        v = VarDict.VarDict()
+        v.SetValue("BLD_*_TEST1", "all", "")
+
+        result = v.GetAllBuildKeyValues("DEBUG")
+        result["TEST1"] = "changed"
+        result["TEST2"] = "added"
+        self.assertEqual(v.GetAllBuildKeyValues("DEBUG"), {"TEST1": "all"})
+
+    def test_get_all_build_key_values_on_copies(self):
+        v = VarDict.VarDict()
+        v.SetValue("BLD_*_TEST1", "all", "", True)
+        self.assertEqual(v.GetAllBuildKeyValues("DEBUG"), {"TEST1": "all"})
+
+        c = copy.copy(v)
+        c.SetValue("BLD_*_TEST1", "copy", "")
+        c.SetValue("BLD_DEBUG_TEST2", "copy", "")
+        self.assertEqual(c.GetAllBuildKeyValues("DEBUG"), {"TEST1": "copy", "TEST2": "copy"})
+        self.assertEqual(v.GetAllBuildKeyValues("DEBUG"), {"TEST1": "all"})
+
+        v.SetValue("BLD_DEBUG_TEST3", "original", "")
+        self.assertEqual(v.GetAllBuildKeyValues("DEBUG"), {"TEST1": "all", "TEST3": "original"})
+        self.assertEqual(c.GetAllBuildKeyValues("DEBUG"), {"TEST1": "copy", "TEST2": "copy"})
+
+    def test_entries_should_not_have_a_dict(self):
+        en = VarDict.EnvEntry("value", "comment")
+        with self.assertRaises(AttributeError):
+            en.NotAnAttribute = True
+
+    def test_allow_override(self):
+        v = VarDict.VarDict()
+        v.SetValue("test1", "locked", "From CmdLine")
+        c = copy.copy(v)
+        self.assertFalse(v.SetValue("test1", "changed", "test"))
+        self.assertTrue(v.AllowOverride("test1"))
+        self.assertTrue(v.SetValue("test1", "changed", "test"))
+        self.assertEqual(v.GetValue("test1"), "changed")
+        # the copy is still locked
+        self.assertFalse(c.SetValue("test1", "changed", "test"))
+        self.assertEqual(c.GetValue("test1"), "locked")
+        self.assertFalse(v.AllowOverride("test2"))
+
+
+if __name__ == '__main__':
+    unittest.main()
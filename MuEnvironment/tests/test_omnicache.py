@@ -1,7 +1,12 @@
 import os
+import sys
 import unittest
+import threading
+import subprocess
 import logging
 import tempfile
+import time
+from unittest import mock
 import shutil
 try:
     from io import StringIO
@@ -132,5 +137,584 @@ class TestOmniCache(unittest.TestCase):
             os.chdir(currentdir)
 
 
+def get_git_remotes(cache):
+    out = StringIO()
+    UtilityFunctions.RunCmd("git", "config --get-regexp ^remote\\..*\\.url$", workingdir=cache, outstream=out)
+    remotes = {}
+    for line in out.getvalue().splitlines():
+        if line.strip():
+            (key, url) = line.strip().split(" ", 1)
+            remotes[key[len("remote."):-len(".url")]] = url
+    return remotes
+
+
+class TestOmniCacheConfig(unittest.TestCase):
+    def setUp(self):
+        prep_workspace()
+        self.cache = os.path.join(test_dir, "testcache")
+        Omnicache.InitOmnicache(self.cache)
+        self.config = Omnicache.OmniCacheConfig(os.path.join(self.cache, Omnicache.OMNICACHE_FILENAME))
+        os.chdir(self.cache)
+
+    def tearDown(self):
+        os.chdir(current_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        clean_workspace()
+
+    def test_normalize_url(self):
+        self.assertEqual(Omnicache.NormalizeUrl(" HTTPS://GitHub.com/Microsoft/mu_basecore.git/ "),
+                         "https://github.com/Microsoft/mu_basecore")
+        self.assertEqual(Omnicache.NormalizeUrl("https://User@GitHub.com/a/b"), "https://User@github.com/a/b")
+        self.assertEqual(Omnicache.NormalizeUrl("git@github.com:a/b.git"), "git@github.com:a/b")
+
+    def test_lookup_uses_normalized_url(self):
+        self.config.Add("mu", "https://github.com/Microsoft/mu.git")
+        self.assertTrue(self.config.Contains_url("https://GITHUB.com/Microsoft/mu/"))
+        self.assertEqual(self.config.GetNameForUrl("https://github.com/Microsoft/mu"), "mu")
+        self.assertFalse(self.config.Contains_url("https://github.com/microsoft/mu"))
+        self.assertTrue(self.config.Contains_name("mu"))
+        # overwriting the name drops the old url from the index
+        self.config.Remove("mu")
+        self.config.Add("mu", "https://github.com/Microsoft/mu_plus.git")
+        self.assertIsNone(self.config.GetNameForUrl("https://github.com/Microsoft/mu.git"))
+        self.config.Save()
+        config = Omnicache.OmniCacheConfig(self.config.filepath)
+        self.assertEqual(config.GetNameForUrl("https://github.com/Microsoft/mu_plus"), "mu")
+
+    def test_update_entries_add_update_remove(self):
+        upstream = os.path.join(test_dir, "b")
+        make_local_upstream(upstream)
+        Omnicache.UpdateEntries(self.config, [("a", "https://example.com/a.git", False),
+                                              ("b", upstream, True)])
+        self.assertEqual(get_git_remotes(self.cache), {"a": "https://example.com/a.git", "b": upstream})
+        self.assertIn("tag", self.config.remotes["b"])
+        self.assertEqual(Omnicache.FetchEntry("b"), 0)
+        self.assertEqual(len(get_refs(self.cache, "refs/remotes/b")), 1)
+
+        # update a, remove b.  Refs of b are removed with it.
+        Omnicache.UpdateEntries(self.config, [("a", "https://example.com/other.git", False)], ["b"])
+        self.assertEqual(get_git_remotes(self.cache), {"a": "https://example.com/other.git"})
+        self.assertEqual(get_refs(self.cache, "refs/remotes/b"), [])
+        self.assertEqual(list(self.config.remotes.keys()), ["a"])
+        self.assertEqual(self.config.remotes["a"]["url"], "https://example.com/other.git")
+
+    def test_consistency_check(self):
+        self.config.Add("configonly", "https://example.com/configonly.git")
+        UtilityFunctions.RunCmd("git", "remote add gitonly https://example.com/gitonly.git", workingdir=self.cache)
+        self.assertEqual(Omnicache.ConsistencyCheckCacheConfig(self.config), 0)
+        self.assertEqual(get_git_remotes(self.cache), {"configonly": "https://example.com/configonly.git",
+                                                       "gitonly": "https://example.com/gitonly.git"})
+        self.assertTrue(self.config.Contains("gitonly"))
+
+    def test_add_many_entries_from_config(self):
+        cfgfile = os.path.join(test_dir, "many.yaml")
+        with open(cfgfile, "w") as configyaml:
+            configyaml.write("remotes:\n")
+            for x in range(1000):
+                configyaml.write("- name: remote{0}\n".format(x))
+                configyaml.write("  url: https://example.com/org/repo{0}.git\n".format(x))
+
+        start = time.time()
+        (count, input_config_remotes) = Omnicache.AddEntriesFromConfig(self.config, cfgfile)
+        elapsed = time.time() - start
+        self.assertEqual(count, 1000)
+        self.assertEqual(len(self.config.remotes), 1000)
+        self.assertEqual(len(get_git_remotes(self.cache)), 1000)
+        # one git config write instead of 1000 git processes
+        self.assertLess(elapsed, 5)
+
+        # importing again is a no-op and renames are applied
+        with open(cfgfile, "w") as configyaml:
+            configyaml.write("remotes:\n- name: renamed\n  url: https://example.com/org/repo5.git\n")
+        (count, input_config_remotes) = Omnicache.AddEntriesFromConfig(self.config, cfgfile)
+        self.assertEqual(count, 1)
+        self.assertFalse(self.config.Contains("remote5"))
+        self.assertEqual(self.config.GetNameForUrl("https://example.com/org/repo5"), "renamed")
+        self.assertEqual(get_git_remotes(self.cache)["renamed"], "https://example.com/org/repo5.git")
+        self.assertNotIn("remote5", get_git_remotes(self.cache))
+
+
+def make_fake_repo(folder, url, submodules={}, gitdir=None):
+    '''
+    make a folder that looks like a git repo to the scanner without running git.
+    submodules is a dictionary of path to url.  gitdir is used to
+    make a .git file like git does for submodules.
+    '''
+    os.makedirs(folder, exist_ok=True)
+    if gitdir is None:
+        gitdir = os.path.join(folder, ".git")
+    else:
+        with open(os.path.join(folder, ".git"), "w") as gitfile:
+            gitfile.write("gitdir: {0}\n".format(os.path.relpath(gitdir, folder)))
+    os.makedirs(gitdir)
+    with open(os.path.join(gitdir, "config"), "w") as config:
+        config.write("[core]\n\tbare = false\n[remote \"origin\"]\n\turl = {0}\n".format(url))
+        config.write("\tfetch = +refs/heads/*:refs/remotes/origin/*\n")
+    if len(submodules) > 0:
+        with open(os.path.join(folder, ".gitmodules"), "w") as gitmodules:
+            for (path, suburl) in submodules.items():
+                gitmodules.write("[submodule \"{0}\"]\n\tpath = {0}\n\turl = {1}\n".format(path, suburl))
+
+
+class TestOmniCacheScan(unittest.TestCase):
+    def setUp(self):
+        prep_workspace()
+
+    @classmethod
+    def tearDownClass(cls):
+        clean_workspace()
+
+    def test_read_git_config_file(self):
+        path = os.path.join(test_dir, "config")
+        with open(path, "w") as config:
+            config.write("# comment\n[Core]\n\tBare = false\n\tfilemode\n")
+            config.write('[remote "Up stream"] url = "https://example.com/a b.git" ; comment\n')
+            config.write('[submodule "x"]\n\tpath = "C:\\\\src\\\\x" # comment\n')
+        values = Omnicache.ReadGitConfigFile(path)
+        self.assertEqual(values["core.bare"], "false")
+        self.assertEqual(values["core.filemode"], "true")
+        self.assertEqual(values["remote.Up stream.url"], "https://example.com/a b.git")
+        self.assertEqual(values["submodule.x.path"], "C:\\src\\x")
+
+    def test_scan_finds_submodules(self):
+        root = os.path.join(test_dir, "ws")
+        make_fake_repo(os.path.join(root, "platform"), "https://example.com/platform.git",
+                       {"Common/MU": "https://example.com/mu_plus.git", "Silicon": "https://example.com/silicon.git"})
+        make_fake_repo(os.path.join(root, "platform", "Common", "MU"), "https://example.com/mu_plus.git",
+                       {"Nested": "https://example.com/nested.git"},
+                       gitdir=os.path.join(root, "platform", ".git", "modules", "Common", "MU"))
+        make_fake_repo(os.path.join(root, "platform", "Common", "MU", "Nested"), "https://example.com/nested.git",
+                       gitdir=os.path.join(root, "platform", ".git", "modules", "Common", "MU", "modules", "Nested"))
+        # Silicon isn't initialized.  Not a repo and a plain folder at the top level
+        os.makedirs(os.path.join(root, "platform", "Silicon"))
+        os.makedirs(os.path.join(root, "notarepo"))
+        # same url as the submodule with a shorter name wins
+        make_fake_repo(os.path.join(root, "mu"), "https://EXAMPLE.com/mu_plus")
+
+        repos = Omnicache.ScanForRepos(root, jobs=4)
+        self.assertEqual(repos, {"https://example.com/platform.git": "platform",
+                                 "https://EXAMPLE.com/mu_plus": "mu",
+                                 "https://example.com/nested.git": "platform/Common/MU/Nested"})
+
+    def test_scan_many_nested_submodules(self):
+        root = os.path.join(test_dir, "ws")
+        # 300 nested submodules 3 levels deep
+        submodules = {"sub{0}".format(x): "https://example.com/sub{0}.git".format(x) for x in range(10)}
+        make_fake_repo(os.path.join(root, "top"), "https://example.com/top.git", submodules)
+        for first in submodules:
+            nested = {"n{0}".format(x): "https://example.com/{0}_n{1}.git".format(first, x) for x in range(29)}
+            make_fake_repo(os.path.join(root, "top", first), submodules[first], nested)
+            for (second, url) in nested.items():
+                make_fake_repo(os.path.join(root, "top", first, second), url)
+
+        start = time.time()
+        repos = Omnicache.ScanForRepos(root)
+        self.assertEqual(len(repos), 1 + 10 + 290)
+        self.assertLess(time.time() - start, 5)
+
+
+class TestOmniCacheLock(unittest.TestCase):
+    def setUp(self):
+        prep_workspace()
+        self.cache = os.path.join(test_dir, "testcache")
+        Omnicache.InitOmnicache(self.cache)
+
+    @classmethod
+    def tearDownClass(cls):
+        clean_workspace()
+
+    def test_lock_serializes_threads(self):
+        counter_file = os.path.join(test_dir, "counter.txt")
+        with open(counter_file, "w") as counter:
+            counter.write("0")
+
+        def increment():
+            for x in range(5):
+                with Omnicache.OmniCacheLock(self.cache):
+                    with open(counter_file) as counter:
+                        value = int(counter.read())
+                    time.sleep(0.001)
+                    with open(counter_file, "w") as counter:
+                        counter.write(str(value + 1))
+
+        threads = [threading.Thread(target=increment) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(counter_file) as counter:
+            self.assertEqual(int(counter.read()), 40)
+
+    def test_lock_timeout(self):
+        with Omnicache.OmniCacheLock(self.cache):
+            with self.assertRaises(Exception):
+                Omnicache.OmniCacheLock(self.cache, timeout=0.1).acquire()
+        # released so it can be taken again
+        with Omnicache.OmniCacheLock(self.cache, timeout=0.1):
+            pass
+
+    def test_save_is_atomic(self):
+        config = Omnicache.OmniCacheConfig(os.path.join(self.cache, Omnicache.OMNICACHE_FILENAME))
+        config.Add("a", "https://example.com/a.git")
+        config.Save()
+        config.Add("b", "https://example.com/b.git")
+        config.Save()
+        self.assertEqual([x for x in os.listdir(self.cache) if x.endswith(".tmp")], [])
+        self.assertEqual(len(Omnicache.OmniCacheConfig(config.filepath).remotes), 2)
+
+    def test_consistency_check_saves_once(self):
+        for x in range(3):
+            UtilityFunctions.RunCmd("git", "remote add r{0} https://example.com/r{0}.git".format(x),
+                                    workingdir=self.cache)
+        config = Omnicache.OmniCacheConfig(os.path.join(self.cache, Omnicache.OMNICACHE_FILENAME))
+        os.chdir(self.cache)
+        try:
+            with mock.patch.object(config, "Save", wraps=config.Save) as save:
+                self.assertEqual(Omnicache.ConsistencyCheckCacheConfig(config), 0)
+                self.assertEqual(save.call_count, 1)
+        finally:
+            os.chdir(current_dir)
+        self.assertEqual(len(Omnicache.OmniCacheConfig(config.filepath).remotes), 3)
+
+    def test_concurrent_processes_add_entries(self):
+        package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = package_root + os.pathsep + env.get("PYTHONPATH", "")
+        script = "import sys; from MuEnvironment import Omnicache; sys.exit(Omnicache.main())"
+        processes = []
+        for x in range(6):
+            cmd = [sys.executable, "-c", script, "-a", "r{0}".format(x), "https://example.com/r{0}.git".format(x),
+                   "--no-fetch", self.cache]
+            processes.append(subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for process in processes:
+            self.assertEqual(process.wait(), 0)
+
+        config = Omnicache.OmniCacheConfig(os.path.join(self.cache, Omnicache.OMNICACHE_FILENAME))
+        self.assertEqual(sorted(config.remotes.keys()), ["r{0}".format(x) for x in range(6)])
+        self.assertEqual(len(get_git_remotes(self.cache)), 6)
+
+
+def make_local_upstream(folder):
+    os.makedirs(folder)
+    with open(os.path.join(folder, "readme.txt"), "w") as readme:
+        readme.write(os.path.basename(folder))
+    UtilityFunctions.RunCmd("git", "init", workingdir=folder)
+    UtilityFunctions.RunCmd("git", "add readme.txt", workingdir=folder)
+    UtilityFunctions.RunCmd("git", "-c user.name=test -c user.email=test@example.com commit -m initial",
+                            workingdir=folder)
+
+
+def get_refs(cache, pattern):
+    out = StringIO()
+    UtilityFunctions.RunCmd("git", 'for-each-ref "--format=%(refname)" ' + pattern, workingdir=cache, outstream=out)
+    return [x.strip() for x in out.getvalue().splitlines() if x.strip()]
+
+
+class TestOmniCacheFetch(unittest.TestCase):
+    def setUp(self):
+        prep_workspace()
+        self.cache = os.path.join(test_dir, "testcache")
+        Omnicache.InitOmnicache(self.cache)
+        self.config = Omnicache.OmniCacheConfig(os.path.join(self.cache, Omnicache.OMNICACHE_FILENAME))
+        os.chdir(self.cache)
+
+    def tearDown(self):
+        os.chdir(current_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        clean_workspace()
+
+    def test_fetch_entries_parallel(self):
+        names = ["upstream{0}".format(x) for x in range(4)]
+        for name in names:
+            make_local_upstream(os.path.join(test_dir, name))
+            Omnicache.AddEntry(self.config, name, os.path.join(test_dir, name))
+
+        results = Omnicache.FetchEntries(self.config, names, jobs=3)
+        self.assertEqual([r.name for r in results], names)
+        for result in results:
+            self.assertEqual(result.returncode, 0)
+            self.assertEqual(result.attempts, 1)
+            self.assertEqual(len(get_refs(self.cache, "refs/remotes/" + result.name)), 1)
+        Omnicache.LogFetchSummary(results)
+
+    def test_fetch_entries_retry(self):
+        make_local_upstream(os.path.join(test_dir, "good"))
+        Omnicache.AddEntry(self.config, "good", os.path.join(test_dir, "good"))
+        Omnicache.AddEntry(self.config, "bad", os.path.join(test_dir, "does_not_exist"))
+
+        with self.assertLogs(level=logging.ERROR) as logs:
+            results = Omnicache.FetchEntries(self.config, ["bad", "good"], jobs=2, retries=2, backoff=0)
+        # the log says why it failed
+        self.assertTrue(any("[bad]" in line and "does_not_exist" in line for line in logs.output))
+        self.assertNotEqual(results[0].returncode, 0)
+        self.assertEqual(results[0].attempts, 3)
+        self.assertFalse(results[0].timed_out)
+        self.assertEqual(results[1].returncode, 0)
+        self.assertEqual(results[1].attempts, 1)
+
+    def test_timeout_doesnt_wait_for_grandchildren(self):
+        # the grandchild keeps the output pipe open after the child is killed
+        script = ("import subprocess, sys, time\n"
+                  "subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(20)'])\n"
+                  "print('started', flush=True)\n"
+                  "time.sleep(20)\n")
+        start = time.time()
+        (returncode, out, err) = Omnicache._RunWithTimeout([sys.executable, "-c", script], 1,
+                                                           stderr=subprocess.STDOUT)
+        self.assertIsNone(returncode)
+        self.assertLess(time.time() - start, 10)
+
+    def test_scan_uses_jobs(self):
+        root = logging.getLogger('')
+        (handlers, level) = (list(root.handlers), root.level)
+        for (args, jobs) in [([], 8), (["-j", "3"], 3)]:
+            argv = ["omnicache", "--scan", test_dir, "--no-fetch"] + args + [self.cache]
+            try:
+                with mock.patch.object(sys, "argv", argv), \
+                        mock.patch("MuEnvironment.Omnicache.ScanForRepos", return_value={}) as scan:
+                    self.assertEqual(Omnicache.main(), 0)
+            finally:
+                # main adds a console handler
+                root.handlers = list(handlers)
+                root.setLevel(level)
+            scan.assert_called_once_with(test_dir, jobs)
+
+    def test_incremental_only_changed_entries(self):
+        names = ["upstream{0}".format(x) for x in range(3)]
+        for name in names:
+            make_local_upstream(os.path.join(test_dir, name))
+            Omnicache.AddEntry(self.config, name, os.path.join(test_dir, name))
+        refstate = Omnicache.OmniCacheRefState(os.path.join(self.cache, Omnicache.OMNICACHE_REFSTATE_FILENAME))
+
+        # nothing recorded yet so everything is changed
+        (changed, digests) = Omnicache.GetChangedEntries(self.config, refstate, names, jobs=3)
+        self.assertEqual(changed, names)
+        for name in names:
+            self.assertIsNotNone(digests[name])
+            refstate.Set(name, self.config.remotes[name]["url"], digests[name])
+        refstate.Save(self.config)
+
+        # reload and commit to a single upstream
+        refstate = Omnicache.OmniCacheRefState(os.path.join(self.cache, Omnicache.OMNICACHE_REFSTATE_FILENAME))
+        UtilityFunctions.RunCmd("git", "-c user.name=test -c user.email=test@example.com commit --allow-empty -m 2",
+                                workingdir=os.path.join(test_dir, "upstream1"))
+        (changed, digests) = Omnicache.GetChangedEntries(self.config, refstate, names, jobs=3)
+        self.assertEqual(changed, ["upstream1"])
+
+        # a changed url invalidates the recorded state
+        digest = refstate.Get("upstream0", os.path.join(test_dir, "upstream0"))
+        self.assertIsNotNone(digest)
+        refstate.Set("upstream0", "https://example.com/other.git", digest)
+        (changed, digests) = Omnicache.GetChangedEntries(self.config, refstate, names, jobs=3)
+        self.assertEqual(changed, ["upstream0", "upstream1"])
+
+    def test_incremental_unreachable_entry_is_changed(self):
+        Omnicache.AddEntry(self.config, "bad", os.path.join(test_dir, "does_not_exist"))
+        refstate = Omnicache.OmniCacheRefState(os.path.join(self.cache, Omnicache.OMNICACHE_REFSTATE_FILENAME))
+        (changed, digests) = Omnicache.GetChangedEntries(self.config, refstate, ["bad"])
+        self.assertEqual(changed, ["bad"])
+        self.assertIsNone(digests["bad"])
+
+    def test_refstate_save_drops_removed_entries(self):
+        self.config.Add("keep", "https://example.com/keep.git")
+        refstate_file = os.path.join(self.cache, Omnicache.OMNICACHE_REFSTATE_FILENAME)
+        refstate = Omnicache.OmniCacheRefState(refstate_file)
+        refstate.Set("keep", "https://example.com/keep.git", "1234")
+        refstate.Set("gone", "https://example.com/gone.git", "5678")
+        refstate.Save(self.config)
+        refstate = Omnicache.OmniCacheRefState(refstate_file)
+        self.assertEqual(refstate.Get("keep", "https://example.com/keep.git"), "1234")
+        self.assertIsNone(refstate.Get("gone", "https://example.com/gone.git"))
+
+    def test_maintain_cache(self):
+        commits = {}
+        for name in ["keep", "removed"]:
+            upstream = os.path.join(test_dir, name)
+            make_local_upstream(upstream)
+            out = StringIO()
+            UtilityFunctions.RunCmd("git", "rev-parse HEAD", workingdir=upstream, outstream=out)
+            commits[name] = out.getvalue().strip()
+            Omnicache.AddEntry(self.config, name, upstream)
+        # keep fetched objects in packs like a fetch of a real repo would
+        UtilityFunctions.RunCmd("git", "config fetch.unpackLimit 1", workingdir=self.cache)
+        for result in Omnicache.FetchEntries(self.config, ["keep", "removed"]):
+            self.assertEqual(result.returncode, 0)
+        # remove the remote from git and the config but leave its refs behind
+        UtilityFunctions.RunCmd("git", "config --remove-section remote.removed", workingdir=self.cache)
+        self.config.Remove("removed")
+        self.config.Save()
+
+        (ret, before, after) = Omnicache.MaintainCache(self.config, expire="now", full_repack=True)
+        self.assertEqual(ret, 0)
+        self.assertEqual(before["packs"], 2)
+        self.assertEqual(after["packs"], 1)
+        self.assertEqual(after["count"], 0)
+        self.assertEqual(len(get_refs(self.cache, "refs/remotes/keep")), 1)
+        self.assertEqual(get_refs(self.cache, "refs/remotes/removed"), [])
+        self.assertEqual(UtilityFunctions.RunCmd("git", "cat-file -e " + commits["keep"]), 0)
+        self.assertNotEqual(UtilityFunctions.RunCmd("git", "cat-file -e " + commits["removed"]), 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.cache, "objects", "pack", "multi-pack-index")))
+        self.assertTrue(os.path.isdir(os.path.join(self.cache, "objects", "info", "commit-graphs")))
+        Omnicache.LogMaintenanceSummary(before, after)
+
+        seconds = Omnicache.BenchmarkClone(self.cache, os.path.join(test_dir, "keep"))
+        self.assertIsNotNone(seconds)
+
+    def test_maintenance_steps_repack_in_batches(self):
+        pack_dir = os.path.join(self.cache, "objects", "pack")
+        self.assertEqual(Omnicache.GetRepackBatchSize(pack_dir), 1)
+        for (name, size) in [("a", 100), ("b", 30), ("c", 50)]:
+            with open(os.path.join(pack_dir, "pack-{0}.pack".format(name)), "wb") as f:
+                f.write(b"x" * size)
+        self.assertEqual(Omnicache.GetRepackBatchSize(pack_dir), 51)
+        # the default batch size comes from the packs of the cache in the current directory
+        self.assertEqual(Omnicache.GetMaintenanceSteps("now"),
+                         ["prune --expire=now",
+                          "multi-pack-index write",
+                          "multi-pack-index expire",
+                          "multi-pack-index repack --batch-size=51",
+                          "commit-graph write --reachable --split"])
+        self.assertEqual(Omnicache.GetMaintenanceSteps(full_repack=True, batch_size=1024),
+                         ["repack -A -d",
+                          "prune --expire=2.weeks.ago",
+                          "multi-pack-index write",
+                          "multi-pack-index expire",
+                          "multi-pack-index repack --batch-size=1024",
+                          "commit-graph write --reachable --split"])
+
+    def test_maintain_cache_keeps_remotes_added_by_others(self):
+        make_local_upstream(os.path.join(test_dir, "up"))
+        self.config.Save()
+        # another process adds and fetches a remote after this config was loaded
+        other = Omnicache.OmniCacheConfig(self.config.filepath)
+        Omnicache.AddEntry(other, "up", os.path.join(test_dir, "up"))
+        other.Save()
+        self.assertEqual(Omnicache.FetchEntry("up"), 0)
+
+        (ret, before, after) = Omnicache.MaintainCache(self.config)
+        self.assertEqual(len(get_refs(self.cache, "refs/remotes/up")), 1)
+
+    def test_prune_stale_refs_with_slash_in_name(self):
+        make_local_upstream(os.path.join(test_dir, "up"))
+        Omnicache.AddEntry(self.config, "platform/Common/MU", os.path.join(test_dir, "up"))
+        self.assertEqual(Omnicache.FetchEntry("platform/Common/MU"), 0)
+        self.assertEqual(Omnicache.PruneStaleRefs(self.config), 0)
+        # the ref could be the Common/MU/<branch> branch of a remote named platform
+        self.config.Remove("platform/Common/MU")
+        self.config.Add("platform", os.path.join(test_dir, "other"))
+        self.assertEqual(Omnicache.PruneStaleRefs(self.config), 0)
+        self.config.Remove("platform")
+        self.assertEqual(Omnicache.PruneStaleRefs(self.config), 1)
+        self.assertEqual(get_refs(self.cache, "refs/remotes/"), [])
+
+    def test_serve_views(self):
+        upstream = os.path.join(test_dir, "up")
+        make_local_upstream(upstream)
+        UtilityFunctions.RunCmd("git", "-c user.name=test -c user.email=test@example.com tag -a v1 -m v1",
+                                workingdir=upstream)
+        UtilityFunctions.RunCmd("git", "branch feature", workingdir=upstream)
+        Omnicache.AddEntry(self.config, "up", upstream, True)
+        Omnicache.AddEntry(self.config, "other", os.path.join(test_dir, "other"))
+        self.assertEqual(Omnicache.FetchEntry("up", True), 0)
+        self.config.Save()
+        self.assertIsNone(Omnicache.GetServeUrl(self.cache, upstream))
+        self.assertEqual(Omnicache.UpdateServeViews(self.config, self.cache), 0)
+
+        serve_url = Omnicache.GetServeUrl(self.cache, upstream + "/")
+        self.assertTrue(serve_url.startswith("file://"))
+        self.assertEqual(Omnicache.GetServeUrl(self.cache, upstream, "git://localhost"), "git://localhost/up.git")
+        self.assertIsNone(Omnicache.GetServeUrl(self.cache, "https://example.com/not_cached.git"))
+
+        # the view looks like the upstream repo
+        clone = os.path.join(test_dir, "clone")
+        self.assertEqual(UtilityFunctions.RunCmd("git", "clone {0} {1}".format(serve_url, clone)), 0)
+        self.assertEqual(len(get_refs(clone, "refs/remotes/origin/feature")), 1)
+        self.assertEqual(get_refs(clone, "refs/tags"), ["refs/tags/v1"])
+        self.assertTrue(os.path.isfile(os.path.join(clone, "readme.txt")))
+        # and has no objects of its own
+        view = os.path.join(self.cache, Omnicache.OMNICACHE_SERVE_DIRNAME, "up.git")
+        self.assertEqual(os.listdir(os.path.join(view, "objects", "pack")), [])
+
+        # views of removed remotes are removed
+        Omnicache.RemoveEntry(self.config, "up")
+        self.assertEqual(Omnicache.UpdateServeViews(self.config, self.cache), 0)
+        self.assertEqual(os.listdir(os.path.join(self.cache, Omnicache.OMNICACHE_SERVE_DIRNAME)), ["other.git"])
+
+    def test_fetch_tags_namespaced_per_remote(self):
+        commits = {}
+        for name in ["a", "b"]:
+            upstream = os.path.join(test_dir, name)
+            make_local_upstream(upstream)
+            # same tag name on different commits
+            UtilityFunctions.RunCmd("git", "-c user.name=test -c user.email=test@example.com tag -a v1 -m " + name,
+                                    workingdir=upstream)
+            out = StringIO()
+            UtilityFunctions.RunCmd("git", "rev-parse v1^{commit}", workingdir=upstream, outstream=out)
+            commits[name] = out.getvalue().strip()
+            Omnicache.AddEntry(self.config, name, upstream, True)
+        make_local_upstream(os.path.join(test_dir, "notags"))
+        UtilityFunctions.RunCmd("git", "tag v2", workingdir=os.path.join(test_dir, "notags"))
+        Omnicache.AddEntry(self.config, "notags", os.path.join(test_dir, "notags"))
+
+        for result in Omnicache.FetchEntries(self.config, ["a", "b", "notags"], jobs=3):
+            self.assertEqual(result.returncode, 0)
+        # fetching again doesn't fail on the conflicting tags
+        self.assertEqual(Omnicache.FetchEntry("a", True), 0)
+        self.assertEqual(Omnicache.FetchEntry("b", True), 0)
+
+        self.assertEqual(get_refs(self.cache, "refs/tags"), [])
+        self.assertEqual(get_refs(self.cache, "refs/rtags"), ["refs/rtags/a/v1", "refs/rtags/b/v1"])
+        for name in ["a", "b"]:
+            out = StringIO()
+            UtilityFunctions.RunCmd("git", "rev-parse refs/rtags/{0}/v1^{{commit}}".format(name), outstream=out)
+            self.assertEqual(out.getvalue().strip(), commits[name])
+
+    def test_migrate_config_version_1(self):
+        make_local_upstream(os.path.join(test_dir, "up"))
+        UtilityFunctions.RunCmd("git", "tag v1", workingdir=os.path.join(test_dir, "up"))
+        UtilityFunctions.RunCmd("git", "remote add up " + os.path.join(test_dir, "up"))
+        # version 1 fetched tags into the shared refs/tags
+        UtilityFunctions.RunCmd("git", "fetch up --tags")
+        self.assertEqual(get_refs(self.cache, "refs/tags"), ["refs/tags/v1"])
+        with open(self.config.filepath, "w") as configyaml:
+            configyaml.write("version: 1\nlast_change: Monday\nremotes:\n")
+            configyaml.write("- name: up\n  url: {0}\n  tag: true\n".format(os.path.join(test_dir, "up")))
+
+        # read only users don't migrate it
+        config = Omnicache.OmniCacheConfig(self.config.filepath)
+        self.assertEqual(config.version, 1)
+        self.assertTrue(config.Contains_url(os.path.join(test_dir, "up")))
+        self.assertEqual(get_refs(self.cache, "refs/tags"), ["refs/tags/v1"])
+        with open(self.config.filepath) as configyaml:
+            self.assertIn("version: 1", configyaml.read())
+
+        config = Omnicache.OmniCacheConfig(self.config.filepath, migrate=True)
+        self.assertEqual(config.version, 2)
+        self.assertTrue(config.Contains_url(os.path.join(test_dir, "up")))
+        self.assertIn("tag", config.remotes["up"])
+        self.assertEqual(get_refs(self.cache, "refs/tags"), [])
+        # saved as the new version
+        self.assertEqual(Omnicache.OmniCacheConfig(self.config.filepath).version, 2)
+        with open(self.config.filepath) as configyaml:
+            self.assertIn("version: 2", configyaml.read())
+
+        self.assertEqual(Omnicache.FetchEntry("up", True), 0)
+        self.assertEqual(get_refs(self.cache, "refs/rtags/up"), ["refs/rtags/up/v1"])
+
+    def test_parse_fetch_bytes(self):
+        output = ("Receiving objects:  50% (1/2), 1.00 MiB | 1.00 MiB/s\r"
+                  "Receiving objects: 100% (2/2), 2.50 MiB | 1.25 MiB/s, done.\n"
+                  "Resolving deltas: 100% (1/1), done.\n")
+        self.assertEqual(Omnicache.ParseFetchBytes(output), int(2.5 * 1024 * 1024))
+        self.assertEqual(Omnicache.ParseFetchBytes("Receiving objects: 100% (3/3), 250 bytes | 250.00 KiB/s, done."),
+                         250)
+        self.assertEqual(Omnicache.ParseFetchBytes("Receiving objects: 100% (3/3), done."), 0)
+        self.assertEqual(Omnicache.ParseFetchBytes(""), 0)
+
+
 if __name__ == '__main__':
     unittest.main()